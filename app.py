@@ -2,41 +2,394 @@ import os
 import re
 import io
 import json
+import math
+import mmap
+import logging
+import hashlib
+import time
+import asyncio
+import queue
+import threading
 import unicodedata
+import multiprocessing
+import zipfile
+import tempfile
+from functools import lru_cache
+
+# início da importação deste módulo (tempo de arranque, ver /ready)
+_import_started = time.perf_counter()
+
 import fitz  # PyMuPDF
 import cv2
 import numpy as np
-import pytesseract
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query, Request
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from pydantic import BaseModel
-from typing import Optional, List, Tuple, Dict, Any
-
-# LangChain + Groq
-from langchain_groq import ChatGroq
-from langchain_core.output_parsers import JsonOutputParser
+from typing import Optional, List, Tuple, Dict, Any, Callable, Awaitable, Iterator, AsyncIterator, TYPE_CHECKING
+
+import ocr_engine
+import layout
+import metrics
+import tracing
+import image_io
+import totals
+from reconcile import ITEM_KEYS, first_present, item_columns, reconcile_items
+from jobs import JobStore
+from supplier_templates import TemplateRegistry
+from cache import DiskCache, AsyncMemo, sha256_hex, config_fingerprint
+
+# LangChain + Groq: importados no primeiro uso (get_llm / get_parser) ou no prewarm,
+# não no import deste módulo (que também corre em cada processo do pool de OCR)
+if TYPE_CHECKING:
+    from langchain_groq import ChatGroq
+    from langchain_core.output_parsers import JsonOutputParser
 
 # =========================
 # Config / Inicialização
 # =========================
 load_dotenv()
 
-TESSERACT_CMD = os.getenv("TESSERACT_CMD")
-if TESSERACT_CMD:
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
-
 OCR_DPI = int(os.getenv("OCR_DPI", "200"))
 OCR_THREADS = int(os.getenv("OCR_THREADS", str(max(2, (os.cpu_count() or 4) // 2))))
 OCR_LANGS = os.getenv("OCR_LANGS", "por+eng")
 OCR_PSM = os.getenv("OCR_PSM", "6")
+# Máximo de imagens de página em memória (a aguardar ou em OCR) por documento
+OCR_MAX_PAGES_IN_FLIGHT = int(os.getenv("OCR_MAX_PAGES_IN_FLIGHT", str(OCR_THREADS * 2)))
+# Orçamento de memória das imagens de página por documento: limita quantas páginas
+# rasterizadas existem ao mesmo tempo (além de OCR_MAX_PAGES_IN_FLIGHT) e baixa o DPI
+# de uma página que sozinha não caiba. Estimativa: OCR_BYTES_PER_PIXEL bytes por pixel
+# (página em cinzento + binarizada + cópias internas do Tesseract).
+OCR_MEMORY_BUDGET_MB = int(os.getenv("OCR_MEMORY_BUDGET_MB", "512"))
+OCR_BYTES_PER_PIXEL = int(os.getenv("OCR_BYTES_PER_PIXEL", "4"))
+# OCR adaptativo: 1.ª passagem a DPI baixo; páginas com confiança fraca são
+# re-rasterizadas a DPI alto. A confiança é a do Tesseract por palavra (0-100).
+OCR_ADAPTIVE = os.getenv("OCR_ADAPTIVE", "0") == "1"
+OCR_ADAPTIVE_DPI_LOW = int(os.getenv("OCR_ADAPTIVE_DPI_LOW", "150"))
+OCR_ADAPTIVE_DPI_HIGH = int(os.getenv("OCR_ADAPTIVE_DPI_HIGH", "300"))
+OCR_ADAPTIVE_MIN_CONF = float(os.getenv("OCR_ADAPTIVE_MIN_CONF", "80"))
+OCR_ADAPTIVE_WORD_CONF = float(os.getenv("OCR_ADAPTIVE_WORD_CONF", "60"))
+OCR_ADAPTIVE_MAX_LOW_RATIO = float(os.getenv("OCR_ADAPTIVE_MAX_LOW_RATIO", "0.15"))
+# OCR por regiões: recorta margens, separa cabeçalho / tabela / rodapé e aplica a
+# cada zona a config adequada (passagem extra só com dígitos no rodapé dos totais).
+OCR_ROI = os.getenv("OCR_ROI", "0") == "1"
+OCR_ROI_NUMERIC_WHITELIST = os.getenv("OCR_ROI_NUMERIC_WHITELIST", "0123456789.,%-")
+# Filtro pré-OCR (página binarizada à resolução do OCR): páginas em branco e folhas
+# separadoras não passam pelo Tesseract. Páginas repetidas (a mesma página, ou digitalizada
+# de novo, a até OCR_DUP_MAX_HAMMING bits por linha de uma anterior, ver layout.page_hash)
+# só são ignoradas com OCR_SKIP_DUPLICATES=1.
+OCR_SKIP_BLANK = os.getenv("OCR_SKIP_BLANK", "1") == "1"
+OCR_BLANK_MAX_INK = float(os.getenv("OCR_BLANK_MAX_INK", "0.00005"))
+OCR_SEPARATOR_MAX_COMPONENTS = int(os.getenv("OCR_SEPARATOR_MAX_COMPONENTS", "12"))
+OCR_SKIP_DUPLICATES = os.getenv("OCR_SKIP_DUPLICATES", "0") == "1"
+OCR_DUP_MAX_HAMMING = float(os.getenv("OCR_DUP_MAX_HAMMING", "12"))
+# Páginas híbridas: numa página com texto embutido, as zonas de imagem sem camada de
+# texto por cima (carimbos, anexos digitalizados) são rasterizadas e lidas por OCR.
+OCR_HYBRID = os.getenv("OCR_HYBRID", "1") == "1"
+OCR_HYBRID_MIN_AREA_RATIO = float(os.getenv("OCR_HYBRID_MIN_AREA_RATIO", "0.01"))
+OCR_HYBRID_BAND_PT = float(os.getenv("OCR_HYBRID_BAND_PT", "12"))
 LLM_MODEL = os.getenv("GROQ_LLM_MODEL", "llama3-70b-8192")
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0"))
+# Outro endpoint compatível com a API do Groq (ex.: benchmarks/fake_groq.py nos testes de carga)
+GROQ_API_BASE = os.getenv("GROQ_API_BASE") or None
 MAX_CHARS_TO_LLM = int(os.getenv("MAX_CHARS_TO_LLM", "120000"))
+# Extração em blocos: só para textos que passariam de MAX_CHARS_TO_LLM (e seriam truncados);
+# o cabeçalho/rodapé é pedido numa chamada e os itens de cada bloco de LLM_CHUNK_CHARS
+# (páginas/linhas) em chamadas concorrentes. Abaixo disso mantém-se a chamada única.
+LLM_CHUNKING = os.getenv("LLM_CHUNKING", "1") == "1"
+LLM_CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", "12000"))
+LLM_CHUNK_OVERLAP_CHARS = int(os.getenv("LLM_CHUNK_OVERLAP_CHARS", "400"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Pool de processos para as etapas de CPU (render, binarização, Tesseract).
+# Cada processo ainda usa OCR_THREADS threads para o Tesseract, por isso o
+# padrão divide os núcleos disponíveis entre os dois níveis.
+OCR_PROCESSES = int(os.getenv("OCR_PROCESSES", str(max(1, (os.cpu_count() or 4) // OCR_THREADS))))
+
+# Controlo de admissão: documentos em processamento simultâneo + fila de espera.
+# Acima disso o /ocr responde 503 com Retry-After em vez de acumular pedidos.
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", str(OCR_PROCESSES * 2)))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "16"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+# Arranque: o lifespan aquece em segundo plano os processos do pool (import + Tesseract em
+# cada thread de OCR) e o cliente do LLM (import do LangChain/Groq + ligação HTTP com um
+# GET /models, que não gasta tokens). /ready responde 503 até isso terminar.
+PREWARM = os.getenv("PREWARM", "1") == "1"
+PREWARM_LLM_PING = os.getenv("PREWARM_LLM_PING", "1") == "1"
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "180"))
+
+# Uploads: copiados em blocos para um ficheiro temporário (nunca inteiros em memória) e
+# abertos pelo caminho; acima de UPLOAD_MAX_MB o pedido é recusado com 413 durante a cópia.
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "512"))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+# Jobs assíncronos (POST /jobs): fila SQLite local drenada por JOBS_WORKERS tarefas
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOBS_DIR = os.getenv("JOBS_DIR", "job_uploads")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", str(OCR_PROCESSES)))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# Cada processo renova a concessão dos seus jobs a cada JOBS_LEASE_SECONDS / 3; um job
+# só volta à fila (noutro worker) quando a concessão expira, isto é, o processo morreu.
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "60"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1.0"))
+
+# Lotes (POST /ocr/batch): vários ficheiros e/ou ZIP num só pedido. As páginas de todos os
+# documentos são repartidas em tarefas de BATCH_PAGES_PER_TASK páginas, intercaladas entre
+# documentos, para que um documento grande ou lento não atrase os restantes.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_TOTAL_MB = int(os.getenv("BATCH_MAX_TOTAL_MB", "1024"))
+BATCH_PAGES_PER_TASK = int(os.getenv("BATCH_PAGES_PER_TASK", "4"))
+BATCH_MAX_TASKS_IN_FLIGHT = int(os.getenv("BATCH_MAX_TASKS_IN_FLIGHT", str(OCR_PROCESSES * 2)))
+
+# Formatos com páginas (abertos pelo PyMuPDF e lidos página a página) e imagens simples
+PAGED_EXTENSIONS = (".pdf", ".tif", ".tiff")
+SUPPORTED_EXTENSIONS = PAGED_EXTENSIONS + (".png", ".jpg", ".jpeg")
+
+# Imagens grandes (fotografias, digitalizações A0): reduzidas na descodificação para
+# IMAGE_TARGET_DPI (nunca ampliadas) e no máximo IMAGE_MAX_MEGAPIXELS; acima de IMAGE_TILE_PX
+# de altura, o OCR corre em faixas sobrepostas em paralelo. O mesmo limite de pixels vale
+# para as páginas rasterizadas de PDF/TIFF.
+IMAGE_TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", str(OCR_DPI)))
+IMAGE_MAX_MEGAPIXELS = float(os.getenv("IMAGE_MAX_MEGAPIXELS", "60"))
+IMAGE_TILE_PX = int(os.getenv("IMAGE_TILE_PX", "3000"))
+IMAGE_TILE_OVERLAP_PX = int(os.getenv("IMAGE_TILE_OVERLAP_PX", "120"))
+
+# Cache de resultados por documento (SHA-256 do ficheiro + configuração efetiva)
+DOC_CACHE_ENABLED = os.getenv("DOC_CACHE_ENABLED", "1") == "1"
+DOC_CACHE_DB = os.getenv("DOC_CACHE_DB", "cache_documentos.db")
+DOC_CACHE_MAX_MB = int(os.getenv("DOC_CACHE_MAX_MB", "512"))
+DOC_CACHE_TTL_SECONDS = float(os.getenv("DOC_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Cache de OCR por página (hash dos pixels binarizados + configuração do Tesseract).
+# Partilhado pelos processos do pool: só páginas novas/alteradas passam pelo Tesseract.
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+PAGE_CACHE_DB = os.getenv("PAGE_CACHE_DB", "cache_paginas.db")
+PAGE_CACHE_MAX_MB = int(os.getenv("PAGE_CACHE_MAX_MB", "256"))
+PAGE_CACHE_TTL_SECONDS = float(os.getenv("PAGE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Memo das respostas do LLM (hash do prompt final + modelo/temperatura), por processo
+LLM_MEMO_MAX_ENTRIES = int(os.getenv("LLM_MEMO_MAX_ENTRIES", "1024"))
+
+# Templates por fornecedor: documentos de layouts conhecidos são extraídos sem LLM
+TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "1") == "1"
+TEMPLATES_AUTO_LEARN = os.getenv("TEMPLATES_AUTO_LEARN", "1") == "1"
+TEMPLATES_DB = os.getenv("TEMPLATES_DB", "templates_fornecedores.db")
+TEMPLATES_TOLERANCE = float(os.getenv("TEMPLATES_TOLERANCE", "0.005"))
+
+# Logs (JSON por linha, com o request id) e exportação de spans por pedido (ver tracing.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ocr-api")
+
+# Incrementar sempre que build_prompt_for_llm ou o pós-processamento mudarem,
+# para não servir do cache resultados produzidos pela versão anterior.
+PROMPT_VERSION = "1"
 
 TESSERACT_CONFIG = rf'--oem 3 --psm {OCR_PSM} -l {OCR_LANGS}'
+TESSERACT_CONFIG_TABLE = rf'--oem 3 --psm 6 -l {OCR_LANGS}'
+TESSERACT_CONFIG_NUMERIC = rf'--oem 3 --psm 6 -l {OCR_LANGS} -c tessedit_char_whitelist={OCR_ROI_NUMERIC_WHITELIST}'
+
+tracing.configure_logging(LOG_LEVEL, LOG_FORMAT)
+tracing.configure_tracer(TRACE_EXPORTER, TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME)
+log = logging.getLogger("ocr")
+
+doc_cache = DiskCache(DOC_CACHE_DB, DOC_CACHE_MAX_MB * 1024 * 1024, DOC_CACHE_TTL_SECONDS)
+page_cache = DiskCache(PAGE_CACHE_DB, PAGE_CACHE_MAX_MB * 1024 * 1024, PAGE_CACHE_TTL_SECONDS)
+llm_memo = AsyncMemo(LLM_MEMO_MAX_ENTRIES)
+
+job_store = JobStore(JOBS_DB, JOBS_DIR, max_attempts=JOBS_MAX_ATTEMPTS, lease_seconds=JOBS_LEASE_SECONDS)
+JOB_OWNER = f"{os.getpid()}-{os.urandom(4).hex()}"  # este processo, nas concessões de jobs
+
+# =========================
+# Métricas (GET /metrics)
+# =========================
+metrics_registry = metrics.Registry()
+STAGE_SECONDS = metrics_registry.histogram(
+    "ocr_stage_seconds", "Duração de cada etapa do pipeline (render/preprocess/ocr por página).", ("stage",))
+PAGES_TOTAL = metrics_registry.counter(
+    "ocr_pages_total", "Páginas processadas por origem do texto (ocr, texto, hibrida, ignorada).", ("source",))
+DOC_CACHE_LOOKUPS = metrics_registry.counter(
+    "ocr_document_cache_lookups_total", "Consultas ao cache de documentos.", ("result",))
+LLM_REQUESTS = metrics_registry.counter(
+    "ocr_llm_requests_total", "Chamadas ao LLM (sem contar respostas memorizadas).", ("result",))
+LLM_CALLS = metrics_registry.gauge(
+    "ocr_llm_calls", "Chamadas ao LLM em curso e à espera de slot (LLM_MAX_CONCURRENCY).", ("state",))
+CPU_TASKS = metrics_registry.gauge(
+    "ocr_cpu_pool_tasks", "Tarefas enviadas ao pool de processos ainda não concluídas (em fila + a correr).")
+
+def _cache_stats_gauge() -> Dict[Tuple[str, ...], float]:
+    out: Dict[Tuple[str, ...], float] = {}
+    for name, cache in (("documentos", doc_cache), ("paginas", page_cache)):
+        stats = cache.stats()
+        for event in ("hits", "misses", "sets", "evictions", "expirations", "entries"):
+            out[(name, event)] = stats.get(event, 0)
+    stats = llm_memo.stats()
+    for event in ("hits", "misses", "coalesced", "errors", "entries"):
+        out[("llm", event)] = stats[event]
+    return out
+
+def _admission_gauge() -> Dict[Tuple[str, ...], float]:
+    return {("inflight",): admission.inflight, ("waiting",): admission.waiting, ("rejected",): admission.rejected}
+
+def _jobs_gauge() -> Dict[Tuple[str, ...], float]:
+    return {(status,): n for status, n in job_store.counts().items()}
+
+metrics_registry.gauge("ocr_cache_events", "Contadores dos caches (partilhados entre processos).",
+                       ("cache", "event"), collect=_cache_stats_gauge)
+metrics_registry.gauge("ocr_admission", "Documentos em processamento, à espera e rejeitados (503).",
+                       ("state",), collect=_admission_gauge)
+metrics_registry.gauge("ocr_jobs", "Jobs na fila persistente por estado.", ("status",), collect=_jobs_gauge)
+
+def observe_document(document: Dict[str, Any]) -> None:
+    """
+    Regista as páginas e os tempos por página que vieram do pool de processos, nas
+    métricas e no trace do pedido (um span "pagina" com render/preprocess/ocr dentro).
+    """
+    for page in document["pages"]:
+        PAGES_TOTAL.inc(source=page["source"])
+        for stage, seconds in page.get("timings", {}).items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+    for page, spans in document.get("spans", {}).items():
+        start = min(st for _, st, _ in spans)
+        end = max(st + d for _, st, d in spans)
+        parent = tracing.add_span("pagina", start, end - start, page=page)
+        for stage, st, d in spans:
+            tracing.add_span(stage, st, d, parent=parent)
+
+
+# =========================
+# Arranque: prewarm e prontidão
+# =========================
+startup: Dict[str, Any] = {"import_seconds": None, "prewarm_seconds": None, "ready": False, "components": {}}
 
-app = FastAPI(title="OCR + Extração Estruturada Turbo", version="1.1.0")
+def _startup_gauge() -> Dict[Tuple[str, ...], float]:
+    return {(phase,): startup[f"{phase}_seconds"] for phase in ("import", "prewarm")
+            if startup[f"{phase}_seconds"] is not None}
+
+metrics_registry.gauge("ocr_startup_seconds", "Duração do import do módulo e do prewarm.", ("phase",),
+                       collect=_startup_gauge)
+
+def warmup_ocr_process() -> Tuple[int, str]:
+    """
+    Corre num processo do pool (a 1.ª tarefa paga o import deste módulo): um OCR pequeno
+    em cada thread de OCR, que fica com o seu handle do Tesseract já inicializado.
+    Devolve (pid, backend de OCR em uso nesse processo).
+    """
+    barrier = threading.Barrier(OCR_THREADS)
+
+    def warm(_: int) -> str:
+        backend = ocr_engine.warmup(TESSERACT_CONFIG)
+        try:
+            barrier.wait(timeout=30)  # uma tarefa por thread
+        except threading.BrokenBarrierError:
+            pass
+        return backend
+
+    list(get_ocr_executor().map(warm, range(OCR_THREADS)))
+    return os.getpid(), ocr_engine.backend_name()
+
+async def prewarm_ocr_pool() -> Dict[str, Any]:
+    """
+    Arranca os OCR_PROCESSES processos do pool. Cada tarefa vai para o processo livre que a
+    apanhar primeiro: repete-se até todos terem corrido uma.
+    """
+    loop = asyncio.get_running_loop()
+    backends: Dict[int, str] = {}
+    while len(backends) < OCR_PROCESSES:
+        pool = get_cpu_pool()
+        backends.update(await asyncio.gather(*(loop.run_in_executor(pool, warmup_ocr_process)
+                                               for _ in range(OCR_PROCESSES - len(backends)))))
+        await asyncio.sleep(0.05)
+    backend = ",".join(sorted(set(backends.values())))
+    if backend != "tesserocr":
+        log.warning("OCR sem tesserocr nos processos do pool", extra={"ocr_backend": backend})
+    return {"processes": len(backends), "threads": OCR_THREADS, "backend": backend}
+
+async def prewarm_llm() -> Dict[str, Any]:
+    """
+    Cria o cliente do LLM e os parsers. Com PREWARM_LLM_PING, abre já a ligação (TLS) do
+    pool HTTP do cliente assíncrono; uma falha aqui só fica registada (o Groq pode estar
+    indisponível sem que a instância deixe de servir cache, templates e jobs).
+    """
+    client = await asyncio.to_thread(get_llm)
+    for model in (DocumentData, DocumentHeader, ItemsData):
+        await asyncio.to_thread(get_parser, model)
+    out: Dict[str, Any] = {"model": LLM_MODEL}
+    groq_client = getattr(getattr(client, "async_client", None), "_client", None)
+    if PREWARM_LLM_PING and groq_client is not None:
+        try:
+            await groq_client.models.list()
+            out["ping"] = "ok"
+        except Exception as e:
+            out["ping"] = f"{type(e).__name__}: {e}"
+            log.warning("prewarm do LLM: %s", out["ping"])
+    return out
+
+async def prewarm() -> None:
+    started = time.perf_counter()
+
+    async def component(name: str, coro: Awaitable[Dict[str, Any]]) -> None:
+        t0 = time.perf_counter()
+        try:
+            detail = await coro
+            startup["components"][name] = {"ok": True, "seconds": round(time.perf_counter() - t0, 3), **detail}
+        except Exception as e:
+            log.exception("prewarm falhou", extra={"component": name})
+            startup["components"][name] = {"ok": False, "seconds": round(time.perf_counter() - t0, 3),
+                                           "error": f"{type(e).__name__}: {e}"}
+
+    try:
+        await asyncio.wait_for(asyncio.gather(component("ocr", prewarm_ocr_pool()), component("llm", prewarm_llm())),
+                               PREWARM_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.error("prewarm excedeu %ss", PREWARM_TIMEOUT)
+    startup["prewarm_seconds"] = round(time.perf_counter() - started, 3)
+    startup["ready"] = all(startup["components"].get(c, {}).get("ok") for c in ("ocr", "llm"))
+    log.info("prewarm terminado", extra={"seconds": startup["prewarm_seconds"], "ready": startup["ready"]})
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    log.info("backend de OCR", extra={"ocr_backend": ocr_engine.backend_name(), "config": ocr_engine.OCR_BACKEND})
+    job_store.init()
+    await asyncio.to_thread(job_store.requeue_stale)
+    workers = [asyncio.create_task(job_worker()) for _ in range(JOBS_WORKERS)]
+    startup["ready"] = not PREWARM
+    if PREWARM:
+        workers.append(asyncio.create_task(prewarm()))
+    yield
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    shutdown_cpu_pool()
+    shutdown_mp_manager()
+
+
+app = FastAPI(title="OCR + Extração Estruturada Turbo", version="1.1.0", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """
+    X-Request-ID (recebido ou gerado) fica no contexto do pedido, nos logs e na resposta;
+    é também o trace id dos spans.
+    """
+    rid = tracing.normalize_request_id(request.headers.get("x-request-id"))
+    token = tracing.bind_request_id(rid)
+    try:
+        response = await call_next(request)
+    finally:
+        tracing.unbind_request_id(token)
+    response.headers["X-Request-ID"] = rid
+    return response
 
 # =========================
 # Modelos
@@ -57,13 +410,39 @@ class DocumentData(BaseModel):
     valor_pago: float
     items: List[ItemData]
 
-parser = JsonOutputParser(pydantic_object=DocumentData)
+class DocumentHeader(BaseModel):
+    supplier_name: str
+    nif: Optional[str] = None
+    invoice_number: str
+    data_emissao: str
+    valor_total_documento: float
+    total_iva: float
+    valor_pago: float
 
-llm = ChatGroq(
-    model=LLM_MODEL,
-    temperature=LLM_TEMPERATURE,
-    api_key=os.getenv("GROQ_API_KEY"),
-)
+class ItemsData(BaseModel):
+    items: List[ItemData]
+
+@lru_cache(maxsize=None)
+def get_parser(model: type) -> "JsonOutputParser":
+    from langchain_core.output_parsers import JsonOutputParser
+    return JsonOutputParser(pydantic_object=model)
+
+llm = None  # ChatGroq, criado por get_llm()
+_llm_lock = threading.Lock()
+
+def get_llm() -> "ChatGroq":
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                from langchain_groq import ChatGroq
+                llm = ChatGroq(
+                    model=LLM_MODEL,
+                    temperature=LLM_TEMPERATURE,
+                    api_key=os.getenv("GROQ_API_KEY"),
+                    base_url=GROQ_API_BASE,
+                )
+    return llm
 
 # =========================
 # Helpers de texto/número
@@ -72,6 +451,8 @@ def strip_accents(s: str) -> str:
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
 
 def canon(s: str) -> str:
+    if s.isascii():
+        return s.upper()
     return strip_accents(s).upper()
 
 def limpar_texto(texto: str) -> str:
@@ -82,6 +463,12 @@ def limpar_e_ajustar_texto_para_llm(texto_ocr: str) -> str:
     """
     Limpa o texto do OCR e faz ajustes heurísticos antes de enviar para o LLM.
     """
+    return limpar_texto(ajustar_texto_ocr(texto_ocr))
+
+def ajustar_texto_ocr(texto_ocr: str) -> str:
+    """
+    Ajustes heurísticos sem limpar os espaços (as quebras de página mantêm-se).
+    """
     # 1. Corrigir erros comuns de OCR (ex: 2006 -> 200G)
     # A string 'CHOURICO 2006' deve ser substituída por 'CHOURICO 200G'
     # Use re.sub para ser insensível a maiúsculas/minúsculas e espaços
@@ -96,7 +483,7 @@ def limpar_e_ajustar_texto_para_llm(texto_ocr: str) -> str:
     if match:
         texto_limpo = texto_limpo[:match.start()]
 
-    return limpar_texto(texto_limpo)
+    return texto_limpo
 
 def to_float(num_str: str) -> float:
     """
@@ -125,14 +512,17 @@ def to_float(num_str: str) -> float:
     except ValueError:
         return 0.0
 
+@lru_cache(maxsize=256)
+def label_amount_pattern(label: str) -> "re.Pattern[str]":
+    return re.compile(label + totals.AMOUNT, flags=re.IGNORECASE)
+
 def find_number_after_label(text: str, labels: List[str]) -> Optional[float]:
     """
     Procura um número logo após algum dos rótulos (robusto a quebras e espaços).
     """
     t = canon(text)
     for label in labels:
-        pattern = rf'{label}\s*[:\-]?\s*([0-9\.\,\s]+)'
-        m = re.search(pattern, t, flags=re.IGNORECASE)
+        m = label_amount_pattern(label).search(t)
         if m:
             return to_float(m.group(1))
     return None
@@ -146,67 +536,614 @@ def is_meaningful(texto: str) -> bool:
     t = texto.strip()
     return len(t) > 40 and bool(re.search(r'\d', t))
 
+def render_gray(page: fitz.Page, dpi: int, clip: Optional[fitz.Rect] = None) -> Tuple[fitz.Pixmap, np.ndarray]:
+    """
+    Rasteriza diretamente em tons de cinzento (1 byte/pixel) e devolve (pixmap, vista numpy
+    sem cópia). A vista aponta para a memória do pixmap: o pixmap tem de ficar vivo
+    enquanto a imagem for usada (ver o argumento owner das tarefas de OCR).
+    """
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    return pix, pixmap_to_numpy(pix)
+
 def pixmap_to_numpy(pix: fitz.Pixmap) -> np.ndarray:
-    if pix.n not in (3, 4):
-        pix = fitz.Pixmap(fitz.csRGB, pix)
-    img = np.frombuffer(pix.samples, dtype=np.uint8)
-    if pix.n == 4:
-        img = img.reshape(pix.height, pix.width, 4)
-        img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-    else:
-        img = img.reshape(pix.height, pix.width, 3)
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    return img
+    if pix.n != 1 or pix.alpha:
+        # outro espaço de cor: uma conversão (cópia) para cinzento
+        pix = fitz.Pixmap(fitz.csGRAY, fitz.Pixmap(pix, 0) if pix.alpha else pix)
+        return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    img = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    return img.reshape(pix.height, pix.stride)[:, :pix.width]
 
 def preprocess_image(img_bgr: np.ndarray) -> np.ndarray:
-    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    gray = img_bgr if img_bgr.ndim == 2 else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     return binary
 
+def page_fingerprint(img: np.ndarray, config: str = TESSERACT_CONFIG) -> str:
+    """
+    Impressão digital da página rasterizada: mesmos pixels + mesma config => mesmo texto OCR.
+    """
+    header = f"{img.shape}|{img.dtype}|{config}".encode("utf-8")
+    return sha256_hex(header, b"\0", np.ascontiguousarray(img).tobytes())
+
+def ocr_image_cached(img: np.ndarray, config: str = TESSERACT_CONFIG) -> str:
+    if not PAGE_CACHE_ENABLED:
+        return ocr_engine.image_to_string(img, config)
+    key = page_fingerprint(img, config)
+    cached = page_cache.get(key)
+    if cached is not None:
+        return cached
+    text = ocr_engine.image_to_string(img, config)
+    page_cache.set(key, text)
+    return text
+
+def confidence_summary(confs: List[float]) -> Dict[str, Any]:
+    if not confs:
+        return {"words": 0, "mean_conf": None, "low_conf_ratio": None}
+    low = sum(1 for c in confs if c < OCR_ADAPTIVE_WORD_CONF)
+    return {
+        "words": len(confs),
+        "mean_conf": round(sum(confs) / len(confs), 2),
+        "low_conf_ratio": round(low / len(confs), 4),
+    }
+
+def ocr_image_with_conf_cached(img: np.ndarray, config: str = TESSERACT_CONFIG, dpi: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Como ocr_image_cached, mas devolve também o resumo de confiança das palavras.
+    """
+    key = page_fingerprint(img, f"{config}|conf")
+    if PAGE_CACHE_ENABLED:
+        cached = page_cache.get(key)
+        if cached is not None:
+            return cached
+    text, confs = ocr_engine.image_to_text_and_confidences(img, config, dpi)
+    value = {"text": text, **confidence_summary(confs)}
+    if PAGE_CACHE_ENABLED:
+        page_cache.set(key, value)
+    return value
+
+def needs_escalation(summary: Dict[str, Any]) -> bool:
+    if not summary["words"]:
+        return True
+    return (summary["mean_conf"] < OCR_ADAPTIVE_MIN_CONF
+            or summary["low_conf_ratio"] > OCR_ADAPTIVE_MAX_LOW_RATIO)
+
+_ocr_executor: Optional[ThreadPoolExecutor] = None
+
+def get_ocr_executor() -> ThreadPoolExecutor:
+    """
+    Threads de OCR de longa duração (uma por slot, em cada processo do pool):
+    com o backend tesserocr, cada thread mantém o seu handle já inicializado.
+    """
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ThreadPoolExecutor(max_workers=OCR_THREADS, thread_name_prefix="ocr")
+    return _ocr_executor
+
 def ocr_image(idx_img: Tuple[int, np.ndarray]) -> Tuple[int, str]:
     idx, img = idx_img
-    text = pytesseract.image_to_string(img, config=TESSERACT_CONFIG)
+    text = ocr_image_cached(img)
     return idx, text
 
-def extract_text_from_pdf_stream(file_bytes: bytes) -> str:
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    n = doc.page_count
-    candidates_embedded: List[Tuple[int, str]] = []
-    candidates_ocr_imgs: List[Tuple[int, np.ndarray]] = []
-
-    for i in range(n):
-        page = doc.load_page(i)
-        txt = page.get_text("text")
-        if is_meaningful(txt):
-            candidates_embedded.append((i, txt))
+def merge_confidence_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    words = sum(s["words"] for s in summaries)
+    if not words:
+        return {"words": 0, "mean_conf": None, "low_conf_ratio": None}
+    mean = sum(s["mean_conf"] * s["words"] for s in summaries if s["words"]) / words
+    low = sum(s["low_conf_ratio"] * s["words"] for s in summaries if s["words"]) / words
+    return {"words": words, "mean_conf": round(mean, 2), "low_conf_ratio": round(low, 4)}
+
+def ocr_page_regions(img_bin: np.ndarray, measure: bool, dpi: Optional[int] = None) -> Dict[str, Any]:
+    """
+    OCR por zonas (ver layout.py): só a área com tinta passa pelo Tesseract, a tabela
+    usa PSM de bloco único e o rodapé tem uma 2.ª passagem restrita a dígitos.
+    O texto do rodapé segue à parte para extract_totals_from_text.
+    """
+    cropped, offset = layout.crop_margins(img_bin)
+    zones = layout.detect_zones(cropped) if cropped.size else []
+    texts: List[str] = []
+    summaries: List[Dict[str, Any]] = []
+    footer_text: Optional[str] = None
+    pixels = 0
+    for name, y0, y1 in zones:
+        region = cropped[y0:y1]
+        if not layout.has_ink(region):
             continue
-        pix = page.get_pixmap(dpi=OCR_DPI)
-        img_bgr = pixmap_to_numpy(pix)
-        img_bin = preprocess_image(img_bgr)
-        candidates_ocr_imgs.append((i, img_bin))
+        pixels += int(region.shape[0] * region.shape[1])
+        config = TESSERACT_CONFIG_TABLE if name == "tabela" else TESSERACT_CONFIG
+        if measure:
+            ocr = ocr_image_with_conf_cached(region, config, dpi)
+            summaries.append(ocr)
+            text = ocr["text"]
+        else:
+            text = ocr_image_cached(region, config)
+        if name == "rodape":
+            numeric = ocr_image_cached(region, TESSERACT_CONFIG_NUMERIC)
+            text = layout.merge_numeric_pass(text, numeric)
+            footer_text = text
+        texts.append(text)
+
+    result: Dict[str, Any] = {
+        "text": "\n".join(texts),
+        "zones": layout.zone_stats(zones, offset),
+        "pixels_ocr": pixels,
+    }
+    if footer_text is not None:
+        result["footer_text"] = footer_text
+    if measure:
+        result.update(merge_confidence_summaries(summaries))
+    return result
+
+def text_blocks_from_dict(page: fitz.Page) -> List[Tuple[fitz.Rect, str]]:
+    """
+    Blocos de texto embutido com a sua bbox (sem carregar os bytes das imagens).
+    """
+    flags = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+    blocks: List[Tuple[fitz.Rect, str]] = []
+    for b in page.get_text("dict", flags=flags)["blocks"]:
+        if b.get("type") != 0:
+            continue
+        lines = ["".join(span["text"] for span in line["spans"]) for line in b["lines"]]
+        text = "\n".join(ln for ln in lines if ln.strip())
+        if text:
+            blocks.append((fitz.Rect(b["bbox"]), text))
+    return blocks
 
-    ocr_results: List[Tuple[int, str]] = []
-    if candidates_ocr_imgs:
-        with ThreadPoolExecutor(max_workers=OCR_THREADS) as ex:
-            futures = [ex.submit(ocr_image, tup) for tup in candidates_ocr_imgs]
-            for fut in as_completed(futures):
-                ocr_results.append(fut.result())
+def uncovered_image_regions(page: fitz.Page, text_blocks: List[Tuple[fitz.Rect, str]]) -> List[fitz.Rect]:
+    """
+    Partes das imagens da página sem texto embutido por cima. Cada imagem é dividida em
+    faixas horizontais de OCR_HYBRID_BAND_PT pontos; faixas consecutivas sem texto formam
+    uma região. Regiões menores que OCR_HYBRID_MIN_AREA_RATIO da página são ignoradas.
+    """
+    page_area = abs(page.rect)
+    min_area = page_area * OCR_HYBRID_MIN_AREA_RATIO
+    text_rects = [r for r, _ in text_blocks]
+    regions: List[fitz.Rect] = []
+    for info in page.get_image_info():
+        img_rect = fitz.Rect(info["bbox"]) & page.rect
+        if img_rect.is_empty or abs(img_rect) < min_area:
+            continue
+        covering = [r for r in text_rects if r.intersects(img_rect)]
+        y = img_rect.y0
+        current: Optional[fitz.Rect] = None
+        while y < img_rect.y1:
+            band = fitz.Rect(img_rect.x0, y, img_rect.x1, min(y + OCR_HYBRID_BAND_PT, img_rect.y1))
+            if any(r.intersects(band) for r in covering):
+                if current is not None:
+                    regions.append(current)
+                    current = None
+            else:
+                current = band if current is None else current | band
+            y = band.y1
+        if current is not None:
+            regions.append(current)
+    return [r for r in regions if abs(r) >= min_area]
 
-    all_results = {i: limpar_texto(t) for i in candidates_embedded}
-    for i, t in ocr_results:
-        all_results[i] = limpar_texto(t)
+def rss_mb() -> Optional[float]:
+    """
+    Memória residente atual do processo (/proc/self/statm), em MB. Ao contrário de
+    ru_maxrss (máximo desde o arranque), desce quando as páginas são libertadas.
+    None fora do Linux.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
 
-    ordered_text = "\n".join(all_results[i] for i in sorted(all_results.keys()))
-    return ordered_text
+def stage_spans(started: float, timings: Dict[str, float]) -> List[List[Any]]:
+    """
+    [etapa, início (epoch), duração] das etapas de uma página, em sequência a partir de
+    `started`. Seguem no resultado da página para o trace do pedido (tracing.add_span).
+    """
+    spans: List[List[Any]] = []
+    for stage, seconds in timings.items():
+        spans.append([stage, started, seconds])
+        started += seconds
+    return spans
+
+def _ocr_hybrid_task(idx: int, text_blocks: List[Tuple[Tuple[float, float], str]],
+                     regions: List[Tuple[Tuple[float, float], np.ndarray]], dpi: int) -> Dict[str, Any]:
+    """
+    OCR das regiões de imagem sem texto e junção com os blocos embutidos em ordem de leitura
+    (de cima para baixo, depois da esquerda para a direita). As posições vêm como (y0, x0).
+    """
+    items = list(text_blocks)
+    n_regions = len(regions)
+    pixels = 0
+    t_pre = t_ocr = 0.0
+    started = time.time()
+    for pos, img in regions:
+        t0 = time.perf_counter()
+        img_bin = preprocess_image(img)
+        t1 = time.perf_counter()
+        pixels += int(img_bin.shape[0] * img_bin.shape[1])
+        text = ocr_image_cached(img_bin)
+        t_pre += t1 - t0
+        t_ocr += time.perf_counter() - t1
+        if text.strip():
+            items.append((pos, text))
+    items.sort(key=lambda it: (round(it[0][0]), it[0][1]))
+    return {
+        "page": idx,
+        "source": "hibrida",
+        "dpi": dpi,
+        "regions": n_regions,
+        "pixels": pixels,
+        "timings": {"preprocess": round(t_pre, 4), "ocr": round(t_ocr, 4)},
+        "spans": stage_spans(started, {"preprocess": t_pre, "ocr": t_ocr}),
+        "rss_mb": rss_mb(),
+        "text": "\n".join(text for _, text in items),
+    }
+
+def _ocr_page_task(idx: int, img: np.ndarray, dpi: int, measure: bool) -> Dict[str, Any]:
+    """
+    img pode ser uma vista sem cópia sobre um Pixmap (render_gray): o Pixmap fica com a
+    thread de render, que só o liberta depois de a tarefa terminar (iter_pdf_pages).
+    """
+    started = time.time()
+    t0 = time.perf_counter()
+    img_bin = preprocess_image(img)
+    t1 = time.perf_counter()
+    result: Dict[str, Any] = {"page": idx, "source": "ocr", "dpi": dpi, "pixels": int(img_bin.shape[0] * img_bin.shape[1])}
+    if OCR_ROI:
+        result.update(ocr_page_regions(img_bin, measure, dpi))
+        if measure:
+            result["needs_escalation"] = needs_escalation(result)
+    elif measure:
+        ocr = ocr_image_with_conf_cached(img_bin, dpi=dpi)
+        result.update(ocr)
+        result["needs_escalation"] = needs_escalation(ocr)
+    else:
+        _, result["text"] = ocr_image((idx, img_bin))
+    result["timings"] = {"preprocess": round(t1 - t0, 4), "ocr": round(time.perf_counter() - t1, 4)}
+    result["spans"] = stage_spans(started, result["timings"])
+    result["rss_mb"] = rss_mb()
+    return result
+
+def page_pixels(rect: fitz.Rect, dpi: int) -> int:
+    return int(math.ceil(rect.width * dpi / 72.0) * math.ceil(rect.height * dpi / 72.0))
+
+def capped_dpi(page: fitz.Page, dpi: int) -> int:
+    """
+    Baixa a resolução de páginas enormes (plantas A0, TIFF de grande formato) para não
+    passar de IMAGE_MAX_MEGAPIXELS nem do orçamento de memória do documento.
+    """
+    area_in2 = (page.rect.width / 72.0) * (page.rect.height / 72.0)
+    max_pixels = min(IMAGE_MAX_MEGAPIXELS * 1e6, OCR_MEMORY_BUDGET_MB * 2 ** 20 / OCR_BYTES_PER_PIXEL)
+    if area_in2 <= 0 or area_in2 * dpi * dpi <= max_pixels:
+        return dpi
+    return max(72, int(math.sqrt(max_pixels / area_in2)))
+
+class MemoryBudget:
+    """
+    Orçamento em bytes partilhado pelas páginas de um documento. acquire bloqueia até
+    haver espaço; uma página sozinha passa sempre (senão nunca avançaria).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int) -> None:
+        with self._cond:
+            while self.used and self.used + n > self.limit:
+                self._cond.wait()
+            self.used += n
+            self.peak = max(self.peak, self.used)
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+def screen_page(idx: int, img: np.ndarray, seen: List[Tuple[int, np.ndarray]]) -> Optional[Dict[str, Any]]:
+    """
+    Filtro pré-OCR de uma página rasterizada (cinzento). Devolve o resultado "ignorada"
+    ou None se a página segue para OCR. seen: (página, hash) das páginas já lidas.
+    """
+    img_bin = preprocess_image(img)
+    if OCR_SKIP_BLANK:
+        reason = layout.classify_blank_or_separator(img, img_bin, OCR_BLANK_MAX_INK, OCR_SEPARATOR_MAX_COMPONENTS)
+        if reason:
+            return {"page": idx, "source": "ignorada", "reason": reason, "text": ""}
+    if OCR_SKIP_DUPLICATES:
+        h = layout.page_hash(img_bin)
+        for first, other in seen:
+            distance = layout.hash_distance(h, other)
+            if distance is not None and distance <= OCR_DUP_MAX_HAMMING:
+                return {"page": idx, "source": "ignorada", "reason": "duplicada", "duplicate_of": first, "text": ""}
+        seen.append((idx, h))
+    return None
+
+def iter_pdf_pages(doc: fitz.Document, page_indices: Optional[List[int]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Pipeline produtor/consumidor por página, na ordem em que as páginas ficam prontas.
+      - Esta thread lê o texto embutido e rasteriza (o PyMuPDF não é thread-safe).
+      - As threads de OCR fazem preprocess_image + Tesseract em paralelo com o render.
+      - No máximo OCR_MAX_PAGES_IN_FLIGHT imagens de página existem ao mesmo tempo, e a
+        sua soma estimada não passa de OCR_MEMORY_BUDGET_MB: a memória fica estável mesmo
+        em PDFs com centenas de páginas (páginas grandes => menos páginas em paralelo).
+      - As páginas são rasterizadas em cinzento e passadas ao OCR sem cópia; os Pixmaps
+        ficam nesta thread e só são libertados aqui, depois de a tarefa de OCR terminar.
+      - Em páginas com texto embutido, só as imagens sem texto por cima vão a OCR (OCR_HYBRID).
+      - Páginas em branco e separadoras (e, com OCR_SKIP_DUPLICATES, as repetidas) são
+        detetadas na página binarizada e ignoradas.
+      - Com OCR_ADAPTIVE, a 1.ª passagem é a OCR_ADAPTIVE_DPI_LOW e só as páginas com
+        confiança fraca voltam a ser rasterizadas a OCR_ADAPTIVE_DPI_HIGH.
+    Cada item: {"page": índice, "source": "texto" | "ocr" | "hibrida" | "ignorada", "text": texto bruto, ...}.
+    """
+    indices = range(doc.page_count) if page_indices is None else page_indices
+    done: "queue.Queue[Tuple[Optional[Dict[str, Any]], Optional[BaseException]]]" = queue.Queue()
+    slots = threading.BoundedSemaphore(OCR_MAX_PAGES_IN_FLIGHT)
+    budget = MemoryBudget(OCR_MEMORY_BUDGET_MB * 2 ** 20)
+    ex = get_ocr_executor()
+    futures = []
+    first_pass: Dict[int, Dict[str, Any]] = {}
+    renders: Dict[int, List[Any]] = {}
+    owners: Dict[Any, Any] = {}  # future -> Pixmap(s) cuja memória a tarefa usa
+    seen_hashes: List[Tuple[int, np.ndarray]] = []
+    pending = 0
+
+    def free_owners() -> None:
+        # só nesta thread (o PyMuPDF não é thread-safe); on_done corre depois de done()
+        for fut in [f for f in owners if f.done()]:
+            del owners[fut]
+
+    def on_done(fut, cost: int) -> None:
+        slots.release()
+        budget.release(cost)
+        if fut.cancelled():
+            return
+        err = fut.exception()
+        done.put((None, err) if err is not None else (fut.result(), None))
+
+    def submit(i: int, page: fitz.Page, dpi: int, measure: bool, check: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Rasteriza e envia para OCR. Com check=True a página passa antes pelo filtro
+        pré-OCR; se for ignorada, devolve logo o resultado (sem ocupar slot).
+        """
+        nonlocal pending
+        dpi = capped_dpi(page, dpi)
+        cost = page_pixels(page.rect, dpi) * OCR_BYTES_PER_PIXEL
+        slots.acquire()
+        budget.acquire(cost)
+        free_owners()
+        started, t0 = time.time(), time.perf_counter()
+        pix, img = render_gray(page, dpi)
+        renders[i] = ["render", started, round(time.perf_counter() - t0, 4)]
+        if check:
+            skipped = screen_page(i, img, seen_hashes)
+            if skipped is not None:
+                del img, pix
+                render = renders.pop(i)
+                skipped["timings"] = {"render": render[2]}
+                skipped["spans"] = [render]
+                slots.release()
+                budget.release(cost)
+                return skipped
+        fut = ex.submit(_ocr_page_task, i, img, dpi, measure)
+        owners[fut] = pix
+        del img, pix
+        pending += 1
+        futures.append(fut)
+        fut.add_done_callback(lambda f: on_done(f, cost))
+        return None
+
+    def submit_hybrid(i: int, page: fitz.Page) -> bool:
+        """
+        Página com texto embutido: se houver imagens sem texto por cima, só essas
+        regiões são rasterizadas e o resultado é juntado ao texto embutido.
+        """
+        nonlocal pending
+        if not page.get_image_info():
+            return False
+        blocks = text_blocks_from_dict(page)
+        regions = uncovered_image_regions(page, blocks)
+        if not regions:
+            return False
+        dpi = capped_dpi(page, OCR_DPI)
+        cost = sum(page_pixels(rect, dpi) for rect in regions) * OCR_BYTES_PER_PIXEL
+        slots.acquire()
+        budget.acquire(cost)
+        free_owners()
+        images = []
+        pixmaps = []
+        started, t0 = time.time(), time.perf_counter()
+        for rect in regions:
+            pix, img = render_gray(page, dpi, rect)
+            images.append(((rect.y0, rect.x0), img))
+            pixmaps.append(pix)
+        renders[i] = ["render", started, round(time.perf_counter() - t0, 4)]
+        text_blocks = [((r.y0, r.x0), t) for r, t in blocks]
+        fut = ex.submit(_ocr_hybrid_task, i, text_blocks, images, dpi)
+        owners[fut] = pixmaps
+        del images, pixmaps
+        pending += 1
+        futures.append(fut)
+        fut.add_done_callback(lambda f: on_done(f, cost))
+        return True
+
+    def drain(block: bool) -> Iterator[Dict[str, Any]]:
+        nonlocal pending
+        while pending:
+            try:
+                result, err = done.get(block=block)
+            except queue.Empty:
+                return
+            pending -= 1
+            if err is not None:
+                raise err
+            i = result["page"]
+            render = renders.pop(i, None)
+            if render is not None:
+                result.setdefault("timings", {})["render"] = render[2]
+                result["spans"] = [render] + result.get("spans", [])
+            if result.pop("needs_escalation", False) and result["dpi"] < OCR_ADAPTIVE_DPI_HIGH:
+                page = doc.load_page(i)
+                if capped_dpi(page, OCR_ADAPTIVE_DPI_HIGH) > result["dpi"]:
+                    first_pass[i] = result
+                    submit(i, page, OCR_ADAPTIVE_DPI_HIGH, False)
+                    continue
+            low = first_pass.pop(i, None)
+            if low is not None:
+                result["escalated"] = True
+                result["first_pass"] = {k: low[k] for k in ("dpi", "words", "mean_conf", "low_conf_ratio")}
+                result["pixels"] += low["pixels"]
+                for stage, seconds in low["timings"].items():
+                    result["timings"][stage] = round(result["timings"].get(stage, 0.0) + seconds, 4)
+                result["spans"] = low["spans"] + result["spans"]
+            yield result
+
+    first_dpi = OCR_ADAPTIVE_DPI_LOW if OCR_ADAPTIVE else OCR_DPI
+    try:
+        for i in indices:
+            page = doc.load_page(i)
+            txt = page.get_text("text")
+            if is_meaningful(txt):
+                if OCR_HYBRID:
+                    yield from drain(block=False)
+                    if submit_hybrid(i, page):
+                        continue
+                yield {"page": i, "source": "texto", "text": txt}
+                continue
+            yield from drain(block=False)
+            skipped = submit(i, page, first_dpi, OCR_ADAPTIVE, check=OCR_SKIP_BLANK or OCR_SKIP_DUPLICATES)
+            del page
+            if skipped is not None:
+                yield skipped
+        yield from drain(block=True)
+    finally:
+        running = [fut for fut in futures if not fut.cancel()]
+        # as tarefas em curso ainda leem a memória dos Pixmaps
+        wait(running)
+        owners.clear()
+
+def summarize_pages(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ocr_pages = [p for p in pages if p["source"] == "ocr"]
+    skipped = [p for p in pages if p["source"] == "ignorada"]
+    escalated = sum(1 for p in ocr_pages if p.get("escalated"))
+    pixels = sum(p.get("pixels", 0) for p in ocr_pages)
+    return {
+        "pages": len(pages),
+        "pages_texto": sum(1 for p in pages if p["source"] == "texto"),
+        "pages_ocr": len(ocr_pages),
+        "pages_hibridas": sum(1 for p in pages if p["source"] == "hibrida"),
+        "pages_skipped": len(skipped),
+        "skipped": [{k: p[k] for k in ("page", "reason", "duplicate_of") if k in p} for p in skipped],
+        "adaptive": OCR_ADAPTIVE,
+        "escalated": escalated,
+        "escalation_rate": round(escalated / len(ocr_pages), 4) if ocr_pages else 0.0,
+        "avg_pixels_per_ocr_page": int(pixels / len(ocr_pages)) if ocr_pages else 0,
+        "max_rss_mb": max((p["rss_mb"] for p in pages if p.get("rss_mb") is not None), default=None),
+    }
+
+def build_document_result(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Junta as páginas por ordem e separa o texto dos metadados (dpi, confiança, origem).
+    """
+    pages = sorted(pages, key=lambda p: p["page"])
+    text = "\n".join(limpar_texto(p["text"]) for p in pages if p["source"] != "ignorada")
+    meta = [{k: v for k, v in p.items() if k not in ("text", "footer_text", "spans")} for p in pages]
+    # os totais ficam normalmente no rodapé da última página que o tem
+    footers = [p["footer_text"] for p in pages if p.get("footer_text")]
+    footer_text = limpar_texto(footers[-1]) if footers else None
+    spans = {p["page"]: p["spans"] for p in pages if p.get("spans")}
+    return {"text": text, "footer_text": footer_text, "pages": meta, "stats": summarize_pages(pages), "spans": spans}
+
+def document_filetype(fname: str) -> str:
+    return "tiff" if fname.endswith((".tif", ".tiff")) else "pdf"
+
+def extract_document_from_pdf_stream(file_bytes: bytes, filetype: str = "pdf") -> Dict[str, Any]:
+    """
+    PDF ou TIFF multipágina: cada página/frame passa pelo mesmo pipeline por página.
+    """
+    doc = fitz.open(stream=file_bytes, filetype=filetype)
+    try:
+        pages = list(iter_pdf_pages(doc))
+    finally:
+        doc.close()
+    return build_document_result(pages)
+
+def extract_text_from_pdf_stream(file_bytes: bytes) -> str:
+    return extract_document_from_pdf_stream(file_bytes)["text"]
+
+def ocr_image_in_strips(img_gray: np.ndarray, dpi: int) -> Dict[str, Any]:
+    """
+    Imagem alta demais para uma só chamada: faixas horizontais sobrepostas lidas em
+    paralelo; as linhas repetidas na sobreposição ficam uma só vez.
+    """
+    started, t0 = time.time(), time.perf_counter()
+    img_bin = preprocess_image(img_gray)  # limiar (Otsu) global: igual em todas as faixas
+    del img_gray
+    t1 = time.perf_counter()
+    bounds = image_io.strip_bounds(img_bin.shape[0], IMAGE_TILE_PX, IMAGE_TILE_OVERLAP_PX)
+    texts = list(get_ocr_executor().map(lambda b: ocr_image_cached(img_bin[b[0]:b[1]]), bounds))
+    text = texts[0]
+    for nxt in texts[1:]:
+        text = image_io.merge_overlapping_lines(text, nxt)
+    timings = {"preprocess": round(t1 - t0, 4), "ocr": round(time.perf_counter() - t1, 4)}
+    return {"page": 0, "source": "ocr", "dpi": dpi, "pixels": int(img_bin.shape[0] * img_bin.shape[1]),
+            "strips": len(bounds), "timings": timings, "spans": stage_spans(started, timings),
+            "rss_mb": rss_mb(), "text": text}
+
+def extract_pages_from_image_stream(file_bytes: "bytes | mmap.mmap") -> List[Dict[str, Any]]:
+    """
+    PNG/JPG: descodificada já em tons de cinzento e reduzida para IMAGE_TARGET_DPI.
+    Um TIFF (mesmo com extensão de imagem) segue o caminho por páginas.
+    """
+    if image_io.is_tiff(file_bytes):
+        doc = fitz.open(stream=file_bytes, filetype="tiff")
+        try:
+            return list(iter_pdf_pages(doc))
+        finally:
+            doc.close()
+    started, t0 = time.time(), time.perf_counter()
+    img, dpi = image_io.decode_scaled(file_bytes, IMAGE_TARGET_DPI, int(IMAGE_MAX_MEGAPIXELS * 1e6))
+    if img is None:
+        return []
+    decode_seconds = round(time.perf_counter() - t0, 4)
+    dpi = int(round(dpi))
+    if img.shape[0] > IMAGE_TILE_PX:
+        result = ocr_image_in_strips(img, dpi)
+    else:
+        result = _ocr_page_task(0, img, dpi, False)
+    result["timings"]["render"] = decode_seconds
+    result["spans"].insert(0, ["render", started, decode_seconds])
+    return [result]
+
+def extract_document_from_image_stream(file_bytes: bytes) -> Dict[str, Any]:
+    return build_document_result(extract_pages_from_image_stream(file_bytes))
 
 def extract_text_from_image_stream(file_bytes: bytes) -> str:
-    arr = np.frombuffer(file_bytes, np.uint8)
-    img_bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img_bgr is None:
-        return ""
-    img_bin = preprocess_image(img_bgr)
-    text = pytesseract.image_to_string(img_bin, config=TESSERACT_CONFIG)
-    return limpar_texto(text)
+    return extract_document_from_image_stream(file_bytes)["text"]
+
+def extract_pages_from_image_path(path: str) -> List[Dict[str, Any]]:
+    """
+    Imagem já em disco: mapeada (mmap) em vez de lida para memória. O cabeçalho e a
+    descodificação leem do mapeamento, servido pela cache de ficheiros do sistema.
+    Um TIFF é aberto pelo caminho, como os PDF.
+    """
+    with open(path, "rb") as f:
+        if image_io.is_tiff(f.read(4)):
+            with fitz.open(path, filetype="tiff") as doc:
+                return list(iter_pdf_pages(doc))
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return extract_pages_from_image_stream(data)
+
+def extract_document_from_path(path: str, fname: str) -> Dict[str, Any]:
+    """
+    Documento já em disco (upload copiado por spool_upload ou payload de job). Os PDF/TIFF
+    são abertos pelo caminho: o PyMuPDF lê as páginas do ficheiro à medida que são usadas.
+    """
+    if not fname.endswith(PAGED_EXTENSIONS):
+        return build_document_result(extract_pages_from_image_path(path))
+    with fitz.open(path, filetype=document_filetype(fname)) as doc:
+        return build_document_result(list(iter_pdf_pages(doc)))
 
 # =========================
 # Heurísticas de totais/IVA
@@ -218,56 +1155,9 @@ def extract_totals_from_text(extracted_text: str) -> Dict[str, float]:
       - TOTAL IMPOSTOS / TOTAL IVA / IVA => total_iva
       - TOTAL LÍQUIDO => base sem IVA
       - INCIDÊNCIA ... TAXA% ... VALOR (tabela inferida)
+    O texto é canonizado uma vez e percorrido numa única passagem (ver totals.py).
     """
-    out = {"total_com_iva": None, "total_iva": None, "total_liquido": None, "taxa_padrao": None}
-    t = canon(extracted_text)
-
-    # TOTAL COM IVA (preferência por rótulos inequívocos)
-    labels_total = [
-        r'TOTAL\s*\(KZ\)', r'TOTAL\s+GERAL', r'TOTAL\s+A\s+PAGAR', r'TOTAL\s+A\s+LIQUIDAR',
-        r'TOTAL\s+PAGO', r'VALOR\s+A\s+PAGAR', r'VALOR\s+PAGO'
-    ]
-    for lab in labels_total:
-        m = re.search(rf'{lab}\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
-        if m:
-            out["total_com_iva"] = to_float(m.group(1))
-            break
-
-    # TOTAL IMPOSTOS / IVA
-    labels_iva = [
-        r'TOTAL\s+IMPOSTOS', r'TOTAL\s+IVA', r'IVA\b', r'IMPOSTOS\b', r'IMPOSTO\b'
-    ]
-    for lab in labels_iva:
-        m = re.search(rf'{lab}\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
-        if m:
-            out["total_iva"] = to_float(m.group(1))
-            break
-
-    # TOTAL LÍQUIDO (base)
-    m = re.search(r'TOTAL\s+LIQUIDO\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
-    if m:
-        out["total_liquido"] = to_float(m.group(1))
-
-    # Padrão "INCIDENCIA ... TAXA% ... VALOR"
-    m = re.search(
-        r'INCID[ÊE]NCIA.*?([0-9\.\,\s]+).*?TAXA\s*%?\s*[:\-]?\s*([0-9]{1,2})(?:[,\.\s]\d+)?\s*%?.*?(?:VALOR|IMPOSTOS).*?([0-9\.\,\s]+)',
-        t, flags=re.IGNORECASE | re.DOTALL)
-    if m:
-        base = to_float(m.group(1))
-        taxa = float(m.group(2))
-        val_iva = to_float(m.group(3))
-        # confere coerência básica
-        if base > 0 and val_iva > 0:
-            out["taxa_padrao"] = taxa
-            out["total_liquido"] = out["total_liquido"] or base
-            out["total_iva"] = out["total_iva"] or val_iva
-            out["total_com_iva"] = out["total_com_iva"] or round(base + val_iva, 2)
-
-    # Se não achou "TOTAL (KZ)" mas tem liquido + impostos, soma
-    if out["total_com_iva"] is None and (out["total_liquido"] is not None and out["total_iva"] is not None):
-        out["total_com_iva"] = round(out["total_liquido"] + out["total_iva"], 2)
-
-    return out
+    return totals.extract_totals(canon(extracted_text), to_float)
 
 # =========================
 # LLM
@@ -285,7 +1175,7 @@ Instruções Cruciais para Itens da Fatura:
 - NÃO arredonde os valores de 'preco_unitario' ou 'quantidade' no JSON. Apenas formate como float.
 
 Formato Pydantic:
-{parser.get_format_instructions()}
+{get_parser(DocumentData).get_format_instructions()}
 
 Atenção a rótulos equivalentes:
 - TOTAL (KZ), TOTAL GERAL, TOTAL A PAGAR, TOTAL A LIQUIDAR ⇒ "valor_total_documento" e, se houver, "valor_pago"
@@ -304,29 +1194,202 @@ TEXTO:
 {extracted_text}
 """.strip()
 
-def run_llm_structured_extraction(extracted_text: str) -> Dict[str, Any]:
+def preparar_texto_para_llm(extracted_text: str) -> str:
     processed_text = limpar_e_ajustar_texto_para_llm(extracted_text)
-    text_for_llm = processed_text if len(processed_text) <= MAX_CHARS_TO_LLM else processed_text[:MAX_CHARS_TO_LLM]
-
-    prompt = build_prompt_for_llm(text_for_llm)
-    response = llm.invoke(prompt)
+    return processed_text if len(processed_text) <= MAX_CHARS_TO_LLM else processed_text[:MAX_CHARS_TO_LLM]
 
-    # Debug opcional
-    print("\n===== AMOSTRA TEXTO OCR =====")
-    print(text_for_llm[:1000], "...\n")
-    print("===== RESPOSTA LLM =====")
-    print(response.content[:1000], "...\n")
+def parse_llm_response(content: str, text_for_llm: str) -> Dict[str, Any]:
+    log.debug("resposta do LLM", extra={"amostra_texto_ocr": text_for_llm[:1000], "resposta_llm": content[:1000]})
 
     try:
-        extracted_data = parser.parse(response.content)
+        extracted_data = get_parser(DocumentData).parse(content)
     except Exception:
-        m = re.search(r"\{.*\}", response.content, re.S)
+        m = re.search(r"\{.*\}", content, re.S)
         if not m:
             raise HTTPException(status_code=500, detail="LLM não retornou JSON válido.")
         extracted_data = json.loads(m.group())
 
     return extracted_data
 
+def llm_memo_key(prompt: str) -> str:
+    return sha256_hex(f"{LLM_MODEL}|{LLM_TEMPERATURE}|".encode("utf-8"), prompt.encode("utf-8"))
+
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+async def allm_content(prompt: str) -> str:
+    async def call_llm() -> str:
+        LLM_CALLS.inc(state="waiting")
+        try:
+            await llm_slots.acquire()
+        finally:
+            LLM_CALLS.dec(state="waiting")
+        LLM_CALLS.inc(state="running")
+        start = time.perf_counter()
+        try:
+            with tracing.span("llm", model=LLM_MODEL, prompt_chars=len(prompt)):
+                response = await get_llm().ainvoke(prompt)
+        except Exception:
+            LLM_REQUESTS.inc(result="erro")
+            raise
+        finally:
+            LLM_CALLS.dec(state="running")
+            llm_slots.release()
+        LLM_REQUESTS.inc(result="ok")
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm")
+        return response.content
+
+    # Guarda-se o texto bruto da resposta (imutável); o parse é refeito por pedido
+    # porque validar_e_corrigir_dados altera o dicionário.
+    return await llm_memo.get_or_compute(llm_memo_key(prompt), call_llm)
+
+async def allm_json(prompt: str, text_for_llm: str) -> Dict[str, Any]:
+    """
+    Chamada (memorizada) ao LLM + parse. Uma resposta que não dá JSON válido sai do
+    memo: a próxima tentativa com o mesmo prompt volta a chamar o LLM.
+    """
+    content = await allm_content(prompt)
+    try:
+        return parse_llm_response(content, text_for_llm)
+    except Exception:
+        llm_memo.discard(llm_memo_key(prompt))
+        raise
+
+async def arun_llm_structured_extraction(extracted_text: str) -> Dict[str, Any]:
+    """
+    A chamada ao Groq é assíncrona: não ocupa o event loop nem uma thread.
+    Textos que seriam truncados seguem para a extração em blocos.
+    """
+    if LLM_CHUNKING and len(limpar_e_ajustar_texto_para_llm(extracted_text)) > MAX_CHARS_TO_LLM:
+        return await arun_llm_chunked_extraction(extracted_text)
+    text_for_llm = preparar_texto_para_llm(extracted_text)
+    return await allm_json(build_prompt_for_llm(text_for_llm), text_for_llm)
+
+# =========================
+# LLM em blocos (documentos longos)
+# =========================
+def build_header_prompt_for_llm(extracted_text: str) -> str:
+    return f"""
+Você é um assistente de OCR. Do excerto abaixo (início e fim de um documento longo), extraia apenas os
+dados de cabeçalho e os totais e **retorne SOMENTE o JSON válido** (sem explicações). Não extraia itens.
+O texto pode conter erros de OCR; infira com precisão, mas não invente.
+
+Formato Pydantic:
+{get_parser(DocumentHeader).get_format_instructions()}
+
+Atenção a rótulos equivalentes:
+- TOTAL (KZ), TOTAL GERAL, TOTAL A PAGAR, TOTAL A LIQUIDAR ⇒ "valor_total_documento" e, se houver, "valor_pago"
+- TOTAL IMPOSTOS, TOTAL IVA, IVA ⇒ "total_iva"
+- Use ponto como separador decimal.
+- Datas dd-mm-yyyy.
+
+TEXTO:
+{extracted_text}
+""".strip()
+
+def build_items_prompt_for_llm(extracted_text: str) -> str:
+    return f"""
+Você é um assistente de OCR. O texto abaixo é um bloco da tabela de itens de uma fatura longa.
+Extraia SOMENTE os itens deste bloco e **retorne SOMENTE o JSON válido** (sem explicações).
+O texto pode conter erros de OCR; infira com precisão, mas não invente.
+
+Instruções Cruciais para Itens da Fatura:
+- Para cada item, extraia a 'descricao', o 'preco_unitario' (preço por unidade, SEM IVA), a 'quantidade' e a 'taxa_iva_percentagem'.
+- Se a fatura apresentar um 'valor total da linha' para o item (preço * quantidade) mas não o 'preco_unitario', **divida o 'valor total da linha' pela 'quantidade'** para obter o 'preco_unitario'.
+- Para extrair a 'quantidade', **identifique a coluna 'Quantidade'** na tabela. Ignore totais, NIFs e números fora da tabela de itens.
+- Ignore linhas cortadas no início ou no fim do bloco que não tenham todos os valores.
+- NÃO arredonde os valores. Use ponto como separador decimal. Não agrupe itens.
+- Se o bloco não tiver itens, devolva {{"items": []}}.
+
+Formato Pydantic:
+{get_parser(ItemsData).get_format_instructions()}
+
+TEXTO:
+{extracted_text}
+""".strip()
+
+def dividir_em_blocos(extracted_text: str, max_chars: int, overlap: int) -> List[str]:
+    """
+    Divide o texto já ajustado por páginas (linhas de extracted_text); páginas maiores do
+    que max_chars são cortadas em fronteiras de palavra. Cada bloco (exceto o 1.º) começa
+    com os últimos `overlap` caracteres do anterior, para não perder a linha cortada.
+    """
+    overlap = min(overlap, max_chars // 4)
+    limit = max_chars - overlap - 1
+    pieces: List[str] = []
+    for pagina in ajustar_texto_ocr(extracted_text).split("\n"):
+        pagina = limpar_texto(pagina)
+        while len(pagina) > limit:
+            cut = pagina.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            pieces.append(pagina[:cut])
+            pagina = pagina[cut:].lstrip()
+        if pagina:
+            pieces.append(pagina)
+
+    blocos: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > max_chars:
+            blocos.append(current)
+            tail = current[-overlap:] if overlap > 0 else ""
+            current = tail[tail.find(" ") + 1:] if " " in tail else tail
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        blocos.append(current)
+    return blocos
+
+def chave_item(it: Any) -> Tuple[str, float, float]:
+    if not isinstance(it, dict):
+        return (repr(it), 0.0, 0.0)
+    descricao = canon(str(first_present(it, ITEM_KEYS["descricao"], "")))
+    return (
+        re.sub(r'[^A-Z0-9]', '', descricao),
+        round(safe_float(first_present(it, ITEM_KEYS["quantidade"], 0)), 3),
+        round(safe_float(first_present(it, ITEM_KEYS["preco_unitario"], 0)), 2),
+    )
+
+def juntar_itens(itens_por_bloco: List[List[Any]]) -> List[Any]:
+    """
+    Junta os itens pela ordem dos blocos. Na fronteira entre blocos, a maior sequência
+    de itens no fim de um bloco repetida no início do seguinte (zona de sobreposição)
+    conta uma só vez; itens iguais noutras posições são linhas distintas da fatura.
+    """
+    merged: List[Any] = []
+    merged_keys: List[Tuple[str, float, float]] = []
+    for itens in itens_por_bloco:
+        keys = [chave_item(it) for it in itens]
+        overlap = 0
+        for k in range(min(len(merged_keys), len(keys)), 0, -1):
+            if merged_keys[-k:] == keys[:k]:
+                overlap = k
+                break
+        merged.extend(itens[overlap:])
+        merged_keys.extend(keys[overlap:])
+    return merged
+
+async def arun_llm_chunked_extraction(extracted_text: str) -> Dict[str, Any]:
+    """
+    Cabeçalho/totais numa chamada (início + fim do documento) e itens de cada bloco em
+    chamadas concorrentes: a latência acompanha o maior bloco, não o tamanho total.
+    """
+    blocos = dividir_em_blocos(extracted_text, LLM_CHUNK_CHARS, LLM_CHUNK_OVERLAP_CHARS)
+    texto = limpar_e_ajustar_texto_para_llm(extracted_text)
+    half = LLM_CHUNK_CHARS // 2
+    header_text = texto if len(texto) <= LLM_CHUNK_CHARS else f"{texto[:half]}\n[...]\n{texto[-half:]}"
+
+    async def header() -> Dict[str, Any]:
+        return await allm_json(build_header_prompt_for_llm(header_text), header_text)
+
+    async def items(bloco: str) -> List[Any]:
+        data = await allm_json(build_items_prompt_for_llm(bloco), bloco)
+        found = data.get("items") if isinstance(data, dict) else None
+        return found if isinstance(found, list) else []
+
+    results = await asyncio.gather(header(), *(items(b) for b in blocos))
+    data = dict(results[0]) if isinstance(results[0], dict) else {}
+    data["items"] = juntar_itens(list(results[1:]))
+    return data
+
 # =========================
 # Pós-processamento (fixes)
 # =========================
@@ -355,14 +1418,32 @@ def safe_float(x: Any, default: float = 0.0) -> float:
         return float(default)
 
 
-def first_present(d: Dict[str, Any], keys: List[str], default=None):
-    for k in keys:
-        if k in d and d[k] is not None:
-            return d[k]
-    return default
+def detectar_totais(texto_ocr: str, texto_rodape: Optional[str] = None) -> Dict[str, Any]:
+    det = extract_totals_from_text(texto_ocr)
+    if texto_rodape:
+        # zona de totais isolada pelo OCR por regiões: tem prioridade sobre o texto todo
+        det_rodape = extract_totals_from_text(texto_rodape)
+        det = {k: det_rodape[k] if det_rodape.get(k) is not None else v for k, v in det.items()}
+    return det
 
 
-def validar_e_corrigir_dados(data: Dict[str, Any], texto_ocr: str) -> Dict[str, Any]:
+def resultado_consistente(data: Dict[str, Any], tolerancia: float = TEMPLATES_TOLERANCE) -> bool:
+    """
+    Os itens (com IVA) somam o total do documento, dentro da tolerância.
+    """
+    items = data.get("items") or []
+    total = safe_float(data.get("valor_total_documento"), 0.0)
+    if not items or total <= 0:
+        return False
+    calc = sum(
+        safe_float(it.get("preco_unitario")) * safe_float(it.get("quantidade"))
+        * (1.0 + safe_float(it.get("taxa_iva_percentagem")) / 100.0)
+        for it in items
+    )
+    return abs(calc - total) <= max(1.0, total * tolerancia)
+
+
+def validar_e_corrigir_dados(data: Dict[str, Any], texto_ocr: str, texto_rodape: Optional[str] = None) -> Dict[str, Any]:
     """
     Pós-processamento robusto e heurístico para:
       - Normalizar nomes de campos de itens (preco_unitario, preco_total, quantidade, taxa).
@@ -376,145 +1457,15 @@ def validar_e_corrigir_dados(data: Dict[str, Any], texto_ocr: str) -> Dict[str,
             return data
 
         # Detecção do rodapé (taxa padrão / totais)
-        det = extract_totals_from_text(texto_ocr)
+        det = detectar_totais(texto_ocr, texto_rodape)
         taxa_padrao = det.get("taxa_padrao")
 
-        items = data.get("items") or []
-        normalized_items = []
-
-        # Normalizar itens: aceitar vários nomes que o LLM pode ter usado
-        for it in items:
-            # it pode já ser dict ou pydantic. Vamos transformá-lo num dict mutável
-            if not isinstance(it, dict):
-                try:
-                    it = it.dict()
-                except Exception:
-                    it = dict(it)
-
-            # Capturar possíveis chaves alternativas
-            descricao = first_present(it, ["descricao", "descrição", "descricao_item", "desc", "descricao_produto"], "")
-            # preços: preco_unitario esperado; mas LLM pode devolver "preco_total", "valor", "subtotal"
-            preco_unit = first_present(it, ["preco_unitario", "preco_unit", "unit_price", "preco_unitario_item"], None)
-            preco_total = first_present(it, ["preco_total", "valor_total_item", "valor", "total", "sub_total"], None)
-            quantidade = first_present(it, ["quantidade", "qtd", "quantidade_item", "qty"], 0)
-            taxa = first_present(it, ["taxa_iva_percentagem", "taxa", "iva_percent", "iva_percentagem"], None)
-
-            # converter numeros com segurança
-            quantidade_f = safe_float(quantidade, 0.0)
-            preco_unit_f = None if preco_unit is None else safe_float(preco_unit, 0.0)
-            preco_total_f = None if preco_total is None else safe_float(preco_total, 0.0)
-
-            # Heurística 1:
-            # Se prec_unit is None or zero e existe preco_total e quantidade>0 -> derive unitário
-            if (preco_unit_f is None or preco_unit_f == 0.0) and preco_total_f not in (None, 0.0) and quantidade_f > 0:
-                # assumir preco_total pode conter IVA ou não; deixamos conversão para depois com taxa certa
-                preco_unit_f = round(preco_total_f / quantidade_f, 2)
-
-            # Heurística 2:
-            # Detectar se preco_unit_f * quantidade == preco_total_f (com margem)
-            # Se sim, e se tivermos taxa conhecida (ou taxa_padrao), verificar se preco_unit_f inclui IVA.
-            taxa_f = None
-            if taxa not in (None, ""):
-                taxa_f = safe_float(taxa, 0.0)
-
-            # se taxa não veio nos itens mas existe taxa_padrao do rodapé, usá-la
-            if (taxa_f is None or taxa_f == 0.0) and taxa_padrao is not None:
-                taxa_f = float(taxa_padrao)
-
-            # Se temos preco_unit_f e preco_total_f e apenas o preco_total_f é o somatório com IVA,
-            # podemos detectar inclusão de IVA: se preco_unit_f*quantidade_f ~= preco_total_f
-            if preco_unit_f not in (None, 0.0) and preco_total_f not in (None, 0.0) and quantidade_f > 0:
-                # comparação com tolerância pequena
-                calc = round(preco_unit_f * quantidade_f, 2)
-                if abs(calc - preco_total_f) < 0.01:
-                    # pode ser que preco_unit_f já inclua IVA (ou não). Vamos checar com taxa_f:
-                    if taxa_f and taxa_f > 0:
-                        # Se preco_unit_f inclui IVA, então valor sem IVA = preco_unit_f / (1 + taxa/100)
-                        # NOTA: Corrigi aqui para usar 'preco_unit_f' em vez de 'u_incl'
-                        unit_sem_iva = round(preco_unit_f / (1.0 + taxa_f / 100.0), 2)
-                        # recomputar
-                        preco_unit_f = unit_sem_iva
-
-            # Heurística 3:
-            # Se não existia preco_total mas LLM colocou preco_unit já com IVA e rodapé total mostra total menor,
-            # detectamos por comparação global mais abaixo (recalculo do total)
-            # Formar o item normalizado
-            normalized = {
-                "descricao": descricao or "",
-                "preco_unitario": float(f"{(preco_unit_f or 0.0):.2f}"),
-                "quantidade": float(f"{quantidade_f:.6g}"),  # mantém precisão de quantidade (ex: 1, 1.5)
-                "taxa_iva_percentagem": float(taxa_f or 0.0),
-            }
-
-            # também manter campos auxiliares se existirem
-            if preco_total_f not in (None, 0.0):
-                normalized["preco_total_extraido"] = float(f"{preco_total_f:.2f}")
-
-            normalized_items.append(normalized)
-
-        # Agora recalcular subtotal / iva / total a partir dos itens (considerando taxa em cada item)
-        subtotal = 0.0
-        iva_calc = 0.0
-        # Primeiro pass: se algum item parece ter preço unitario que inclui IVA, tentar detectar pela soma
-        for it in normalized_items:
-            q = safe_float(it.get("quantidade", 0.0))
-            u = safe_float(it.get("preco_unitario", 0.0))
-            t_tax = safe_float(it.get("taxa_iva_percentagem", 0.0))
-            subtotal += round(u * q, 2)
-            iva_calc += round((u * q) * (t_tax / 100.0), 2)
-
-        subtotal = round(subtotal, 2)
-        iva_calc = round(iva_calc, 2)
-        total_calc = round(subtotal + iva_calc, 2)
-
-        # Se existir informação do rodapé (det), priorizamos onde fizer sentido e usamos-a para ajustar itens
+        # Itens em colunas (NumPy): normalização, IVA incluído, taxa padrão e recálculo
         total_iva_footer = det.get("total_iva")
         total_com_iva_footer = det.get("total_com_iva")
         total_liquido_footer = det.get("total_liquido")
-
-        # Se os totais dos itens não baterem com total_com_iva_footer, tentamos detectar se os preços unitários
-        # estão com IVA incluído — neste caso, convertemos unitários para sem IVA usando a taxa (se homogénea).
-        if total_com_iva_footer and abs(total_calc - float(total_com_iva_footer)) > 0.5:
-            # calcular taxa homogénea se possível
-            taxas_presentes = {round(safe_float(it.get("taxa_iva_percentagem", 0.0)), 6) for it in normalized_items}
-            if len(taxas_presentes) == 1:
-                taxa_hom = taxas_presentes.pop()
-                if taxa_hom > 0:
-                    # verificar se convertendo unitários (dividindo por 1+taxa) aproxima total
-                    subtotal_candidate = 0.0
-                    iva_candidate = 0.0
-                    for it in normalized_items:
-                        q = safe_float(it["quantidade"], 0.0)
-                        u_incl = safe_float(it["preco_unitario"], 0.0)
-                        u_excl = round(u_incl / (1.0 + taxa_hom / 100.0), 2)
-                        subtotal_candidate += round(u_excl * q, 2)
-                        iva_candidate += round((u_excl * q) * (taxa_hom / 100.0), 2)
-                    total_candidate = round(subtotal_candidate + iva_candidate, 2)
-                    # Se total_candidate estiver mais próximo do rodapé, fazemos a conversão
-                    if abs(total_candidate - float(total_com_iva_footer)) < abs(total_calc - float(total_com_iva_footer)):
-                        # aplicar conversão
-                        for it in normalized_items:
-                            u_incl = safe_float(it["preco_unitario"], 0.0)
-                            u_excl = round(u_incl / (1.0 + taxa_hom / 100.0), 2)
-                            it["preco_unitario"] = float(f"{u_excl:.2f}")
-                        # recompute
-                        subtotal = subtotal_candidate
-                        iva_calc = iva_candidate
-                        total_calc = total_candidate
-
-        # Após ajuste, se itens tiverem taxa 0 e taxa_padrao detectada, aplicar taxa_padrao
-        if taxa_padrao is not None:
-            for it in normalized_items:
-                if safe_float(it.get("taxa_iva_percentagem", 0.0), 0.0) == 0.0:
-                    it["taxa_iva_percentagem"] = float(taxa_padrao)
-
-        # Recalcular subtotal/iva/total final com taxas atualizadas
-        subtotal = round(sum(safe_float(it["preco_unitario"], 0.0) * safe_float(it["quantidade"], 0.0) for it in normalized_items), 2)
-        iva_calc = round(sum(
-            (safe_float(it["preco_unitario"], 0.0) * safe_float(it["quantidade"], 0.0)) * (safe_float(it["taxa_iva_percentagem"], 0.0) / 100.0)
-            for it in normalized_items
-        ), 2)
-        total_calc = round(subtotal + iva_calc, 2)
+        cols = item_columns(data.get("items") or [], safe_float)
+        normalized_items, subtotal, iva_calc, total_calc = reconcile_items(cols, taxa_padrao, total_com_iva_footer)
 
         # Agora priorizar valores do rodapé quando existirem
         if total_iva_footer and safe_float(total_iva_footer, 0.0) > 0:
@@ -536,16 +1487,6 @@ def validar_e_corrigir_dados(data: Dict[str, Any], texto_ocr: str) -> Dict[str,
         else:
             data["valor_pago"] = float(f"{data.get('valor_total_documento', 0.0):.2f}")
 
-        # Normaliza itens finais (formatos e valores coerentes)
-        for it in normalized_items:
-            # Garantir tipos e formatação
-            it["preco_unitario"] = float(f"{safe_float(it.get('preco_unitario', 0.0)):.2f}")
-            # quantidade pode ser inteiro 1 ou decimal: limitar a 6 dígitos significativos
-            it["quantidade"] = float(it.get("quantidade", 0.0))
-            it["taxa_iva_percentagem"] = float(f"{safe_float(it.get('taxa_iva_percentagem', 0.0)):.2f}")
-            # calcular preco_total com base em unitário (sem inventar: unitario * quantidade)
-            it["preco_total_calculado"] = float(f"{round(it['preco_unitario'] * it['quantidade'], 2):.2f}")
-
         # Substituir items no data pela versão normalizada
         data["items"] = normalized_items
 
@@ -556,11 +1497,695 @@ def validar_e_corrigir_dados(data: Dict[str, Any], texto_ocr: str) -> Dict[str,
 
     except Exception as e:
         # Log do erro sem interromper fluxo
-        print(f"[VALIDACAO] Erro: {e}")
+        log.warning("erro na validação: %s", e)
 
     return data
 
 
+# =========================
+# Templates por fornecedor
+# =========================
+template_registry = TemplateRegistry(TEMPLATES_DB, to_float, canon, tolerance=TEMPLATES_TOLERANCE)
+
+def match_supplier_template(texto_ocr: str, texto_rodape: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    return template_registry.match(texto_ocr, detectar_totais(texto_ocr, texto_rodape))
+
+def learn_supplier_template(texto_ocr: str, data: Dict[str, Any]) -> Optional[str]:
+    """
+    Só resultados que reconciliam com o total do documento servem de base a um template.
+    """
+    if not resultado_consistente(data):
+        return None
+    return template_registry.learn(texto_ocr, data)
+
+
+# =========================
+# Execução concorrente
+# =========================
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """
+    Pool de processos de longa duração, partilhado por todos os pedidos deste worker uvicorn.
+    Usa 'spawn' para não herdar o event loop nem threads do processo principal.
+    """
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(
+            max_workers=OCR_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _cpu_pool
+
+def shutdown_cpu_pool() -> None:
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+
+async def run_cpu(fn, *args):
+    """
+    Executa uma etapa de CPU no pool de processos sem bloquear o event loop.
+    Se um processo filho morrer (ex.: OOM), o pool é recriado no próximo pedido.
+    """
+    loop = asyncio.get_running_loop()
+    CPU_TASKS.inc()
+    try:
+        with tracing.span(f"cpu:{fn.__name__}", pool_pending=int(CPU_TASKS.value()), pool_workers=OCR_PROCESSES):
+            return await loop.run_in_executor(get_cpu_pool(), fn, *args)
+    except BrokenProcessPool:
+        shutdown_cpu_pool()
+        raise HTTPException(status_code=503, detail="Worker de OCR reiniciado. Tente novamente.",
+                            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+    finally:
+        CPU_TASKS.dec()
+
+
+class AdmissionController:
+    """
+    Limita os documentos em processamento e a fila de espera.
+    Com a fila cheia, rejeita de imediato com 503 + Retry-After estimado.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int, retry_after: int):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.avg_seconds: Optional[float] = None
+        self._sem = asyncio.Semaphore(max_inflight)
+
+    def estimate_retry_after(self) -> int:
+        if self.avg_seconds is None:
+            return self.retry_after
+        # tempo até a fila atual escoar pelos slots disponíveis
+        drain = self.avg_seconds * (self.waiting + 1) / max(1, self.max_inflight)
+        return max(self.retry_after, math.ceil(drain))
+
+    def check(self) -> None:
+        """
+        503 se não houver slot livre e a fila estiver cheia.
+        """
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Servidor ocupado. Tente novamente mais tarde.",
+                headers={"Retry-After": str(self.estimate_retry_after())},
+            )
+
+    async def acquire(self, reject: bool = True) -> None:
+        """
+        reject=False: espera sempre (documentos de um lote já aceite com check()).
+        """
+        if reject:
+            self.check()
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+
+    def release(self, elapsed: float) -> None:
+        STAGE_SECONDS.observe(elapsed, stage="documento")
+        self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+        self.inflight -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self, reject: bool = True):
+        await self.acquire(reject)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+
+admission = AdmissionController(ADMISSION_MAX_INFLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_RETRY_AFTER)
+
+
+def document_cache_key(data_bytes: bytes) -> str:
+    return document_cache_key_from_hash(hashlib.sha256(data_bytes))
+
+def document_cache_key_from_hash(content_hash: "hashlib._Hash") -> str:
+    """
+    Chave do cache a partir do SHA-256 do conteúdo já calculado (ex.: durante o spool),
+    igual a document_cache_key(bytes do ficheiro).
+    """
+    config = {
+        "ocr_dpi": OCR_DPI,
+        "ocr_langs": OCR_LANGS,
+        "ocr_psm": OCR_PSM,
+        "llm_model": LLM_MODEL,
+        "llm_temperature": LLM_TEMPERATURE,
+        "max_chars_to_llm": MAX_CHARS_TO_LLM,
+        "llm_chunking": [LLM_CHUNKING, LLM_CHUNK_CHARS, LLM_CHUNK_OVERLAP_CHARS],
+        "ocr_adaptive": [OCR_ADAPTIVE, OCR_ADAPTIVE_DPI_LOW, OCR_ADAPTIVE_DPI_HIGH,
+                         OCR_ADAPTIVE_MIN_CONF, OCR_ADAPTIVE_WORD_CONF, OCR_ADAPTIVE_MAX_LOW_RATIO],
+        "ocr_roi": [OCR_ROI, OCR_ROI_NUMERIC_WHITELIST],
+        "ocr_hybrid": [OCR_HYBRID, OCR_HYBRID_MIN_AREA_RATIO, OCR_HYBRID_BAND_PT],
+        "image": [IMAGE_TARGET_DPI, IMAGE_MAX_MEGAPIXELS, IMAGE_TILE_PX, IMAGE_TILE_OVERLAP_PX],
+        "render": ["gray", OCR_MEMORY_BUDGET_MB, OCR_BYTES_PER_PIXEL],
+        "ocr_skip": [OCR_SKIP_BLANK, OCR_BLANK_MAX_INK, OCR_SEPARATOR_MAX_COMPONENTS, OCR_SKIP_DUPLICATES,
+                     OCR_DUP_MAX_HAMMING],
+        "prompt_version": PROMPT_VERSION,
+    }
+    h = content_hash.copy()
+    h.update(b"\0")
+    h.update(config_fingerprint(config))
+    return h.hexdigest()
+
+def file_sha256(path: str) -> "hashlib._Hash":
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h
+
+def write_chunk(f, h: "hashlib._Hash", chunk: bytes) -> None:
+    f.write(chunk)
+    h.update(chunk)
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def spool_upload(file: UploadFile, fname: str, max_bytes: Optional[int] = None,
+                       too_large: Optional[str] = None, spool_dir: Optional[str] = None,
+                       allow_empty: bool = False) -> Tuple[str, "hashlib._Hash"]:
+    """
+    Copia o upload em blocos de UPLOAD_CHUNK_BYTES para um ficheiro temporário (com a
+    extensão original), calculando o SHA-256 pelo caminho. Devolve (caminho, hash);
+    o chamador remove o ficheiro. 400 se vazio (salvo allow_empty), 413 (too_large)
+    assim que a leitura passa de max_bytes (por omissão UPLOAD_MAX_MB).
+    """
+    if max_bytes is None:
+        max_bytes = UPLOAD_MAX_MB * 1024 * 1024
+    if too_large is None:
+        too_large = f"Arquivo excede {UPLOAD_MAX_MB} MB."
+    start = time.perf_counter()
+    h = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(fname)[1], prefix="upload_",
+                                dir=spool_dir or UPLOAD_SPOOL_DIR)
+    try:
+        with tracing.span("upload") as sp, os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=too_large)
+                await asyncio.to_thread(write_chunk, f, h, chunk)
+            sp["attributes"]["bytes"] = size
+        if size == 0 and not allow_empty:
+            raise HTTPException(status_code=400, detail="Arquivo vazio.")
+    except BaseException:
+        await asyncio.to_thread(remove_file, path)
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="upload")
+    return path, h
+
+
+async def process_document(
+    path: str,
+    fname: str,
+    on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+    use_cache: bool = True,
+    content_hash: Optional["hashlib._Hash"] = None,
+) -> Dict[str, Any]:
+    """
+    Pipeline completo: OCR/texto embutido (pool de processos) -> LLM (async) -> validação (pool).
+    O documento é lido de `path`; content_hash (SHA-256 do conteúdo), se já calculado, evita
+    reler o ficheiro para a chave do cache.
+    on_stage, se indicado, é chamado no início de cada etapa ("extracao", "llm", "validacao").
+    Com use_cache=False o cache não é consultado, mas o resultado novo substitui a entrada antiga.
+    """
+    async def stage(name: str) -> None:
+        if on_stage is not None:
+            await on_stage(name)
+
+    cache_key = None
+    if DOC_CACHE_ENABLED:
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(file_sha256, path)
+        cache_key = document_cache_key_from_hash(content_hash)
+        if use_cache:
+            cached = await asyncio.to_thread(doc_cache.get, cache_key)
+            DOC_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                cached["cache"] = "hit"
+                return cached
+
+    await stage("extracao")
+    start = time.perf_counter()
+    document = await run_cpu(extract_document_from_path, path, fname)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="extracao")
+
+    return await structure_document(document, stage, cache_key, use_cache)
+
+
+async def structure_document(
+    document: Dict[str, Any],
+    stage: Callable[[str], Awaitable[None]],
+    cache_key: Optional[str],
+    use_cache: bool,
+) -> Dict[str, Any]:
+    """
+    Etapas após a extração de texto: LLM -> validação -> gravação no cache.
+    """
+    observe_document(document)
+    extracted_text = document["text"]
+
+    if not extracted_text or not extracted_text.strip():
+        raise HTTPException(status_code=400, detail="Nenhum texto extraído do documento.")
+
+    footer_text = document.get("footer_text")
+    extracted_data = None
+    source = {"tipo": "llm"}
+    if TEMPLATES_ENABLED:
+        await stage("template")
+        match = await run_cpu(match_supplier_template, extracted_text, footer_text)
+        if match is not None:
+            extracted_data = await run_cpu(validar_e_corrigir_dados, match["data"], extracted_text, footer_text)
+            if resultado_consistente(extracted_data):
+                source = {"tipo": "template", "template": match["key"]}
+            else:
+                await asyncio.to_thread(template_registry.report_failure, match["key"])
+                extracted_data = None
+
+    if extracted_data is None:
+        await stage("llm")
+        extracted_data = await arun_llm_structured_extraction(extracted_text)
+        await stage("validacao")
+        start = time.perf_counter()
+        extracted_data = await run_cpu(validar_e_corrigir_dados, extracted_data, extracted_text, footer_text)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="validacao")
+        if TEMPLATES_ENABLED and TEMPLATES_AUTO_LEARN:
+            learned = await run_cpu(learn_supplier_template, extracted_text, extracted_data)
+            if learned:
+                source["template_aprendido"] = learned
+
+    result = {
+        "extracted_text": extracted_text,
+        "extracted_data": extracted_data,
+        "extraction_source": source,
+        "ocr_report": {"pages": document["pages"], "stats": document["stats"]},
+    }
+    if cache_key is not None:
+        await asyncio.to_thread(doc_cache.set, cache_key, result)
+        result["cache"] = "miss" if use_cache else "bypass"
+    return result
+
+
+# =========================
+# Streaming por página
+# =========================
+_mp_manager = None
+
+def get_mp_manager():
+    """
+    Manager partilhado: fornece filas/eventos que atravessam a fronteira do pool de processos.
+    """
+    global _mp_manager
+    if _mp_manager is None:
+        _mp_manager = multiprocessing.get_context("spawn").Manager()
+    return _mp_manager
+
+def shutdown_mp_manager() -> None:
+    global _mp_manager
+    if _mp_manager is not None:
+        _mp_manager.shutdown()
+        _mp_manager = None
+
+def page_event(result: Dict[str, Any]) -> Dict[str, Any]:
+    event = {k: v for k, v in result.items() if k not in ("text", "footer_text", "spans")}
+    event["event"] = "page"
+    event["text"] = limpar_texto(result["text"])
+    return event
+
+def extract_document_streaming(path: str, fname: str, events, cancel) -> Dict[str, Any]:
+    """
+    Corre no pool de processos: publica cada página em `events` assim que fica pronta.
+    Se `cancel` for sinalizado (cliente desligou), pára antes da página seguinte.
+    """
+    if not fname.endswith(PAGED_EXTENSIONS):
+        document = build_document_result(extract_pages_from_image_path(path))
+        for page in document["pages"]:
+            events.put(page_event({**page, "text": document["text"]}))
+        return document
+
+    doc = fitz.open(path, filetype=document_filetype(fname))
+    pages: List[Dict[str, Any]] = []
+    try:
+        for result in iter_pdf_pages(doc):
+            pages.append(result)
+            events.put(page_event(result))
+            if cancel.is_set():
+                break
+    finally:
+        doc.close()
+    return build_document_result(pages)
+
+async def stream_document(path: str, content_hash: "hashlib._Hash", fname: str, company_id: int,
+                          use_cache: bool) -> AsyncIterator[bytes]:
+    """
+    Eventos NDJSON: "page" (um por página, por ordem de conclusão), "totals" (rodapé),
+    "result" (DocumentData validado) ou "error".
+    """
+    def line(obj: Dict[str, Any]) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+    async def no_stage(_name: str) -> None:
+        return None
+
+    cache_key = document_cache_key_from_hash(content_hash) if DOC_CACHE_ENABLED else None
+    if cache_key is not None and use_cache:
+        cached = await asyncio.to_thread(doc_cache.get, cache_key)
+        DOC_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield line({"event": "result", "company_id": company_id, "cache": "hit", **cached})
+            return
+
+    manager = get_mp_manager()
+    events = manager.Queue()
+    cancel = manager.Event()
+    loop = asyncio.get_running_loop()
+    pages: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    def pump() -> None:
+        # thread dedicada: get bloqueante na fila do Manager até ao sentinela (None)
+        while True:
+            event = events.get()
+            try:
+                loop.call_soon_threadsafe(pages.put_nowait, event)
+            except RuntimeError:  # event loop fechado
+                return
+            if event is None:
+                return
+
+    async def extract() -> Dict[str, Any]:
+        try:
+            return await run_cpu(extract_document_streaming, path, fname, events, cancel)
+        finally:
+            # depois da última página publicada pelo worker, ou se o worker falhou
+            await asyncio.to_thread(events.put, None)
+
+    threading.Thread(target=pump, name="stream-pages", daemon=True).start()
+    fut = asyncio.ensure_future(extract())
+    try:
+        while True:
+            event = await pages.get()
+            if event is None:
+                break
+            yield line(event)
+        document = await fut
+
+        footer_totals = await run_cpu(extract_totals_from_text, document.get("footer_text") or document["text"])
+        yield line({"event": "totals", "totals": footer_totals})
+
+        result = await structure_document(document, no_stage, cache_key, use_cache)
+        yield line({"event": "result", "company_id": company_id, **result})
+    except HTTPException as e:
+        yield line({"event": "error", "status_code": e.status_code, "detail": e.detail})
+    except Exception as e:
+        log.exception("erro no streaming", extra={"company_id": company_id})
+        yield line({"event": "error", "status_code": 500, "detail": f"Erro no processamento: {str(e)}"})
+    finally:
+        if not fut.done():
+            cancel.set()
+
+
+# =========================
+# Lotes (vários ficheiros / ZIP)
+# =========================
+def copy_zip_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, path: str) -> "hashlib._Hash":
+    """
+    Descomprime um membro do ZIP para path em blocos, com o SHA-256 pelo caminho.
+    """
+    h = hashlib.sha256()
+    with zf.open(info) as src, open(path, "wb") as dst:
+        for chunk in iter(lambda: src.read(UPLOAD_CHUNK_BYTES), b""):
+            write_chunk(dst, h, chunk)
+    return h
+
+def pdf_page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+def extract_pages_from_pdf_path(path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    """
+    Corre no pool de processos: uma fatia [start, stop) das páginas de um PDF em disco.
+    """
+    with fitz.open(path) as doc:
+        return list(iter_pdf_pages(doc, list(range(start, min(stop, doc.page_count)))))
+
+BatchEntry = Tuple[str, str, "hashlib._Hash"]  # (nome, caminho em disco, SHA-256)
+
+def expandir_lote(uploads: List[BatchEntry], workdir: str) -> List[BatchEntry]:
+    """
+    Abre os ZIP já gravados em disco (membros com extensão suportada, sem diretórios),
+    descomprimindo-os para workdir, e aplica os limites do lote ao conteúdo expandido.
+    Corre numa thread: a descompressão é CPU.
+    """
+    max_bytes = BATCH_MAX_TOTAL_MB * 1024 * 1024
+    total = 0
+    files: List[BatchEntry] = []
+
+    def add(entry: BatchEntry, size: int) -> None:
+        nonlocal total
+        total += size
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Lote excede {BATCH_MAX_TOTAL_MB} MB.")
+        files.append(entry)
+        if len(files) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Lote excede {BATCH_MAX_FILES} ficheiros.")
+
+    for name, path, h in uploads:
+        if not name.endswith(".zip"):
+            add((name, path, h), os.path.getsize(path))
+            continue
+        try:
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    member = info.filename.lower()
+                    if info.is_dir() or not member.endswith(SUPPORTED_EXTENSIONS):
+                        continue
+                    # o tamanho declarado protege contra ZIP bombs antes de descomprimir
+                    if total + info.file_size > max_bytes:
+                        raise HTTPException(status_code=413, detail=f"Lote excede {BATCH_MAX_TOTAL_MB} MB.")
+                    dest = os.path.join(workdir, f"zip_{len(files)}{os.path.splitext(member)[1]}")
+                    add((f"{name}/{info.filename}", dest, copy_zip_member(zf, info, dest)), info.file_size)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"ZIP inválido: {name}")
+        remove_file(path)
+    return files
+
+async def spool_batch(files: List[UploadFile], workdir: str) -> List[BatchEntry]:
+    """
+    Grava os uploads do lote em workdir à medida que chegam; o total lido não passa de
+    BATCH_MAX_TOTAL_MB (413 assim que o ultrapassa, sem ler o resto).
+    """
+    remaining = BATCH_MAX_TOTAL_MB * 1024 * 1024
+    uploads: List[BatchEntry] = []
+    for file in files:
+        fname = (file.filename or "").lower()
+        per_file = UPLOAD_MAX_MB * 1024 * 1024
+        too_large = f"Arquivo excede {UPLOAD_MAX_MB} MB." if per_file < remaining else f"Lote excede {BATCH_MAX_TOTAL_MB} MB."
+        path, h = await spool_upload(file, fname, min(per_file, remaining), too_large, workdir, allow_empty=True)
+        remaining -= os.path.getsize(path)
+        uploads.append((fname, path, h))
+    return uploads
+
+async def stream_batch(files: List[BatchEntry], company_id: int, use_cache: bool) -> AsyncIterator[bytes]:
+    """
+    Eventos NDJSON: um "file" por documento, pela ordem em que ficam prontos (resultado
+    validado ou erro desse ficheiro), e um "summary" no fim.
+    Cada documento ocupa um slot da admissão enquanto é processado (um lote grande conta
+    como tantos pedidos quantos os seus documentos). As tarefas de páginas de todos os
+    documentos passam por uma única fila FIFO limitada a BATCH_MAX_TASKS_IN_FLIGHT; cada
+    documento só põe na fila uma nova tarefa quando uma das suas termina, o que as
+    intercala entre documentos.
+    """
+    def line(obj: Dict[str, Any]) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+    async def no_stage(_name: str) -> None:
+        return None
+
+    start = time.monotonic()
+    events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    slots = asyncio.Semaphore(BATCH_MAX_TASKS_IN_FLIGHT)
+    counts = {"ok": 0, "erro": 0, "cache": 0}
+
+    def emit_error(name: str, e: BaseException) -> None:
+        if isinstance(e, HTTPException):
+            status_code, detail = e.status_code, e.detail
+        else:
+            log.error("erro no lote: %s", e, extra={"company_id": company_id, "ficheiro": name})
+            status_code, detail = 500, f"Erro no processamento: {str(e)}"
+        events.put_nowait({"event": "file", "filename": name, "status": "erro",
+                           "status_code": status_code, "detail": detail})
+
+    async def finish(doc: Dict[str, Any]) -> None:
+        try:
+            document = await asyncio.to_thread(build_document_result, doc["pages"])
+            result = await structure_document(document, no_stage, doc["cache_key"], use_cache)
+            events.put_nowait({"event": "file", "filename": doc["name"], "status": "ok", **result})
+        except Exception as e:
+            emit_error(doc["name"], e)
+
+    async def run_task(doc: Dict[str, Any], fn, *args) -> None:
+        async with slots:
+            if doc["failed"]:
+                return
+            try:
+                pages = await run_cpu(fn, *args)
+            except Exception as e:
+                if not doc["failed"]:
+                    doc["failed"] = True
+                    emit_error(doc["name"], e)
+                return
+        if not doc["failed"]:
+            doc["pages"].extend(pages)
+
+    async def prepare(name: str, path: str, content_hash: "hashlib._Hash") -> Optional[Dict[str, Any]]:
+        """
+        Cache e divisão em tarefas; devolve None se já respondido.
+        """
+        if await asyncio.to_thread(os.path.getsize, path) == 0:
+            raise HTTPException(status_code=400, detail="Arquivo vazio.")
+        cache_key = document_cache_key_from_hash(content_hash) if DOC_CACHE_ENABLED else None
+        if cache_key is not None and use_cache:
+            cached = await asyncio.to_thread(doc_cache.get, cache_key)
+            DOC_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                events.put_nowait({"event": "file", "filename": name, "status": "ok", "cache": "hit", **cached})
+                return None
+        doc = {"name": name, "cache_key": cache_key, "pages": [], "failed": False}
+        if os.path.splitext(name)[1].lower() in PAGED_EXTENSIONS:
+            n = await run_cpu(pdf_page_count, path)
+            doc["ranges"] = [(extract_pages_from_pdf_path, path, a, a + BATCH_PAGES_PER_TASK)
+                             for a in range(0, n, BATCH_PAGES_PER_TASK)]
+        else:
+            doc["ranges"] = [(extract_pages_from_image_path, path)]
+        return doc
+
+    async def run_document(name: str, path: str, content_hash: "hashlib._Hash") -> None:
+        async with admission.slot(reject=False):
+            try:
+                doc = await prepare(name, path, content_hash)
+            except Exception as e:
+                emit_error(name, e)
+                return
+            if doc is None:
+                counts["cache"] += 1
+                return
+            window = asyncio.Semaphore(BATCH_MAX_TASKS_IN_FLIGHT)
+            pending: List["asyncio.Task[None]"] = []
+            try:
+                for task_args in doc["ranges"]:
+                    await window.acquire()
+                    if doc["failed"]:
+                        window.release()
+                        break
+                    task = asyncio.ensure_future(run_task(doc, *task_args))
+                    task.add_done_callback(lambda _t: window.release())
+                    pending.append(task)
+                await asyncio.gather(*pending)
+            finally:
+                for task in pending:
+                    task.cancel()
+            if not doc["failed"]:
+                await finish(doc)
+
+    tasks = [asyncio.ensure_future(run_document(*entry)) for entry in files]
+    try:
+        for _ in range(len(files)):
+            event = await events.get()
+            counts["ok" if event["status"] == "ok" else "erro"] += 1
+            yield line({"company_id": company_id, **event})
+
+        yield line({"event": "summary", "company_id": company_id, "files": len(files), "ok": counts["ok"],
+                    "erros": counts["erro"], "cache_hits": counts["cache"],
+                    "seconds": round(time.monotonic() - start, 3)})
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# =========================
+# Jobs assíncronos
+# =========================
+_job_wakeup = asyncio.Event()
+
+async def heartbeat_job(job_id: str) -> None:
+    while True:
+        await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+        if not await asyncio.to_thread(job_store.heartbeat, job_id, JOB_OWNER):
+            log.warning("concessão do job perdida", extra={"job_id": job_id})
+            return
+
+async def run_job(job: Dict[str, Any]) -> None:
+    job_id = job["id"]
+
+    async def on_stage(name: str) -> None:
+        await asyncio.to_thread(job_store.set_stage, job_id, name, JOB_OWNER)
+
+    heartbeat = asyncio.create_task(heartbeat_job(job_id))
+    try:
+        with tracing.trace("job", job_id, company_id=job["company_id"], filename=job["filename"]):
+            result = await process_document(job["payload_path"], job["filename"].lower(), on_stage)
+        result = {"company_id": job["company_id"], **result}
+        await asyncio.to_thread(job_store.complete, job_id, result, JOB_OWNER)
+    except asyncio.CancelledError:
+        # shutdown a meio do job: volta para a fila para outro worker retomar
+        await asyncio.shield(asyncio.to_thread(job_store.requeue, job_id, JOB_OWNER))
+        raise
+    except HTTPException as e:
+        if e.status_code == 503:
+            # worker de OCR reiniciado (BrokenProcessPool): transitório, gasta uma tentativa
+            state = await asyncio.to_thread(job_store.retry, job_id, JOB_OWNER, str(e.detail))
+            log.warning("job devolvido à fila" if state == "queued" else "job sem mais tentativas",
+                        extra={"job_id": job_id, "attempts": job["attempts"]})
+        else:
+            await asyncio.to_thread(job_store.fail, job_id, str(e.detail), JOB_OWNER)
+    except Exception as e:
+        log.exception("erro no job", extra={"job_id": job_id})
+        await asyncio.to_thread(job_store.fail, job_id, f"Erro no processamento: {str(e)}", JOB_OWNER)
+    finally:
+        heartbeat.cancel()
+
+async def job_worker() -> None:
+    """
+    Drena a fila ao ritmo sustentável do pool: cada worker processa um job de cada vez.
+    Sem trabalho, recupera os jobs de processos que morreram (concessão expirada).
+    """
+    swept = time.monotonic()
+    while True:
+        job = await asyncio.to_thread(job_store.claim, JOB_OWNER)
+        if job is None:
+            if time.monotonic() - swept >= JOBS_LEASE_SECONDS:
+                swept = time.monotonic()
+                await asyncio.to_thread(job_store.requeue_stale)
+            _job_wakeup.clear()
+            try:
+                await asyncio.wait_for(_job_wakeup.wait(), timeout=JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job)
+
+
 # =========================
 # Endpoint
 # =========================
@@ -569,41 +2194,183 @@ async def ocr_and_structured_extract(
     file: UploadFile = File(...),
     # AQUI ESTÁ A MUDANÇA: company_id agora é do tipo 'int'
     company_id: int = Query(..., description="ID único da empresa para a qual o documento está a ser processado (número inteiro)."),
+    no_cache: bool = Query(False, description="Ignora o cache de resultados e reprocessa o documento."),
 ):
-    print(f"Recebida requisição para company_id: {company_id} (tipo: {type(company_id)})")
-
     fname = (file.filename or "").lower()
-    if not fname.endswith((".pdf", ".png", ".jpg", ".jpeg")):
-        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Envie PDF/PNG/JPG.")
+    log.info("pedido recebido", extra={"company_id": company_id, "ficheiro": fname})
+    if not fname.endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Envie PDF/PNG/JPG/TIFF.")
 
     # A validação do company_id agora é tratada automaticamente pelo Pydantic/FastAPI
     # Se o valor não puder ser convertido para int, um erro 422 será retornado.
 
     try:
-        data_bytes = await file.read()
-        if not data_bytes:
-            raise HTTPException(status_code=400, detail="Arquivo vazio.")
-
-        if fname.endswith(".pdf"):
-            extracted_text = extract_text_from_pdf_stream(data_bytes)
-        else:
-            extracted_text = extract_text_from_image_stream(data_bytes)
-
-        if not extracted_text or not extracted_text.strip():
-            raise HTTPException(status_code=400, detail="Nenhum texto extraído do documento.")
-
-        extracted_data = run_llm_structured_extraction(extracted_text)
-        extracted_data = validar_e_corrigir_dados(extracted_data, extracted_text)
+        with tracing.trace("POST /ocr", company_id=company_id, filename=fname):
+            async with admission.slot():
+                path, content_hash = await spool_upload(file, fname)
+                try:
+                    result = await process_document(path, fname, use_cache=not no_cache, content_hash=content_hash)
+                finally:
+                    await asyncio.to_thread(remove_file, path)
 
         # Retornar o company_id no resultado para confirmação
         return {
             "company_id": company_id, # O company_id aqui já será um int
-            "extracted_text": extracted_text,
-            "extracted_data": extracted_data
+            **result,
         }
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Erro no processamento para company_id {company_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erro no processamento: {str(e)}")
\ No newline at end of file
+        log.exception("erro no processamento", extra={"company_id": company_id})
+        raise HTTPException(status_code=500, detail=f"Erro no processamento: {str(e)}")
+
+@app.post("/ocr/stream")
+async def ocr_stream(
+    file: UploadFile = File(...),
+    company_id: int = Query(..., description="ID único da empresa para a qual o documento está a ser processado (número inteiro)."),
+    no_cache: bool = Query(False, description="Ignora o cache de resultados e reprocessa o documento."),
+):
+    """
+    Variante em streaming (NDJSON) do /ocr: o texto de cada página é enviado assim que
+    o OCR termina, seguido dos totais do rodapé e do resultado final validado.
+    Se o cliente fechar a ligação, o OCR das páginas restantes é interrompido.
+    """
+    fname = (file.filename or "").lower()
+    if not fname.endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Envie PDF/PNG/JPG/TIFF.")
+
+    await admission.acquire()
+    start = time.monotonic()
+    try:
+        path, content_hash = await spool_upload(file, fname)
+    except BaseException:
+        admission.release(time.monotonic() - start)
+        raise
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            with tracing.trace("POST /ocr/stream", company_id=company_id, filename=fname):
+                async for chunk in stream_document(path, content_hash, fname, company_id, use_cache=not no_cache):
+                    yield chunk
+        finally:
+            await asyncio.to_thread(remove_file, path)
+            admission.release(time.monotonic() - start)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.post("/ocr/batch")
+async def ocr_batch(
+    files: List[UploadFile] = File(...),
+    company_id: int = Query(..., description="ID único da empresa para a qual o documento está a ser processado (número inteiro)."),
+    no_cache: bool = Query(False, description="Ignora o cache de resultados e reprocessa o documento."),
+):
+    """
+    Vários ficheiros (PDF/PNG/JPG) e/ou arquivos ZIP num só pedido. Resposta em NDJSON:
+    um evento "file" por documento assim que fica pronto e um "summary" no fim.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Lote excede {BATCH_MAX_FILES} ficheiros.")
+    for file in files:
+        if not (file.filename or "").lower().endswith(SUPPORTED_EXTENSIONS + (".zip",)):
+            raise HTTPException(status_code=400, detail=f"Formato de arquivo não suportado: {file.filename}. Envie PDF/PNG/JPG/TIFF/ZIP.")
+    # rejeita antes de ler os ficheiros; cada documento espera depois pelo seu slot
+    admission.check()
+
+    workdir = tempfile.TemporaryDirectory(prefix="ocr_batch_", dir=UPLOAD_SPOOL_DIR)
+    try:
+        uploads = await spool_batch(files, workdir.name)
+        entries = await asyncio.to_thread(expandir_lote, uploads, workdir.name)
+        if not entries:
+            raise HTTPException(status_code=400, detail="Nenhum documento suportado no lote.")
+    except BaseException:
+        await asyncio.to_thread(workdir.cleanup)
+        raise
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            with tracing.trace("POST /ocr/batch", company_id=company_id, files=len(entries)):
+                async for chunk in stream_batch(entries, company_id, use_cache=not no_cache):
+                    yield chunk
+        finally:
+            await asyncio.to_thread(workdir.cleanup)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.get("/templates/stats")
+async def templates_stats():
+    return await asyncio.to_thread(template_registry.stats)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    company_id: int = Query(..., description="ID único da empresa para a qual o documento está a ser processado (número inteiro)."),
+):
+    """
+    Aceita o documento e devolve de imediato o id do job; o processamento decorre em segundo plano.
+    """
+    fname = (file.filename or "").lower()
+    if not fname.endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Envie PDF/PNG/JPG/TIFF.")
+
+    path, _ = await spool_upload(file, fname)
+    try:
+        job_id = await asyncio.to_thread(job_store.submit_file, fname, company_id, path)
+    finally:
+        await asyncio.to_thread(remove_file, path)
+    _job_wakeup.set()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "company_id": job["company_id"],
+        "filename": job["filename"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "finished_at": job["finished_at"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Métricas no formato de texto do Prometheus (latência por etapa, páginas, caches, filas).
+    """
+    body = await asyncio.to_thread(metrics_registry.render)
+    return Response(content=body, media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 só depois do prewarm (processos do pool com o Tesseract carregado
+    e cliente do LLM criado); antes disso, ou se o prewarm falhou, 503.
+    """
+    return JSONResponse(startup, status_code=200 if startup["ready"] else 503)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "documentos": await asyncio.to_thread(doc_cache.stats),
+        "paginas": await asyncio.to_thread(page_cache.stats),
+        "llm": llm_memo.stats(),
+    }
+
+
+startup["import_seconds"] = round(time.perf_counter() - _import_started, 3)
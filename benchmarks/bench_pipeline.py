@@ -0,0 +1,214 @@
+"""
+Benchmark offline dos componentes do pipeline sobre o corpus sintético (corpus.py).
+
+Para cada fatura (digital, rasterizada e ruidosa; 1 a --max-pages páginas) mede:
+  - extração (extract_document_from_pdf_stream): páginas/s por variante, latência
+    por etapa de página (render, preprocess, ocr, ...) e memória: o pico de RSS do
+    processo e dos filhos (ru_maxrss, inclui picos entre amostras) e o maior RSS
+    amostrado no fim das páginas;
+  - recall no texto dos campos conhecidos (NIF, n.º da fatura, data, totais);
+  - extract_totals_from_text: totais e taxa do rodapé contra os valores esperados;
+  - LLM + validar_e_corrigir_dados: o Groq é substituído pelo stub determinístico de
+    fake_groq.py, que lê a tabela do próprio texto do prompt (como faria o modelo) e
+    reproduz os desvios típicos das respostas (unitário com IVA, unitário em falta,
+    números em texto); mede-se a exatidão dos totais e dos itens depois da validação.
+
+Sem rede, sem caches (documento, página, templates) e sem exportação de traces.
+
+    python benchmarks/bench_pipeline.py [--docs 12] [--max-pages 200] [--seed 1] [--corpus DIR]
+                                        [--desvios 0.1] [--json resultados.json]
+
+Com --corpus, usa os PDF e o truth.json gravados por corpus.py em vez de os gerar.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, Any, List, Tuple, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+for _k, _v in {
+    "DOC_CACHE_ENABLED": "0", "PAGE_CACHE_ENABLED": "0", "TEMPLATES_ENABLED": "0",
+    "TRACE_EXPORTER": "none", "LOG_LEVEL": "WARNING",
+    "DOC_CACHE_DB": os.path.join(_tmp, "doc.db"), "PAGE_CACHE_DB": os.path.join(_tmp, "pag.db"),
+    "TEMPLATES_DB": os.path.join(_tmp, "tpl.db"), "JOBS_DB": os.path.join(_tmp, "jobs.db"),
+    "JOBS_DIR": os.path.join(_tmp, "jobs"), "GROQ_API_KEY": "stub",
+}.items():
+    os.environ.setdefault(_k, _v)
+
+import app  # noqa: E402
+from corpus import generate, kz  # noqa: E402
+from fake_groq import StubLLM  # noqa: E402
+
+
+# ---------- métricas ----------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def close(a: Any, b: float, tol: float = 0.01) -> bool:
+    return a is not None and abs(float(a) - b) <= tol
+
+
+def text_recall(text: str, truth: Dict[str, Any]) -> Tuple[int, int]:
+    flat = app.limpar_texto(text)
+    fields = [truth["nif"], truth["invoice_number"], truth["data_emissao"],
+              kz(truth["total_liquido"]), kz(truth["total_iva"]), kz(truth["valor_total_documento"])]
+    return sum(1 for f in fields if f in flat), len(fields)
+
+
+def totals_hits(det: Dict[str, Any], truth: Dict[str, Any]) -> Tuple[int, int]:
+    checks = [close(det.get("total_com_iva"), truth["valor_total_documento"]),
+              close(det.get("total_iva"), truth["total_iva"]),
+              close(det.get("total_liquido"), truth["total_liquido"]),
+              close(det.get("taxa_padrao"), truth["taxa_padrao"])]
+    return sum(checks), len(checks)
+
+
+def validated_hits(data: Dict[str, Any], truth: Dict[str, Any]) -> Tuple[int, int, int, int]:
+    """
+    (campos certos, campos, itens certos, itens esperados). Um item está certo se o
+    unitário (sem IVA) e a quantidade batem com o da mesma linha da fatura.
+    """
+    fields = [close(data.get("valor_total_documento"), truth["valor_total_documento"]),
+              close(data.get("total_iva"), truth["total_iva"]),
+              close(data.get("valor_pago"), truth["valor_pago"]),
+              data.get("invoice_number") == truth["invoice_number"],
+              data.get("data_emissao") == truth["data_emissao"]]
+    got = data.get("items") or []
+    items_ok = sum(
+        1 for g, t in zip(got, truth["items"])
+        if close(g.get("preco_unitario"), t["preco_unitario"]) and close(g.get("quantidade"), t["quantidade"], 1e-6)
+    )
+    return sum(fields), len(fields), items_ok, len(truth["items"])
+
+
+def load_corpus(path: str) -> List[Tuple[str, bytes, Dict[str, Any]]]:
+    with open(os.path.join(path, "truth.json"), encoding="utf-8") as f:
+        truths = json.load(f)
+    out = []
+    for name in sorted(truths):
+        with open(os.path.join(path, name), "rb") as f:
+            out.append((name, f.read(), truths[name]))
+    return out
+
+
+async def run(corpus: List[Tuple[str, bytes, Dict[str, Any]]]) -> Dict[str, Any]:
+    per_variant: Dict[str, Dict[str, Any]] = {}
+    stages: Dict[str, List[float]] = {}
+    doc_stages: Dict[str, List[float]] = {"extracao": [], "totais": [], "llm": [], "validacao": []}
+    max_rss = 0.0
+
+    for name, pdf, truth in corpus:
+        v = per_variant.setdefault(truth["variant"], {
+            "docs": 0, "pages": 0, "seconds": 0.0, "texto": [0, 0], "totais": [0, 0],
+            "campos": [0, 0], "itens": [0, 0]})
+
+        t0 = time.perf_counter()
+        document = app.extract_document_from_pdf_stream(pdf)
+        t1 = time.perf_counter()
+        det = app.detectar_totais(document["text"], document["footer_text"])
+        t2 = time.perf_counter()
+        data = await app.arun_llm_structured_extraction(document["text"])
+        t3 = time.perf_counter()
+        data = app.validar_e_corrigir_dados(data, document["text"], document["footer_text"])
+        t4 = time.perf_counter()
+
+        for stage, dur in zip(doc_stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            doc_stages[stage].append(dur)
+        for page in document["pages"]:
+            for stage, dur in (page.get("timings") or {}).items():
+                stages.setdefault(stage, []).append(dur)
+        max_rss = max(max_rss, document["stats"].get("max_rss_mb") or 0.0)
+
+        v["docs"] += 1
+        v["pages"] += len(document["pages"])
+        v["seconds"] += t1 - t0
+        for key, (ok, n) in (("texto", text_recall(document["text"], truth)), ("totais", totals_hits(det, truth))):
+            v[key][0] += ok
+            v[key][1] += n
+        f_ok, f_n, i_ok, i_n = validated_hits(data, truth)
+        v["campos"][0] += f_ok
+        v["campos"][1] += f_n
+        v["itens"][0] += i_ok
+        v["itens"][1] += i_n
+        print(f"{name}: {len(document['pages'])} pág. em {t1 - t0:.2f}s, itens {i_ok}/{i_n}", file=sys.stderr)
+
+    return {"variants": per_variant, "page_stages": stages, "doc_stages": doc_stages,
+            "max_sampled_rss_mb": max_rss,
+            "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None}
+
+
+def peak_rss_mb(who: int) -> Optional[float]:
+    """
+    Pico de RSS desde o arranque (getrusage: KB em Linux, bytes em macOS).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def ratio(pair: List[int]) -> float:
+    return pair[0] / pair[1] if pair[1] else 0.0
+
+
+def report(res: Dict[str, Any]) -> None:
+    print(f"{'variante':<12} {'docs':>5} {'pág.':>6} {'pág./s':>7} {'texto':>7} {'totais':>7} {'campos':>7} {'itens':>7}")
+    for name, v in res["variants"].items():
+        pps = v["pages"] / v["seconds"] if v["seconds"] else 0.0
+        print(f"{name:<12} {v['docs']:>5} {v['pages']:>6} {pps:>7.2f} {ratio(v['texto']):>7.1%} "
+              f"{ratio(v['totais']):>7.1%} {ratio(v['campos']):>7.1%} {ratio(v['itens']):>7.1%}")
+    print()
+    print(f"{'etapa':<22} {'n':>6} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for prefix, group in (("página/", res["page_stages"]), ("documento/", res["doc_stages"])):
+        for stage, values in group.items():
+            print(f"{prefix + stage:<22} {len(values):>6} {percentile(values, 0.5) * 1000:>9.1f} "
+                  f"{percentile(values, 0.95) * 1000:>9.1f}")
+    print()
+    print(f"pico de RSS (ru_maxrss): processo {res['peak_rss_mb']} MB, "
+          f"filhos (tesseract) {res['peak_rss_children_mb']} MB")
+    print(f"RSS máximo amostrado (fim de cada página): {res['max_sampled_rss_mb']} MB")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=12)
+    ap.add_argument("--max-pages", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--corpus", default=None)
+    ap.add_argument("--desvios", type=float, default=0.1)
+    ap.add_argument("--json", default=None)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate(args.docs, args.max_pages, args.seed)
+    stub = StubLLM(args.desvios)
+    app.llm = stub
+    try:
+        res = asyncio.run(run(corpus))
+    finally:
+        app.shutdown_cpu_pool()
+    res["llm_calls"] = stub.calls
+    report(res)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Tempo de arranque a frio.
+
+  - import: `import app` num interpretador novo, --runs vezes (mediana e mínimo), e os
+    módulos com maior tempo acumulado segundo `python -X importtime`;
+  - serviço (--serve): arranca `uvicorn app:app` e mede o tempo até à primeira resposta
+    HTTP (a aceitar ligações) e até /ready responder 200 (prewarm terminado).
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 15] [--serve] [--port 8011] [--timeout 300]
+
+Para não depender do Groq, o --serve pode apontar para o servidor falso
+(GROQ_API_BASE=http://127.0.0.1:8090, ver fake_groq.py).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Dict, Any, List, Tuple, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(runs: int) -> List[float]:
+    out = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import app"], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        out.append(time.perf_counter() - start)
+    return out
+
+
+def import_profile() -> List[Tuple[int, str]]:
+    """
+    (microssegundos acumulados, módulo) dos imports de topo (sem os submódulos).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):  # submódulo (indentado sob quem o importou)
+            continue
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)
+
+
+def status(url: str) -> Optional[int]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def time_serve(port: int, timeout: float) -> Dict[str, Any]:
+    url = f"http://127.0.0.1:{port}/ready"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = ready = None
+    body = None
+    try:
+        while time.perf_counter() - start < timeout and proc.poll() is None:
+            code = status(url)
+            if code is not None and listening is None:
+                listening = time.perf_counter() - start
+            if code == 200:
+                ready = time.perf_counter() - start
+                with urllib.request.urlopen(url, timeout=2) as resp:
+                    body = json.loads(resp.read())
+                break
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {"listening": listening, "ready": ready, "startup": body}
+
+
+def seconds(v: Optional[float]) -> str:
+    return f"{v:.2f}s" if v is not None else "—"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--port", type=int, default=8011)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    args = ap.parse_args()
+
+    times = time_import(args.runs)
+    print(f"import app: mediana {statistics.median(times):.2f}s, mínimo {min(times):.2f}s ({args.runs} execuções)")
+    print()
+    print(f"{'acumulado (ms)':>15}  módulo")
+    for cumulative, name in import_profile()[:args.top]:
+        print(f"{cumulative / 1000:>15.1f}  {name}")
+
+    if args.serve:
+        res = time_serve(args.port, args.timeout)
+        print()
+        print(f"uvicorn: a aceitar ligações em {seconds(res['listening'])}, "
+              f"pronto (/ready 200) em {seconds(res['ready'])}")
+        if res["startup"]:
+            print(json.dumps(res["startup"], ensure_ascii=False, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Micro-benchmark do scanner de totais (totals.extract_totals) contra a
+implementação anterior (um re.search por rótulo + padrão INCIDÊNCIA em DOTALL).
+
+Gera textos longos (várias páginas de itens + rodapé), confirma que os dois
+dão exatamente o mesmo resultado e mede o tempo de cada um.
+
+    python benchmarks/bench_totals.py [--pages 40] [--docs 200] [--seed 1]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import unicodedata
+from typing import Dict, List, Optional, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from totals import extract_totals  # noqa: E402
+
+
+# ---------- cópia da implementação anterior (referência) ----------
+def strip_accents(s: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+
+def canon(s: str) -> str:
+    return strip_accents(s).upper()
+
+def to_float(num_str: str) -> float:
+    if not num_str:
+        return 0.0
+    s = num_str.strip().replace('\u00A0', ' ')
+    s = re.sub(r'[^\d,.\-]', '', s)
+    if s.count(',') and s.count('.'):
+        last_comma = s.rfind(',')
+        last_dot = s.rfind('.')
+        if last_comma > last_dot:
+            s = s.replace('.', '')
+            s = s.replace(',', '.')
+        else:
+            s = s.replace(',', '')
+    else:
+        if s.count(','):
+            s = s.replace(',', '.')
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+def legacy_extract_totals_from_text(extracted_text: str) -> Dict[str, Optional[float]]:
+    out = {"total_com_iva": None, "total_iva": None, "total_liquido": None, "taxa_padrao": None}
+    t = canon(extracted_text)
+    labels_total = [
+        r'TOTAL\s*\(KZ\)', r'TOTAL\s+GERAL', r'TOTAL\s+A\s+PAGAR', r'TOTAL\s+A\s+LIQUIDAR',
+        r'TOTAL\s+PAGO', r'VALOR\s+A\s+PAGAR', r'VALOR\s+PAGO'
+    ]
+    for lab in labels_total:
+        m = re.search(rf'{lab}\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
+        if m:
+            out["total_com_iva"] = to_float(m.group(1))
+            break
+    labels_iva = [
+        r'TOTAL\s+IMPOSTOS', r'TOTAL\s+IVA', r'IVA\b', r'IMPOSTOS\b', r'IMPOSTO\b'
+    ]
+    for lab in labels_iva:
+        m = re.search(rf'{lab}\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
+        if m:
+            out["total_iva"] = to_float(m.group(1))
+            break
+    m = re.search(r'TOTAL\s+LIQUIDO\s*[:\-]?\s*([0-9\.\,\s]+)', t, flags=re.IGNORECASE)
+    if m:
+        out["total_liquido"] = to_float(m.group(1))
+    m = re.search(
+        r'INCID[ÊE]NCIA.*?([0-9\.\,\s]+).*?TAXA\s*%?\s*[:\-]?\s*([0-9]{1,2})(?:[,\.\s]\d+)?\s*%?.*?(?:VALOR|IMPOSTOS).*?([0-9\.\,\s]+)',
+        t, flags=re.IGNORECASE | re.DOTALL)
+    if m:
+        base = to_float(m.group(1))
+        taxa = float(m.group(2))
+        val_iva = to_float(m.group(3))
+        if base > 0 and val_iva > 0:
+            out["taxa_padrao"] = taxa
+            out["total_liquido"] = out["total_liquido"] or base
+            out["total_iva"] = out["total_iva"] or val_iva
+            out["total_com_iva"] = out["total_com_iva"] or round(base + val_iva, 2)
+    if out["total_com_iva"] is None and (out["total_liquido"] is not None and out["total_iva"] is not None):
+        out["total_com_iva"] = round(out["total_liquido"] + out["total_iva"], 2)
+    return out
+
+
+def scanner_extract_totals_from_text(extracted_text: str) -> Dict[str, Optional[float]]:
+    return extract_totals(canon(extracted_text), to_float)
+
+
+# ---------- corpus sintético ----------
+PRODUTOS = ["ARROZ AGULHA 25KG", "Óleo alimentar 5L", "CHOURIÇO 200G", "Água mineral 1,5L",
+            "Açúcar branco 1KG", "LEITE EM PÓ 400G", "SABÃO EM BARRA", "Farinha de milho 1KG"]
+RODAPES = [
+    "TOTAL LÍQUIDO: {base}\nTOTAL IMPOSTOS: {iva}\nTOTAL (KZ): {total}\n",
+    "Incidência {base} Taxa 14% Valor {iva}\nTOTAL A PAGAR {total}\n",
+    "INCIDÊNCIA\n{base}\nTAXA % : 14,00 %\nIMPOSTOS\n{iva}\n",
+    "Total Geral - {total}\nIVA {iva}\n",
+    "Resumo de impostos\nIncidência Taxa Valor\n",             # cadeia INCIDÊNCIA incompleta
+    "VALOR PAGO {total}\nAlternativa de pagamento 3\n",
+    "",
+]
+
+
+def fmt(v: float, rng: random.Random) -> str:
+    s = f"{v:,.2f}"
+    return rng.choice([s.replace(",", " ").replace(".", ","), s.replace(",", "X").replace(".", ",").replace("X", "."), s])
+
+
+def make_document(rng: random.Random, pages: int) -> str:
+    parts: List[str] = []
+    base = 0.0
+    for p in range(pages):
+        parts.append(f"FATURA FT A{rng.randint(1, 99)}/{rng.randint(1, 9999)}  Página {p + 1}\nDESCRIÇÃO QTD PREÇO IVA TOTAL\n")
+        for _ in range(rng.randint(15, 40)):
+            qtd, preco = rng.randint(1, 50), rng.uniform(100, 20000)
+            base += qtd * preco
+            parts.append(f"{rng.choice(PRODUTOS)} {qtd} {fmt(preco, rng)} 14% {fmt(qtd * preco, rng)}\n")
+    iva = base * 0.14
+    for _ in range(rng.randint(1, 2)):
+        parts.append(rng.choice(RODAPES).format(base=fmt(base, rng), iva=fmt(iva, rng), total=fmt(base + iva, rng)))
+    return "".join(parts)
+
+
+def bench(fn: Callable[[str], Dict[str, Optional[float]]], docs: List[str]) -> float:
+    start = time.perf_counter()
+    for d in docs:
+        fn(d)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=40)
+    ap.add_argument("--docs", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = [make_document(rng, rng.randint(1, args.pages)) for _ in range(args.docs)]
+    # caso patológico: muitas "INCIDÊNCIA" sem TAXA depois (retrocesso do padrão DOTALL)
+    docs.append("INCIDÊNCIA 1.000,00 IMPOSTOS ABC\n" * 200)
+
+    mismatches = 0
+    for d in docs:
+        a, b = legacy_extract_totals_from_text(d), scanner_extract_totals_from_text(d)
+        if a != b:
+            mismatches += 1
+            print("DIFERENÇA:", a, b)
+    print(f"{len(docs)} documentos, {sum(map(len, docs)) / 1e6:.1f} M caracteres, {mismatches} diferenças")
+
+    legacy = bench(legacy_extract_totals_from_text, docs)
+    scanner = bench(scanner_extract_totals_from_text, docs)
+    print(f"anterior: {legacy:.3f}s  scanner: {scanner:.3f}s  ({legacy / scanner:.1f}x)")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
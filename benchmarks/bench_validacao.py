@@ -0,0 +1,236 @@
+"""
+Micro-benchmark da reconciliação de itens em colunas (reconcile.py) contra a
+implementação anterior item a item de validar_e_corrigir_dados.
+
+Para cada tamanho (10 .. 10 000 itens) gera faturas sintéticas com os casos das
+heurísticas (unitário em falta, unitário com IVA incluído, taxa ausente, nomes
+de campos alternativos, valores em texto, totais de rodapé com e sem IVA),
+confirma que os itens normalizados e os totais são idênticos e mede o tempo.
+
+    python benchmarks/bench_validacao.py [--sizes 10,100,1000,10000] [--docs 20] [--seed 1]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from typing import Optional, Dict, Any, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reconcile import item_columns, reconcile_items  # noqa: E402
+
+
+# ---------- cópia da implementação anterior (referência) ----------
+def to_float(num_str: str) -> float:
+    if not num_str:
+        return 0.0
+    s = num_str.strip().replace('\u00A0', ' ')
+    s = re.sub(r'[^\d,.\-]', '', s)
+    if s.count(',') and s.count('.'):
+        last_comma = s.rfind(',')
+        last_dot = s.rfind('.')
+        if last_comma > last_dot:
+            s = s.replace('.', '')
+            s = s.replace(',', '.')
+        else:
+            s = s.replace(',', '')
+    else:
+        if s.count(','):
+            s = s.replace(',', '.')
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+def safe_float(x: Any, default: float = 0.0) -> float:
+    try:
+        if x is None:
+            return float(default)
+        if isinstance(x, float):
+            return x
+        if isinstance(x, int):
+            return float(x)
+        if isinstance(x, str):
+            s = x.strip()
+            if s == "":
+                return float(default)
+            return to_float(s)
+        return float(x)
+    except Exception:
+        return float(default)
+
+def first_present(d: Dict[str, Any], keys: List[str], default=None):
+    for k in keys:
+        if k in d and d[k] is not None:
+            return d[k]
+    return default
+
+def legacy_reconcile(items: List[Dict[str, Any]], taxa_padrao: Optional[float],
+                     total_com_iva_footer: Optional[float]) -> Tuple[List[Dict[str, Any]], float, float, float]:
+    normalized_items = []
+    for it in items:
+        descricao = first_present(it, ["descricao", "descrição", "descricao_item", "desc", "descricao_produto"], "")
+        preco_unit = first_present(it, ["preco_unitario", "preco_unit", "unit_price", "preco_unitario_item"], None)
+        preco_total = first_present(it, ["preco_total", "valor_total_item", "valor", "total", "sub_total"], None)
+        quantidade = first_present(it, ["quantidade", "qtd", "quantidade_item", "qty"], 0)
+        taxa = first_present(it, ["taxa_iva_percentagem", "taxa", "iva_percent", "iva_percentagem"], None)
+        quantidade_f = safe_float(quantidade, 0.0)
+        preco_unit_f = None if preco_unit is None else safe_float(preco_unit, 0.0)
+        preco_total_f = None if preco_total is None else safe_float(preco_total, 0.0)
+        if (preco_unit_f is None or preco_unit_f == 0.0) and preco_total_f not in (None, 0.0) and quantidade_f > 0:
+            preco_unit_f = round(preco_total_f / quantidade_f, 2)
+        taxa_f = None
+        if taxa not in (None, ""):
+            taxa_f = safe_float(taxa, 0.0)
+        if (taxa_f is None or taxa_f == 0.0) and taxa_padrao is not None:
+            taxa_f = float(taxa_padrao)
+        if preco_unit_f not in (None, 0.0) and preco_total_f not in (None, 0.0) and quantidade_f > 0:
+            calc = round(preco_unit_f * quantidade_f, 2)
+            if abs(calc - preco_total_f) < 0.01:
+                if taxa_f and taxa_f > 0:
+                    unit_sem_iva = round(preco_unit_f / (1.0 + taxa_f / 100.0), 2)
+                    preco_unit_f = unit_sem_iva
+        normalized = {
+            "descricao": descricao or "",
+            "preco_unitario": float(f"{(preco_unit_f or 0.0):.2f}"),
+            "quantidade": float(f"{quantidade_f:.6g}"),
+            "taxa_iva_percentagem": float(taxa_f or 0.0),
+        }
+        if preco_total_f not in (None, 0.0):
+            normalized["preco_total_extraido"] = float(f"{preco_total_f:.2f}")
+        normalized_items.append(normalized)
+
+    subtotal = 0.0
+    iva_calc = 0.0
+    for it in normalized_items:
+        q = safe_float(it.get("quantidade", 0.0))
+        u = safe_float(it.get("preco_unitario", 0.0))
+        t_tax = safe_float(it.get("taxa_iva_percentagem", 0.0))
+        subtotal += round(u * q, 2)
+        iva_calc += round((u * q) * (t_tax / 100.0), 2)
+    subtotal = round(subtotal, 2)
+    iva_calc = round(iva_calc, 2)
+    total_calc = round(subtotal + iva_calc, 2)
+
+    if total_com_iva_footer and abs(total_calc - float(total_com_iva_footer)) > 0.5:
+        taxas_presentes = {round(safe_float(it.get("taxa_iva_percentagem", 0.0)), 6) for it in normalized_items}
+        if len(taxas_presentes) == 1:
+            taxa_hom = taxas_presentes.pop()
+            if taxa_hom > 0:
+                subtotal_candidate = 0.0
+                iva_candidate = 0.0
+                for it in normalized_items:
+                    q = safe_float(it["quantidade"], 0.0)
+                    u_incl = safe_float(it["preco_unitario"], 0.0)
+                    u_excl = round(u_incl / (1.0 + taxa_hom / 100.0), 2)
+                    subtotal_candidate += round(u_excl * q, 2)
+                    iva_candidate += round((u_excl * q) * (taxa_hom / 100.0), 2)
+                total_candidate = round(subtotal_candidate + iva_candidate, 2)
+                if abs(total_candidate - float(total_com_iva_footer)) < abs(total_calc - float(total_com_iva_footer)):
+                    for it in normalized_items:
+                        u_incl = safe_float(it["preco_unitario"], 0.0)
+                        u_excl = round(u_incl / (1.0 + taxa_hom / 100.0), 2)
+                        it["preco_unitario"] = float(f"{u_excl:.2f}")
+
+    if taxa_padrao is not None:
+        for it in normalized_items:
+            if safe_float(it.get("taxa_iva_percentagem", 0.0), 0.0) == 0.0:
+                it["taxa_iva_percentagem"] = float(taxa_padrao)
+
+    subtotal = round(sum(safe_float(it["preco_unitario"], 0.0) * safe_float(it["quantidade"], 0.0) for it in normalized_items), 2)
+    iva_calc = round(sum(
+        (safe_float(it["preco_unitario"], 0.0) * safe_float(it["quantidade"], 0.0)) * (safe_float(it["taxa_iva_percentagem"], 0.0) / 100.0)
+        for it in normalized_items
+    ), 2)
+    total_calc = round(subtotal + iva_calc, 2)
+
+    for it in normalized_items:
+        it["preco_unitario"] = float(f"{safe_float(it.get('preco_unitario', 0.0)):.2f}")
+        it["quantidade"] = float(it.get("quantidade", 0.0))
+        it["taxa_iva_percentagem"] = float(f"{safe_float(it.get('taxa_iva_percentagem', 0.0)):.2f}")
+        it["preco_total_calculado"] = float(f"{round(it['preco_unitario'] * it['quantidade'], 2):.2f}")
+    return normalized_items, subtotal, iva_calc, total_calc
+
+
+def columnar_reconcile(items: List[Dict[str, Any]], taxa_padrao: Optional[float],
+                       total_com_iva_footer: Optional[float]) -> Tuple[List[Dict[str, Any]], float, float, float]:
+    return reconcile_items(item_columns(items, safe_float), taxa_padrao, total_com_iva_footer)
+
+
+# ---------- faturas sintéticas ----------
+def money(rng: random.Random, v: float) -> Any:
+    # mistura floats, valores com 3 casas (empates em .xx5) e texto com vírgula decimal
+    kind = rng.random()
+    if kind < 0.5:
+        return round(v, 2)
+    if kind < 0.7:
+        return round(v, 3)
+    if kind < 0.9:
+        return f"{v:,.2f}".replace(",", " ").replace(".", ",")
+    return str(round(v, 2))
+
+
+def make_invoice(rng: random.Random, n: int) -> Tuple[List[Dict[str, Any]], Optional[float], Optional[float]]:
+    taxa_doc = rng.choice([14.0, 7.0, 5.0, 0.0])
+    iva_incluido = rng.random() < 0.3
+    items: List[Dict[str, Any]] = []
+    total = 0.0
+    for i in range(n):
+        q = rng.choice([1, 2, 3, 1.5, 0.25, 12, 100, "2", "1,5", None])
+        unit = rng.uniform(1, 5000)
+        qn = safe_float(q)
+        shown_unit = unit * (1 + taxa_doc / 100) if iva_incluido else unit
+        total += unit * qn * (1 + taxa_doc / 100)
+        it: Dict[str, Any] = {rng.choice(["descricao", "desc", "descrição"]): f"PRODUTO {i}"}
+        r = rng.random()
+        if r < 0.6:
+            it[rng.choice(["preco_unitario", "preco_unit", "unit_price"])] = money(rng, shown_unit)
+        elif r < 0.7:
+            it["preco_unitario"] = 0
+        if rng.random() < 0.5 or r >= 0.6:
+            it[rng.choice(["preco_total", "valor", "total"])] = money(rng, shown_unit * qn)
+        if q is not None:
+            it[rng.choice(["quantidade", "qtd", "qty"])] = q
+        r = rng.random()
+        if r < 0.6:
+            it[rng.choice(["taxa_iva_percentagem", "taxa", "iva_percent"])] = rng.choice([taxa_doc, str(taxa_doc), f"{taxa_doc:.0f}%"])
+        elif r < 0.7:
+            it["taxa_iva_percentagem"] = rng.choice([0, "", None])
+        items.append(it)
+    taxa_padrao = rng.choice([None, taxa_doc])
+    footer = rng.choice([None, round(total, 2), round(total * 1.01, 2)])
+    return items, taxa_padrao, footer
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,10000")
+    ap.add_argument("--docs", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    mismatches = 0
+    print(f"{'itens':>7} {'anterior (ms)':>14} {'colunas (ms)':>13} {'ganho':>6}")
+    for n in [int(s) for s in args.sizes.split(",")]:
+        invoices = [make_invoice(rng, n) for _ in range(args.docs)]
+        for inv in invoices:
+            if legacy_reconcile(*inv) != columnar_reconcile(*inv):
+                mismatches += 1
+        start = time.perf_counter()
+        for inv in invoices:
+            legacy_reconcile(*inv)
+        legacy = (time.perf_counter() - start) / len(invoices)
+        start = time.perf_counter()
+        for inv in invoices:
+            columnar_reconcile(*inv)
+        columnar = (time.perf_counter() - start) / len(invoices)
+        print(f"{n:>7} {legacy * 1000:>14.2f} {columnar * 1000:>13.2f} {legacy / columnar:>5.1f}x")
+    print(f"{mismatches} diferenças")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Corpus sintético de faturas angolanas (PyMuPDF) com os valores esperados.
+
+Cada documento tem cabeçalho (fornecedor, NIF, n.º FT, data), tabela de itens em
+várias páginas e rodapé com o quadro INCIDÊNCIA / TAXA / VALOR e os totais, com
+números no formato 1.234.567,89. Variantes:
+  - digital:     PDF com texto embutido;
+  - rasterizado: cada página convertida numa imagem (só OCR);
+  - ruidoso:     como rasterizado, com rotação ligeira, ruído e manchas.
+
+    python benchmarks/corpus.py --out corpus --docs 20 [--max-pages 200] [--seed 1]
+
+grava <out>/<id>.pdf e <out>/truth.json (valores esperados por documento).
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from typing import Dict, Any, List, Tuple
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+VARIANTS = ("digital", "rasterizado", "ruidoso")
+
+FORNECEDORES = [
+    ("COMERCIAL KWANZA, LDA", "5417000123"), ("DISTRIBUIDORA MUTAMBA, SA", "5401234567"),
+    ("MERCADO DO KILAMBA, LDA", "5000987654"), ("ARMAZENS DO CAZENGA, LDA", "5417766554"),
+    ("SUPERMERCADO TALATONA", "5419988776"), ("FERRAGENS DA MAIANGA, LDA", "5401122334"),
+]
+PRODUTOS = [
+    "ARROZ AGULHA 25KG", "OLEO ALIMENTAR 5L", "ACUCAR BRANCO 1KG", "FARINHA DE MILHO 1KG",
+    "LEITE EM PO 400G", "AGUA MINERAL 1,5L", "SABAO EM BARRA", "FEIJAO CATARINA 1KG",
+    "MASSA ESPARGUETE 500G", "SAL IODADO 1KG", "CIMENTO 50KG", "VARAO DE FERRO 12MM",
+]
+TAXA_IVA = 14.0
+LINES_PER_PAGE = 28
+DPI = 200
+
+
+def kz(v: float) -> str:
+    """1234567.891 -> '1.234.567,89'"""
+    s = f"{v:,.2f}"
+    return s.replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def make_truth(rng: random.Random, n_pages: int) -> Dict[str, Any]:
+    fornecedor, nif = rng.choice(FORNECEDORES)
+    n_items = max(1, n_pages * LINES_PER_PAGE - rng.randint(6, 12))
+    items = []
+    for _ in range(n_items):
+        qtd = float(rng.choice([1, 2, 3, 5, 10, 12, 24, 50]))
+        unit = round(rng.uniform(150, 60000), 2)
+        items.append({"descricao": rng.choice(PRODUTOS), "quantidade": qtd, "preco_unitario": unit,
+                      "taxa_iva_percentagem": TAXA_IVA, "total": round(unit * qtd, 2)})
+    liquido = round(sum(it["total"] for it in items), 2)
+    iva = round(sum(round(it["total"] * TAXA_IVA / 100.0, 2) for it in items), 2)
+    total = round(liquido + iva, 2)
+    return {
+        "supplier_name": fornecedor,
+        "nif": nif,
+        "invoice_number": f"FT A{rng.randint(2023, 2025)}/{rng.randint(1, 99999)}",
+        "data_emissao": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2023, 2025)}",
+        "items": items,
+        "total_liquido": liquido,
+        "total_iva": iva,
+        "valor_total_documento": total,
+        "valor_pago": total,
+        "taxa_padrao": TAXA_IVA,
+        "pages": n_pages,
+    }
+
+
+def write_lines(page: fitz.Page, y: float, lines: List[str], size: float = 9) -> float:
+    for line in lines:
+        page.insert_text((40, y), line, fontsize=size, fontname="cour")
+        y += size * 1.5
+    return y
+
+
+def digital_pdf(truth: Dict[str, Any]) -> bytes:
+    doc = fitz.open()
+    items = truth["items"]
+    n_pages = truth["pages"]
+    for p in range(n_pages):
+        page = doc.new_page(width=595, height=842)  # A4
+        y = write_lines(page, 50, [truth["supplier_name"], f"NIF: {truth['nif']}", "Luanda - Angola"], 11)
+        y = write_lines(page, y + 10, [
+            f"FACTURA {truth['invoice_number']}",
+            f"Data de Emissao: {truth['data_emissao']}    Pagina {p + 1}/{n_pages}",
+            "",
+            f"{'DESCRICAO':<24}{'QTD':>6}{'PRECO UNIT.':>15}{'IVA%':>7}{'TOTAL':>16}",
+        ], 9)
+        for it in items[p * LINES_PER_PAGE:(p + 1) * LINES_PER_PAGE]:
+            y = write_lines(page, y, [
+                f"{it['descricao']:<24}{it['quantidade']:>6.0f}{kz(it['preco_unitario']):>15}"
+                f"{it['taxa_iva_percentagem']:>6.0f}%{kz(it['total']):>16}"
+            ], 9)
+        if p == n_pages - 1:
+            write_lines(page, max(y + 20, 650), [
+                "QUADRO RESUMO DE IMPOSTOS",
+                f"INCIDENCIA {kz(truth['total_liquido'])}  TAXA {truth['taxa_padrao']:.0f}%  VALOR {kz(truth['total_iva'])}",
+                "",
+                f"TOTAL LIQUIDO: {kz(truth['total_liquido'])}",
+                f"TOTAL IMPOSTOS: {kz(truth['total_iva'])}",
+                f"TOTAL (KZ): {kz(truth['valor_total_documento'])}",
+            ], 10)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def degrade(img: np.ndarray, rng: random.Random) -> np.ndarray:
+    """
+    Digitalização fraca: rotação até ±1.5°, ruído gaussiano, sal e pimenta e uma mancha.
+    """
+    h, w = img.shape
+    nrng = np.random.default_rng(rng.randint(0, 2 ** 31))
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-1.5, 1.5), 1.0)
+    img = cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+    noisy = img.astype(np.int16) + nrng.normal(0, 12, img.shape).astype(np.int16)
+    salt = nrng.random(img.shape)
+    noisy[salt < 0.002] = 0
+    noisy[salt > 0.998] = 255
+    cx, cy = rng.randint(0, w - 1), rng.randint(0, h - 1)
+    cv2.circle(noisy, (cx, cy), rng.randint(10, 40), 170, -1)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def rasterized_pdf(digital: bytes, noisy: bool, rng: random.Random) -> bytes:
+    src = fitz.open(stream=digital, filetype="pdf")
+    out = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(dpi=DPI, colorspace=fitz.csGRAY, alpha=False)
+        img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+        if noisy:
+            img = degrade(img, rng)
+        ok, png = cv2.imencode(".png", img)
+        dst = out.new_page(width=page.rect.width, height=page.rect.height)
+        dst.insert_image(dst.rect, stream=png.tobytes())
+    data = out.tobytes(garbage=3, deflate=True)
+    src.close()
+    out.close()
+    return data
+
+
+def make_document(rng: random.Random, n_pages: int, variant: str) -> Tuple[bytes, Dict[str, Any]]:
+    truth = make_truth(rng, n_pages)
+    truth["variant"] = variant
+    pdf = digital_pdf(truth)
+    if variant != "digital":
+        pdf = rasterized_pdf(pdf, variant == "ruidoso", rng)
+    return pdf, truth
+
+
+def page_counts(rng: random.Random, docs: int, max_pages: int) -> List[int]:
+    """
+    Maioria de faturas curtas, algumas longas e pelo menos uma com max_pages.
+    """
+    counts = [min(max_pages, rng.choice([1, 1, 1, 2, 2, 3, 5, 10, 25])) for _ in range(docs)]
+    if counts:
+        counts[-1] = max_pages
+    return counts
+
+
+def generate(docs: int, max_pages: int, seed: int, variants=VARIANTS) -> List[Tuple[str, bytes, Dict[str, Any]]]:
+    rng = random.Random(seed)
+    out = []
+    for i, n in enumerate(page_counts(rng, docs, max_pages)):
+        variant = variants[i % len(variants)]
+        pdf, truth = make_document(rng, n, variant)
+        out.append((f"fatura_{i:04d}_{variant}_{n}p.pdf", pdf, truth))
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--docs", type=int, default=20)
+    ap.add_argument("--max-pages", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    truths = {}
+    for name, pdf, truth in generate(args.docs, args.max_pages, args.seed):
+        with open(os.path.join(args.out, name), "wb") as f:
+            f.write(pdf)
+        truths[name] = truth
+        print(f"{name}: {len(pdf) / 1024:.0f} KB", file=sys.stderr)
+    with open(os.path.join(args.out, "truth.json"), "w", encoding="utf-8") as f:
+        json.dump(truths, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
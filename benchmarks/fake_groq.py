@@ -0,0 +1,284 @@
+"""
+Servidor local compatível com a API de chat do Groq (POST /openai/v1/chat/completions),
+para testes de carga sem rede e sem custo.
+
+As respostas são determinísticas (dependem só do prompt): o "modelo" lê a tabela de
+itens e os totais do texto da fatura que vem no prompt, no formato das faturas de
+corpus.py, e devolve o JSON pedido pelo prompt (documento completo, só cabeçalho ou
+só itens de um bloco), com uma fração de desvios típicos (unitário com IVA incluído,
+unitário em falta, números em texto). A latência e a taxa de erros são configuráveis.
+
+    python benchmarks/fake_groq.py [--port 8090] [--latency-ms 800] [--jitter-ms 200]
+                                   [--ms-per-1k-chars 20] [--error-rate 0.01] [--error-status 500]
+                                   [--desvios 0.1] [--seed 1]
+
+e a aplicação aponta para ele com:
+
+    GROQ_API_BASE=http://127.0.0.1:8090 GROQ_API_KEY=local uvicorn app:app
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+AMOUNT = r"\d{1,3}(?:\.\d{3})*,\d{2}"
+ROW = re.compile(rf"(\d+) ({AMOUNT}) (\d+(?:[.,]\d+)?) ?% ({AMOUNT})")
+
+
+def to_float(s: str) -> float:
+    """'1.234.567,89' -> 1234567.89 (formato das faturas do corpus)"""
+    return float(s.replace(".", "").replace(",", "."))
+
+
+def kz(v: float) -> str:
+    s = f"{v:,.2f}"
+    return s.replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+# =========================
+# "Modelo" determinístico
+# =========================
+class InvoiceResponder:
+    """
+    `desvios` é a fração de documentos com unitários com IVA incluído e de linhas
+    sem unitário ou com números em texto.
+    """
+
+    def __init__(self, desvios: float = 0.1):
+        self.desvios = desvios
+
+    @staticmethod
+    def _rng(text: str) -> random.Random:
+        return random.Random(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16))
+
+    def header(self, text: str) -> Dict[str, Any]:
+        def find(pattern: str) -> Optional[str]:
+            m = re.search(pattern, text, re.IGNORECASE)
+            return m.group(1) if m else None
+
+        def amount(label: str) -> float:
+            v = find(label + rf"\s*:?\s*({AMOUNT})")
+            return to_float(v) if v else 0.0
+
+        total = amount(r"TOTAL \(KZ\)")
+        return {
+            "supplier_name": (find(r"^\s*(.+?)\s+NIF") or "").strip(),
+            "nif": find(r"NIF:?\s*(\d{9,10})"),
+            "invoice_number": find(r"FACTURA\s+(FT\s*\S+)") or "",
+            "data_emissao": find(r"(\d{2}-\d{2}-\d{4})") or "",
+            "valor_total_documento": total,
+            "total_iva": amount(r"TOTAL IMPOSTOS"),
+            "valor_pago": total,
+        }
+
+    def items(self, text: str) -> List[Dict[str, Any]]:
+        rng = self._rng(text[:200])
+        iva_incluido = rng.random() < self.desvios
+        items = []
+        prev = 0
+        for m in ROW.finditer(text):
+            desc = text[prev:m.start()].strip()
+            desc = desc.rsplit("TOTAL ", 1)[-1].strip()
+            prev = m.end()
+            qtd = float(m.group(1))
+            unit = to_float(m.group(2))
+            taxa = float(m.group(3).replace(",", "."))
+            total = to_float(m.group(4))
+            if iva_incluido:
+                unit = round(unit * (1 + taxa / 100.0), 2)
+                total = round(unit * qtd, 2)
+            item: Dict[str, Any] = {"descricao": desc, "quantidade": qtd, "taxa_iva_percentagem": taxa}
+            r = rng.random()
+            if r < self.desvios:
+                item["total"] = total  # sem unitário: só o valor da linha
+            elif r < 2 * self.desvios:
+                item["preco_unitario"] = kz(unit)
+                item["quantidade"] = f"{qtd:g}"
+            else:
+                item["preco_unitario"] = unit
+            items.append(item)
+        return items
+
+    def respond(self, prompt: str) -> str:
+        """
+        O JSON que o prompt pede: cabeçalho (prompt de documento longo), itens de um
+        bloco, ou o documento completo.
+        """
+        text = prompt.rsplit("TEXTO:", 1)[-1]
+        if "Não extraia itens" in prompt:
+            data = self.header(text)
+        elif "bloco da tabela de itens" in prompt:
+            data = {"items": self.items(text)}
+        else:
+            data = dict(self.header(text), items=self.items(text))
+        return json.dumps(data, ensure_ascii=False)
+
+
+class StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """
+    Substitui o ChatGroq no próprio processo: mesma interface (invoke / ainvoke -> .content).
+    """
+
+    def __init__(self, desvios: float = 0.1):
+        self.responder = InvoiceResponder(desvios)
+        self.calls = 0
+
+    def invoke(self, prompt: str) -> StubMessage:
+        self.calls += 1
+        return StubMessage(self.responder.respond(prompt))
+
+    async def ainvoke(self, prompt: str) -> StubMessage:
+        return self.invoke(prompt)
+
+
+# =========================
+# Servidor HTTP
+# =========================
+class FakeGroq:
+    def __init__(self, responder: InvoiceResponder, latency_ms: float, jitter_ms: float,
+                 ms_per_1k_chars: float, error_rate: float, error_status: int, seed: int):
+        self.responder = responder
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ms_per_1k_chars = ms_per_1k_chars
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.inflight = 0
+        self.max_inflight = 0
+
+    def draw(self, prompt_chars: int) -> Tuple[float, bool]:
+        """
+        (atraso em segundos, falha?) do próximo pedido.
+        """
+        with self._lock:
+            jitter = self._rng.gauss(0.0, self.jitter_ms) if self.jitter_ms > 0 else 0.0
+            fail = self._rng.random() < self.error_rate
+        delay_ms = max(0.0, self.latency_ms + jitter + self.ms_per_1k_chars * prompt_chars / 1000.0)
+        return delay_ms / 1000.0, fail
+
+    def enter(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+
+    def leave(self, failed: bool) -> None:
+        with self._lock:
+            self.inflight -= 1
+            self.errors += int(failed)
+
+
+def completion(model: str, content: str, prompt_chars: int) -> Dict[str, Any]:
+    prompt_tokens = max(1, prompt_chars // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                     "logprobs": None, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+        "system_fingerprint": None,
+        "x_groq": {"id": f"req_{uuid.uuid4().hex}"},
+    }
+
+
+def make_handler(fake: FakeGroq):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/models"):
+                self._send(200, {"object": "list", "data": []})
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length)
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            try:
+                body = json.loads(raw)
+                prompt = next(m["content"] for m in reversed(body["messages"]) if m.get("role") == "user")
+            except (ValueError, KeyError, StopIteration):
+                self._send(400, {"error": {"message": "pedido inválido", "type": "invalid_request_error"}})
+                return
+
+            delay, fail = fake.draw(len(prompt))
+            fake.enter()
+            try:
+                time.sleep(delay)
+                if fail:
+                    headers = {"Retry-After": "1"} if fake.error_status == 429 else None
+                    self._send(fake.error_status, {"error": {"message": "erro simulado", "type": "server_error"}}, headers)
+                else:
+                    content = fake.responder.respond(prompt)
+                    self._send(200, completion(body.get("model", "fake"), content, len(prompt)))
+            finally:
+                fake.leave(fail)
+
+        def log_message(self, fmt: str, *args: Any) -> None:
+            return None
+
+    return Handler
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--latency-ms", type=float, default=800.0)
+    ap.add_argument("--jitter-ms", type=float, default=200.0)
+    ap.add_argument("--ms-per-1k-chars", type=float, default=20.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=500)
+    ap.add_argument("--desvios", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    fake = FakeGroq(InvoiceResponder(args.desvios), args.latency_ms, args.jitter_ms, args.ms_per_1k_chars,
+                    args.error_rate, args.error_status, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"fake Groq em http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{fake.requests} pedidos, {fake.errors} erros, máx. {fake.max_inflight} em simultâneo", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Teste de carga ponta a ponta contra uma instância a correr (por omissão POST /ocr).
+
+Repete os documentos de um corpus (corpus.py) em patamares de carga e, por patamar,
+mede a latência p50/p95/p99 dos pedidos com sucesso, o débito (documentos/s) e os
+erros por tipo (503 = recusado pela admissão, outros códigos HTTP, timeouts).
+Dois modos:
+  - fechado (--concurrency 1,2,4,8): N clientes, cada um envia o pedido seguinte
+    quando recebe a resposta;
+  - aberto (--rates 0.5,1,2): chegadas de Poisson a R pedidos/s, até --max-inflight
+    pedidos em curso. A latência conta desde a chegada planeada, por isso inclui a
+    espera no cliente quando o servidor não acompanha (sem coordinated omission).
+
+Para planear capacidade sem rede, a instância usa o Groq falso:
+
+    python benchmarks/fake_groq.py --latency-ms 800 --error-rate 0.01 &
+    GROQ_API_BASE=http://127.0.0.1:8090 GROQ_API_KEY=local uvicorn app:app --port 8000 &
+    python benchmarks/corpus.py --out corpus --docs 40 --max-pages 20
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --corpus corpus \\
+        [--concurrency 1,2,4,8 | --rates 0.5,1,2,4] [--duration 60] [--timeout 600] [--json curva.json]
+
+Os pedidos levam no_cache=true (o cache de documentos esconderia o custo real);
+--with-cache desliga isso. As respostas do LLM continuam memorizadas por processo:
+um corpus com mais documentos do que pedidos por patamar evita repetições.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate  # noqa: E402
+
+CONTENT_TYPES = {".pdf": "application/pdf", ".png": "image/png", ".jpg": "image/jpeg",
+                 ".jpeg": "image/jpeg", ".tif": "image/tiff", ".tiff": "image/tiff"}
+
+
+def multipart(name: str, data: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    ctype = CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        f"Content-Type: {ctype}\r\n\r\n"
+    ).encode("utf-8") + data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def load_corpus(path: str) -> List[Tuple[str, bytes]]:
+    names = sorted(n for n in os.listdir(path) if n.lower().endswith(tuple(CONTENT_TYPES)))
+    out = []
+    for name in names:
+        with open(os.path.join(path, name), "rb") as f:
+            out.append((name, f.read()))
+    return out
+
+
+class Client:
+    def __init__(self, url: str, company_id: int, use_cache: bool, timeout: float,
+                 corpus: List[Tuple[str, bytes]]):
+        query = {"company_id": company_id}
+        if not use_cache:
+            query["no_cache"] = "true"
+        self.url = f"{url}?{urllib.parse.urlencode(query)}"
+        self.timeout = timeout
+        self.bodies = [multipart(name, data) for name, data in corpus]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def next_body(self) -> Tuple[bytes, str]:
+        with self._lock:
+            body = self.bodies[self._next % len(self.bodies)]
+            self._next += 1
+        return body
+
+    def send(self) -> Tuple[str, float]:
+        """
+        (resultado, fim). resultado: "ok", o código HTTP de erro ou "timeout"/"ligacao".
+        """
+        data, ctype = self.next_body()
+        req = urllib.request.Request(self.url, data=data, method="POST",
+                                     headers={"Content-Type": ctype, "X-Request-ID": uuid.uuid4().hex})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+            return "ok", time.perf_counter()
+        except urllib.error.HTTPError as e:
+            e.read()
+            return str(e.code), time.perf_counter()
+        except (TimeoutError, OSError) as e:
+            reason = getattr(e, "reason", e)
+            kind = "timeout" if isinstance(reason, TimeoutError) or "timed out" in str(reason) else "ligacao"
+            return kind, time.perf_counter()
+
+
+def closed_loop(client: Client, workers: int, duration: float) -> List[Tuple[float, str, float]]:
+    """
+    (chegada, resultado, latência) de cada pedido iniciado no patamar.
+    """
+    results: List[Tuple[float, str, float]] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker() -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            outcome, end = client.send()
+            with lock:
+                results.append((start, outcome, end - start))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def open_loop(client: Client, rate: float, duration: float, max_inflight: int,
+              rng: random.Random) -> List[Tuple[float, str, float]]:
+    results: List[Tuple[float, str, float]] = []
+    lock = threading.Lock()
+
+    def request(arrival: float) -> None:
+        outcome, end = client.send()
+        with lock:
+            results.append((arrival, outcome, end - arrival))
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        start = time.perf_counter()
+        arrival = start
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= start + duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(request, arrival)
+    return results
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def summarize(level: str, results: List[Tuple[float, str, float]]) -> Dict[str, Any]:
+    ok = [lat for _, outcome, lat in results if outcome == "ok"]
+    errors: Dict[str, int] = {}
+    for _, outcome, _ in results:
+        if outcome != "ok":
+            errors[outcome] = errors.get(outcome, 0) + 1
+    if results:
+        first = min(a for a, _, _ in results)
+        last = max(a + lat for a, _, lat in results)
+        wall = max(1e-9, last - first)
+    else:
+        wall = 0.0
+    return {
+        "level": level,
+        "sent": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "throughput": round(len(ok) / wall, 4) if wall else 0.0,
+        "p50": round(percentile(ok, 0.50), 3),
+        "p95": round(percentile(ok, 0.95), 3),
+        "p99": round(percentile(ok, 0.99), 3),
+        "max": round(max(ok), 3) if ok else 0.0,
+    }
+
+
+def print_row(row: Optional[Dict[str, Any]]) -> None:
+    if row is None:
+        print(f"{'patamar':>10} {'enviados':>9} {'ok':>6} {'erros':>7} {'doc/s':>7} "
+              f"{'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8}  detalhe")
+        return
+    detail = " ".join(f"{k}:{v}" for k, v in sorted(row["errors"].items()))
+    print(f"{row['level']:>10} {row['sent']:>9} {row['ok']:>6} {row['error_rate']:>7.1%} {row['throughput']:>7.2f} "
+          f"{row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f}  {detail}", flush=True)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--endpoint", default="/ocr")
+    ap.add_argument("--corpus", default=None)
+    ap.add_argument("--docs", type=int, default=20)
+    ap.add_argument("--max-pages", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--company-id", type=int, default=1)
+    ap.add_argument("--concurrency", default=None)
+    ap.add_argument("--rates", default=None)
+    ap.add_argument("--max-inflight", type=int, default=64)
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--pause", type=float, default=5.0)
+    ap.add_argument("--timeout", type=float, default=600.0)
+    ap.add_argument("--with-cache", action="store_true")
+    ap.add_argument("--json", default=None)
+    args = ap.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = [(name, pdf) for name, pdf, _ in generate(args.docs, args.max_pages, args.seed)]
+    if not corpus:
+        ap.error("corpus vazio")
+    client = Client(args.url.rstrip("/") + args.endpoint, args.company_id, args.with_cache, args.timeout, corpus)
+    rng = random.Random(args.seed)
+
+    if args.rates:
+        levels = [("rate", float(r)) for r in args.rates.split(",")]
+    else:
+        levels = [("concurrency", int(c)) for c in (args.concurrency or "1,2,4,8").split(",")]
+
+    rows = []
+    print_row(None)
+    for i, (mode, value) in enumerate(levels):
+        if i and args.pause > 0:
+            time.sleep(args.pause)  # deixa terminar o que ficou em curso no servidor
+        if mode == "rate":
+            results = open_loop(client, value, args.duration, args.max_inflight, rng)
+            label = f"{value:g}/s"
+        else:
+            results = closed_loop(client, value, args.duration)
+            label = f"c={value}"
+        row = summarize(label, results)
+        rows.append(row)
+        print_row(row)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"url": client.url, "docs": len(corpus), "duration": args.duration, "levels": rows},
+                      f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
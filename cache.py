@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import atexit
+import weakref
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+# =========================
+# Cache em disco (SQLite) partilhado entre processos
+# =========================
+# LRU limitado por tamanho total + TTL. Vários workers uvicorn (e os processos
+# do pool de OCR) podem abrir o mesmo ficheiro: as escritas são serializadas
+# pelo SQLite (WAL). As leituras são SELECT simples numa ligação por thread (em WAL
+# não esperam pelas escritas); os contadores e o last_access das leituras ficam em
+# memória e são gravados em lote (ver DiskCache.flush) e à saída do processo.
+# O tamanho total fica na tabela stats ("bytes"), atualizado por cada escrita: o set
+# não soma a tabela inteira para decidir se despeja.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS idx_entries_created_at ON entries (created_at);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+STAT_NAMES = ("hits", "misses", "sets", "evictions", "expirations")
+
+# leituras acumuladas antes de gravar contadores / last_access (ou ao fim de FLUSH_SECONDS)
+FLUSH_EVERY = 64
+FLUSH_SECONDS = 5.0
+# entradas lidas de cada vez ao despejar (por ordem de last_access)
+EVICT_BATCH = 64
+
+_caches: "weakref.WeakSet[DiskCache]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all() -> None:
+    # também nos processos do pool de OCR (spawn: saem por sys.exit, que corre o atexit)
+    for c in list(_caches):
+        try:
+            c.flush()
+        except sqlite3.Error:
+            pass
+
+
+def sha256_hex(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p)
+    return h.hexdigest()
+
+
+def config_fingerprint(config: Dict[str, Any]) -> bytes:
+    """
+    Serialização estável da configuração efetiva, para entrar na chave do cache.
+    """
+    return json.dumps(config, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class DiskCache:
+    """
+    Cache chave -> JSON com despejo LRU por bytes e expiração por TTL.
+    max_bytes <= 0 ou ttl_seconds <= 0 desativam o respetivo limite.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int, ttl_seconds: float):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._initialized = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._touched: Dict[str, float] = {}
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+        _caches.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _db(self):
+        """
+        Ligação deste processo/thread, aberta uma vez e reutilizada (o pid protege
+        contra ligações herdadas num fork).
+        """
+        if not self._initialized:
+            self.init()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def init(self) -> None:
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            conn.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)", [(n,) for n in STAT_NAMES])
+            # bases anteriores ao total mantido: soma uma vez
+            conn.execute("INSERT OR IGNORE INTO stats (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+        finally:
+            conn.close()
+        self._initialized = True
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, name: str, n: int = 1) -> None:
+        if n:
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = ?", (n, name))
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Leitura sem transação de escrita. Entradas expiradas contam como miss e são
+        apagadas pelo próximo set.
+        """
+        now = time.time()
+        with self._db() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        hit = row is not None and not self._expired(row[1], now)
+        self._record("hits" if hit else "misses", key if hit else None, now)
+        return json.loads(row[0]) if hit else None
+
+    def _record(self, name: str, key: Optional[str], now: float) -> None:
+        with self._lock:
+            self._counts[name] += 1
+            if key is not None:
+                self._touched[key] = now
+            self._pending += 1
+            due = self._pending >= FLUSH_EVERY or time.monotonic() - self._flushed_at >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def _take_pending(self) -> "tuple[Counter, Dict[str, float]]":
+        with self._lock:
+            counts, touched = self._counts, self._touched
+            self._counts, self._touched = Counter(), {}
+            self._pending = 0
+            self._flushed_at = time.monotonic()
+        return counts, touched
+
+    def _write_pending(self, conn: sqlite3.Connection, counts: Counter, touched: Dict[str, float]) -> None:
+        for name, n in counts.items():
+            self._bump(conn, name, n)
+        if touched:
+            conn.executemany("UPDATE entries SET last_access = MAX(last_access, ?) WHERE key = ?",
+                             [(t, k) for k, t in touched.items()])
+
+    def flush(self) -> None:
+        """
+        Grava os contadores e os last_access acumulados pelas leituras numa só transação.
+        """
+        counts, touched = self._take_pending()
+        if not counts and not touched:
+            return
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_pending(conn, counts, touched)
+            conn.execute("COMMIT")
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+        now = time.time()
+        counts, touched = self._take_pending()
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # o LRU considera as leituras acumuladas antes de despejar
+            self._write_pending(conn, counts, touched)
+            old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, now, now),
+            )
+            self._bump(conn, "sets")
+            self._bump(conn, "bytes", size - (old[0] if old else 0))
+            if self.ttl_seconds > 0:
+                limit = now - self.ttl_seconds
+                n, freed = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE created_at < ?",
+                                        (limit,)).fetchone()
+                if n:
+                    conn.execute("DELETE FROM entries WHERE created_at < ?", (limit,))
+                    self._bump(conn, "expirations", n)
+                    self._bump(conn, "bytes", -freed)
+            if self.max_bytes > 0:
+                self._evict(conn)
+            conn.execute("COMMIT")
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+        evicted = freed = 0
+        while total - freed > self.max_bytes:
+            batch = conn.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT ?",
+                                 (EVICT_BATCH,)).fetchall()
+            if not batch:
+                break
+            for key, size in batch:
+                if total - freed <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                freed += size
+                evicted += 1
+        self._bump(conn, "evictions", evicted)
+        self._bump(conn, "bytes", -freed)
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        with self._db() as conn:
+            out: Dict[str, Any] = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = out.get("hits", 0) + out.get("misses", 0)
+        out["entries"] = entries
+        out["max_bytes"] = self.max_bytes
+        out["ttl_seconds"] = self.ttl_seconds
+        out["hit_rate"] = round(out.get("hits", 0) / lookups, 4) if lookups else 0.0
+        return out
+
+
+# =========================
+# Memo em memória para chamadas assíncronas (LLM)
+# =========================
+class AsyncMemo:
+    """
+    LRU limitado por número de entradas, com coalescência de chamadas em curso:
+    pedidos concorrentes com a mesma chave esperam pela mesma tarefa.
+    A tarefa corre desacoplada de quem a iniciou, por isso o cancelamento de um
+    cliente não cancela a chamada para os restantes. Erros não são memorizados.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def peek(self, key: str) -> Optional[Any]:
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        """
+        Esquece um valor já memorizado (ex.: resposta que afinal não é válida).
+        """
+        self._data.pop(key, None)
+
+    def _on_done(self, key: str, task: "asyncio.Task[Any]") -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.errors += 1
+            return
+        self.put(key, task.result())
+
+    async def get_or_compute(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.peek(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "entries": len(self._data),
+            "inflight": len(self._inflight),
+            "max_entries": self.max_entries,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,167 @@
+import struct
+from typing import Optional, Tuple, List
+
+import cv2
+import numpy as np
+
+# =========================
+# Imagens grandes: leitura do cabeçalho, descodificação reduzida e faixas
+# =========================
+# Fotografias de 50 MP e digitalizações A0 não passam inteiras pelo Tesseract:
+# o cabeçalho dá as dimensões (e a resolução, se existir) sem descodificar, a
+# descodificação já sai em tons de cinzento e, quando possível, reduzida pelo
+# próprio libjpeg (IMREAD_REDUCED_*), e o que continuar grande é lido em faixas
+# horizontais sobrepostas.
+
+A4_LONG_SIDE_IN = 11.69
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+
+def is_tiff(data: bytes) -> bool:
+    return data[:4] in (b"II*\x00", b"MM\x00*")
+
+
+def _png_header(data: bytes) -> Optional[Tuple[int, int, Optional[float]]]:
+    w, h = struct.unpack(">II", data[16:24])
+    dpi = None
+    pos = 8
+    # pHYs vem antes de IDAT; não é preciso ler o resto do ficheiro
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if kind == b"pHYs" and length == 9:
+            ppu_x, _, unit = struct.unpack(">IIB", data[pos + 8:pos + 17])
+            if unit == 1 and ppu_x > 0:
+                dpi = ppu_x * 0.0254
+            break
+        if kind == b"IDAT":
+            break
+        pos += 12 + length
+    return w, h, dpi
+
+
+def _jpeg_header(data: bytes) -> Optional[Tuple[int, int, Optional[float]]]:
+    pos = 2
+    dpi = None
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xE0 and data[pos + 4:pos + 9] == b"JFIF\x00":
+            unit, xd = data[pos + 11], struct.unpack(">H", data[pos + 12:pos + 14])[0]
+            if xd > 1:
+                dpi = float(xd) if unit == 1 else (xd * 2.54 if unit == 2 else None)
+        elif marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            h, w = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return w, h, dpi
+        pos += 2 + length
+    return None
+
+
+def probe(data: bytes) -> Optional[Tuple[int, int, Optional[float]]]:
+    """
+    (largura, altura, dpi ou None) lidos só do cabeçalho PNG/JPEG; None se desconhecido.
+    """
+    try:
+        if data[:8] == b"\x89PNG\r\n\x1a\n":
+            return _png_header(data)
+        if data[:2] == b"\xff\xd8":
+            return _jpeg_header(data)
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+def effective_dpi(w: int, h: int, dpi: Optional[float]) -> float:
+    """
+    Resolução declarada ou, sem ela (fotografias), a que o lado maior teria numa folha A4.
+    """
+    if dpi and dpi >= 50:
+        return dpi
+    return max(w, h) / A4_LONG_SIDE_IN
+
+
+def decode_scaled(data: bytes, target_dpi: float, max_pixels: int) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Descodifica em tons de cinzento já reduzida para ~target_dpi (nunca amplia) e no
+    máximo max_pixels. Devolve (imagem, dpi efetivo da imagem devolvida).
+    data também pode ser um mmap do ficheiro (lido sem cópia).
+    """
+    header = probe(data)
+    arr = np.frombuffer(data, np.uint8)
+    if header is None:
+        img = cv2.imdecode(arr, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None, target_dpi
+        w, h, dpi = img.shape[1], img.shape[0], None
+    else:
+        w, h, dpi = header
+        img = None
+    src_dpi = effective_dpi(w, h, dpi)
+    scale = min(1.0, target_dpi / src_dpi)
+    if w * h * scale * scale > max_pixels:
+        scale = (max_pixels / float(w * h)) ** 0.5
+
+    factor = 1
+    if img is None:
+        flag = cv2.IMREAD_GRAYSCALE
+        for factor, reduced in _REDUCED_FLAGS:
+            if 1.0 / factor >= scale:
+                flag = reduced
+                break
+        else:
+            factor = 1
+        img = cv2.imdecode(arr, flag)
+        if img is None:
+            return None, target_dpi
+    del arr
+
+    # a partir da imagem descodificada: a orientação EXIF pode ter trocado largura e altura
+    tw = max(1, int(round(img.shape[1] * factor * scale)))
+    th = max(1, int(round(img.shape[0] * factor * scale)))
+    if (img.shape[1], img.shape[0]) != (tw, th):
+        img = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+    return img, src_dpi * scale
+
+
+def strip_bounds(h: int, strip: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Faixas horizontais (y0, y1) de altura `strip`, com `overlap` pixels em comum entre
+    faixas vizinhas (uma linha de texto cortada fica inteira numa delas).
+    """
+    if h <= strip:
+        return [(0, h)]
+    step = max(1, strip - overlap)
+    out: List[Tuple[int, int]] = []
+    y0 = 0
+    while True:
+        y1 = min(h, y0 + strip)
+        out.append((y0, y1))
+        if y1 == h:
+            return out
+        y0 += step
+
+
+def merge_overlapping_lines(prev: str, nxt: str, max_lines: int = 8) -> str:
+    """
+    Junta o texto de duas faixas consecutivas; as linhas lidas duas vezes na faixa
+    de sobreposição (fim de prev = início de nxt) ficam uma só vez.
+    """
+    a = [ln for ln in prev.splitlines() if ln.strip()]
+    b = [ln for ln in nxt.splitlines() if ln.strip()]
+    norm_a = [" ".join(ln.split()) for ln in a]
+    norm_b = [" ".join(ln.split()) for ln in b]
+    for k in range(min(max_lines, len(a), len(b)), 0, -1):
+        if norm_a[-k:] == norm_b[:k]:
+            b = b[k:]
+            break
+    return "\n".join(a + b)
@@ -0,0 +1,279 @@
+import os
+import json
+import shutil
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+# =========================
+# Fila persistente de jobs (SQLite local, sem broker externo)
+# =========================
+# Estados: queued -> running -> done | failed
+# O ficheiro enviado fica em disco até o job terminar; o resultado fica na base.
+# Um job 'running' pertence ao worker que o reservou (owner) enquanto a concessão
+# (lease_until) for renovada por heartbeat; só concessões expiradas voltam à fila.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    filename TEXT NOT NULL,
+    company_id INTEGER NOT NULL,
+    payload_path TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+# colunas acrescentadas depois da 1.ª versão do esquema (bases já existentes)
+MIGRATIONS = {"owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+              "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL"}
+
+
+class JobStore:
+    """
+    Fila durável partilhável entre vários processos uvicorn no mesmo host.
+    A reserva de um job é atómica (BEGIN IMMEDIATE) e fica com o owner do worker e uma
+    concessão de lease_seconds; as escritas seguintes do worker só valem enquanto o job
+    for seu, por isso um job recuperado por outro worker não é concluído duas vezes.
+    """
+
+    def __init__(self, db_path: str, payload_dir: str, max_attempts: int = 3, lease_seconds: float = 60.0):
+        self.db_path = db_path
+        self.payload_dir = payload_dir
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _db(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def init(self) -> None:
+        os.makedirs(self.payload_dir, exist_ok=True)
+        with self._db() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, ddl in MIGRATIONS.items():
+                if name not in columns:
+                    conn.execute(ddl)
+
+    # ---------- produtor ----------
+    def submit_file(self, filename: str, company_id: int, src_path: str) -> str:
+        """
+        Regista um trabalho para um ficheiro já em disco: é movido (sem o ler para
+        memória) para a pasta dos payloads.
+        """
+        job_id = uuid.uuid4().hex
+        payload_path = self._payload_path(job_id, filename)
+        shutil.move(src_path, payload_path)
+        with open(payload_path, "rb") as f:
+            os.fsync(f.fileno())
+        return self._insert(job_id, filename, company_id, payload_path)
+
+    def _payload_path(self, job_id: str, filename: str) -> str:
+        return os.path.join(self.payload_dir, f"{job_id}{os.path.splitext(filename)[1]}")
+
+    def _insert(self, job_id: str, filename: str, company_id: int, payload_path: str) -> str:
+        now = time.time()
+        with self._db() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, filename, company_id, payload_path, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, filename, company_id, payload_path, now, now),
+            )
+        return job_id
+
+    # ---------- consumidor ----------
+    def claim(self, owner: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ?, "
+                "owner = ?, lease_until = ? WHERE id = ?",
+                (now, now, owner, now + self.lease_seconds, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        job = dict(row)
+        job["attempts"] += 1
+        job["owner"] = owner
+        return job
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        """
+        Renova a concessão. False se o job já não é deste worker (concessão expirada e
+        job devolvido à fila ou concluído por outro).
+        """
+        now = time.time()
+        with self._db() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running' AND owner = ?",
+                (now + self.lease_seconds, now, job_id, owner),
+            )
+        return cur.rowcount == 1
+
+    def set_stage(self, job_id: str, stage: str, owner: str) -> None:
+        """
+        Marca o início de uma etapa; a etapa anterior fica concluída com a sua duração.
+        """
+        now = time.time()
+        with self._db() as conn:
+            row = conn.execute("SELECT stage, progress FROM jobs WHERE id = ? AND status = 'running' AND owner = ?",
+                               (job_id, owner)).fetchone()
+            if row is None:
+                return
+            progress = json.loads(row["progress"] or "{}")
+            prev = row["stage"]
+            if prev and prev in progress and progress[prev]["status"] == "running":
+                progress[prev]["status"] = "done"
+                progress[prev]["seconds"] = round(now - progress[prev]["started_at"], 3)
+            progress[stage] = {"status": "running", "started_at": now}
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (stage, json.dumps(progress), now, job_id, owner),
+            )
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str],
+                owner: Optional[str]) -> bool:
+        """
+        Fecha o job. Com owner, só se o job ainda for desse worker.
+        """
+        now = time.time()
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT stage, progress, payload_path, status, owner FROM jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+            if row is None or (owner is not None and (row["status"] != "running" or row["owner"] != owner)):
+                conn.execute("COMMIT")
+                return False
+            progress = json.loads(row["progress"] or "{}")
+            prev = row["stage"]
+            if prev and prev in progress and progress[prev]["status"] == "running":
+                progress[prev]["status"] = "done" if status == "done" else "failed"
+                progress[prev]["seconds"] = round(now - progress[prev]["started_at"], 3)
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, payload_path = NULL, "
+                "owner = NULL, lease_until = NULL, updated_at = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(progress), None if result is None else json.dumps(result),
+                 error, now, now, job_id),
+            )
+            conn.execute("COMMIT")
+        self._remove_payload(row["payload_path"])
+        return True
+
+    def complete(self, job_id: str, result: Dict[str, Any], owner: str) -> bool:
+        return self._finish(job_id, "done", result, None, owner)
+
+    def fail(self, job_id: str, error: str, owner: Optional[str]) -> bool:
+        return self._finish(job_id, "failed", None, error, owner)
+
+    def requeue(self, job_id: str, owner: str) -> None:
+        """
+        Devolve um job interrompido à fila (ex.: shutdown do worker a meio do processamento).
+        """
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, progress = '{}', owner = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND status = 'running' AND owner = ?",
+                (time.time(), job_id, owner),
+            )
+
+    def retry(self, job_id: str, owner: str, error: str) -> str:
+        """
+        Falha transitória: volta à fila se ainda houver tentativas (a reserva já gastou
+        uma), senão fica 'failed'. Devolve o novo estado.
+        """
+        with self._db() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["attempts"] >= self.max_attempts:
+            self.fail(job_id, f"Número máximo de tentativas excedido. {error}".strip(), owner)
+            return "failed"
+        self.requeue(job_id, owner)
+        return "queued"
+
+    def requeue_stale(self) -> int:
+        """
+        Recupera jobs 'running' cuja concessão expirou (o worker morreu ou deixou de
+        renovar). Jobs de workers vivos nunca são tocados, por mais longa que seja a etapa.
+        Jobs que já esgotaram as tentativas passam a 'failed'.
+        """
+        now = time.time()
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE status = 'running' "
+                "AND COALESCE(lease_until, updated_at + ?) < ?",
+                (self.lease_seconds, now),
+            ).fetchall()
+            retry = [row["id"] for row in rows if row["attempts"] < self.max_attempts]
+            conn.executemany(
+                "UPDATE jobs SET status = 'queued', stage = NULL, progress = '{}', owner = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                [(now, job_id) for job_id in retry],
+            )
+            conn.execute("COMMIT")
+        for row in rows:
+            if row["attempts"] >= self.max_attempts:
+                self.fail(row["id"], "Número máximo de tentativas excedido.", None)
+        return len(rows)
+
+    # ---------- consulta ----------
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._db() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        with self._db() as conn:
+            rows: List[sqlite3.Row] = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    @staticmethod
+    def _remove_payload(path: Optional[str]) -> None:
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,185 @@
+import re
+from typing import List, Tuple, Dict, Any, Optional
+
+import cv2
+import numpy as np
+
+# =========================
+# Layout / regiões de interesse (OpenCV)
+# =========================
+# As imagens aqui são as binarizadas por preprocess_image: texto preto (0) em fundo branco (255).
+
+Zone = Tuple[str, int, int]  # (nome, y0, y1) em coordenadas da imagem recortada
+
+
+def ink_mask(img_bin: np.ndarray) -> np.ndarray:
+    return img_bin < 128
+
+
+def crop_margins(img_bin: np.ndarray, pad: int = 10, min_ink: int = 2) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Remove as margens em branco. Linhas/colunas com menos de min_ink pixels escuros
+    contam como vazias (tolera pó e ruído do scanner).
+    Devolve a imagem recortada (view, sem cópia) e o deslocamento (x0, y0).
+    """
+    ink = ink_mask(img_bin)
+    rows = np.flatnonzero(ink.sum(axis=1) >= min_ink)
+    cols = np.flatnonzero(ink.sum(axis=0) >= min_ink)
+    if rows.size == 0 or cols.size == 0:
+        return img_bin[0:0, 0:0], (0, 0)
+    h, w = img_bin.shape[:2]
+    y0, y1 = max(0, rows[0] - pad), min(h, rows[-1] + 1 + pad)
+    x0, x1 = max(0, cols[0] - pad), min(w, cols[-1] + 1 + pad)
+    return img_bin[y0:y1, x0:x1], (x0, y0)
+
+
+def horizontal_rules(img_bin: np.ndarray, min_width_ratio: float = 0.5) -> List[int]:
+    """
+    Posições y das linhas horizontais longas (réguas de tabela), já agrupadas.
+    """
+    h, w = img_bin.shape[:2]
+    if h == 0 or w == 0:
+        return []
+    inv = np.where(ink_mask(img_bin), 255, 0).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, int(w * min_width_ratio)), 1))
+    lines = cv2.morphologyEx(inv, cv2.MORPH_OPEN, kernel)
+    ys = np.flatnonzero(lines.max(axis=1) > 0)
+    rules: List[int] = []
+    for y in ys:
+        if rules and y - rules[-1] <= 3:
+            rules[-1] = int(y)
+        else:
+            rules.append(int(y))
+    return rules
+
+
+def detect_zones(img_bin: np.ndarray, min_table_ratio: float = 0.05, min_zone_px: int = 20) -> List[Zone]:
+    """
+    Divide a página em cabeçalho / tabela de itens / rodapé (totais) a partir das
+    réguas horizontais da tabela. Sem pelo menos duas réguas, devolve a página inteira.
+    """
+    h = img_bin.shape[0]
+    rules = horizontal_rules(img_bin)
+    if len(rules) < 2 or (rules[-1] - rules[0]) < h * min_table_ratio:
+        return [("pagina", 0, h)]
+    top, bottom = rules[0], rules[-1]
+    zones: List[Zone] = []
+    if top >= min_zone_px:
+        zones.append(("cabecalho", 0, top))
+    zones.append(("tabela", top, bottom + 1))
+    if h - bottom - 1 >= min_zone_px:
+        zones.append(("rodape", bottom + 1, h))
+    return zones
+
+
+def has_ink(img_bin: np.ndarray, min_pixels: int = 20) -> bool:
+    return img_bin.size > 0 and int(ink_mask(img_bin).sum()) >= min_pixels
+
+
+_NUM_TOKEN = re.compile(r'\d[\d\.,]*')
+
+
+def merge_numeric_pass(label_text: str, numeric_text: str) -> str:
+    """
+    Junta a passagem "normal" do rodapé (rótulos legíveis) com a passagem restrita a
+    dígitos: linha a linha, os números da 1.ª são trocados pelos da 2.ª quando as
+    duas passagens concordam no número de linhas e de números por linha.
+    """
+    label_lines = [ln for ln in label_text.splitlines() if ln.strip()]
+    numeric_lines = [ln for ln in numeric_text.splitlines() if ln.strip()]
+    if len(label_lines) != len(numeric_lines):
+        return label_text
+    merged: List[str] = []
+    for lab, num in zip(label_lines, numeric_lines):
+        nums: List[str] = _NUM_TOKEN.findall(num)
+        if nums and len(nums) == len(_NUM_TOKEN.findall(lab)):
+            it = iter(nums)
+            lab = _NUM_TOKEN.sub(lambda _m: next(it), lab)
+        merged.append(lab)
+    return "\n".join(merged)
+
+
+def zone_stats(zones: List[Zone], offset: Tuple[int, int]) -> List[Dict[str, Any]]:
+    _, y_off = offset
+    return [{"zona": name, "y0": y0 + y_off, "y1": y1 + y_off} for name, y0, y1 in zones]
+
+
+# =========================
+# Filtro pré-OCR: páginas em branco, separadores e repetidas
+# =========================
+def _central(img: np.ndarray, margin: float = 0.05) -> np.ndarray:
+    # ignora as bordas, onde o scanner costuma deixar sombras escuras
+    h, w = img.shape[:2]
+    my, mx = int(h * margin), int(w * margin)
+    return img[my:h - my or h, mx:w - mx or w]
+
+
+def classify_blank_or_separator(gray: np.ndarray, img_bin: np.ndarray, max_blank_ink: float,
+                                max_separator_components: int) -> Optional[str]:
+    """
+    Sobre a página inteira (cinzento e binarizada por preprocess_image, à resolução do OCR):
+    "em_branco": quase sem tinta (fração de pixels escuros abaixo de max_blank_ink).
+    "separador": folha uniforme escura, ou pouca tinta concentrada em poucos
+                 componentes grandes (código de barras / patch code / carimbo "SEPARADOR").
+    None: página normal, segue para OCR. Uma página só com os totais, uma assinatura ou
+    "Pagina 3/3" em corpo 10 tem tinta acima de max_blank_ink e segue para OCR.
+    """
+    center = _central(gray)
+    if center.size == 0:
+        return "em_branco"
+    uniform = float(center.std()) < 8.0
+    if uniform and float(center.mean()) < 128:
+        return "separador"
+    # numa folha clara quase uniforme o Otsu separa o ruído do papel: conta-se a tinta no cinzento
+    ink = ink_mask(center if uniform else _central(img_bin))
+    ratio = float(ink.mean())
+    if ratio < max_blank_ink:
+        return "em_branco"
+    if ratio < 0.3:
+        n, _, stats, _ = cv2.connectedComponentsWithStats(ink.astype(np.uint8), connectivity=8)
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        if 0 < areas.size <= max_separator_components and areas.max() >= 0.5 * areas.sum():
+            return "separador"
+    return None
+
+
+def text_lines(img_bin: np.ndarray, min_ink: int = 3, max_gap: int = 2, min_height: int = 6) -> List[Tuple[int, int]]:
+    """
+    Faixas (y0, y1) das linhas de texto, pela projeção horizontal da tinta.
+    """
+    rows = ink_mask(img_bin).sum(axis=1) >= min_ink
+    bands: List[List[int]] = []
+    for y in np.flatnonzero(rows):
+        if bands and y - bands[-1][1] <= max_gap:
+            bands[-1][1] = int(y) + 1
+        else:
+            bands.append([int(y), int(y) + 1])
+    return [(y0, y1) for y0, y1 in bands if y1 - y0 >= min_height]
+
+
+def page_hash(img_bin: np.ndarray, width: int = 32, height: int = 8) -> np.ndarray:
+    """
+    Hash perceptual da página: um dHash (width x height bits) por linha de texto, cada
+    linha recortada à sua própria tinta. Uma página digitalizada de novo (deslocada,
+    com ruído) dá os mesmos hashes a poucos bits; uma página de continuação com o mesmo
+    cabeçalho e outros números na tabela difere em todas as linhas de itens.
+    Não tolera rotação: páginas tortas simplesmente não coincidem.
+    """
+    ink = ink_mask(img_bin)
+    out = []
+    for y0, y1 in text_lines(img_bin):
+        band = ink[y0:y1]
+        cols = np.flatnonzero(band.any(axis=0))
+        small = cv2.resize(band[:, cols[0]:cols[-1] + 1].astype(np.float32), (width + 1, height),
+                           interpolation=cv2.INTER_AREA)
+        out.append(np.packbits(small[:, 1:] > small[:, :-1]))
+    return np.array(out, dtype=np.uint8).reshape(len(out), width * height // 8)
+
+
+def hash_distance(a: np.ndarray, b: np.ndarray) -> Optional[float]:
+    """
+    Mediana da distância de Hamming linha a linha; None se o número de linhas difere.
+    """
+    if len(a) != len(b) or len(a) == 0:
+        return None
+    return float(np.median(np.unpackbits(a ^ b, axis=1).sum(axis=1)))
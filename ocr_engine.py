@@ -0,0 +1,231 @@
+import os
+import shlex
+import logging
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple, Dict, List
+
+import numpy as np
+
+# =========================
+# Backend de OCR
+# =========================
+# Preferimos o tesserocr (API C++ do Tesseract em processo): cada thread mantém
+# um handle já inicializado com o traineddata carregado e recebe o buffer do
+# numpy diretamente. Sem tesserocr instalado (ou se a inicialização falhar),
+# cai para o pytesseract, que lança o binário tesseract por imagem.
+#
+# OCR_BACKEND: "auto" (padrão), "tesserocr" ou "pytesseract".
+# O pytesseract só é importado se for usado (TESSERACT_CMD indica o binário).
+
+try:
+    import tesserocr
+except ImportError:  # dependência opcional
+    tesserocr = None
+
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+
+_pytesseract = None
+
+
+def get_pytesseract():
+    global _pytesseract
+    if _pytesseract is None:
+        import pytesseract
+        cmd = os.getenv("TESSERACT_CMD")
+        if cmd:
+            pytesseract.pytesseract.tesseract_cmd = cmd
+        _pytesseract = pytesseract
+    return _pytesseract
+
+
+@dataclass(frozen=True)
+class TessConfig:
+    lang: str = "eng"
+    oem: int = 3
+    psm: int = 3
+    dpi: Optional[int] = None
+    variables: Tuple[Tuple[str, str], ...] = ()
+
+
+@lru_cache(maxsize=64)
+def parse_tesseract_config(config: str) -> TessConfig:
+    """
+    Interpreta a mesma string de config usada no pytesseract
+    (ex.: '--oem 3 --psm 6 -l por+eng -c tessedit_char_whitelist=0123456789').
+    """
+    tokens = shlex.split(config)
+    lang, oem, psm, dpi = "eng", 3, 3, None
+    variables: List[Tuple[str, str]] = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if tok == "-l" and nxt is not None:
+            lang, i = nxt, i + 2
+        elif tok == "--oem" and nxt is not None:
+            oem, i = int(nxt), i + 2
+        elif tok == "--psm" and nxt is not None:
+            psm, i = int(nxt), i + 2
+        elif tok == "--dpi" and nxt is not None:
+            dpi, i = int(nxt), i + 2
+        elif tok == "-c" and nxt is not None and "=" in nxt:
+            name, value = nxt.split("=", 1)
+            variables.append((name, value))
+            i += 2
+        else:
+            i += 1
+    return TessConfig(lang=lang, oem=oem, psm=psm, dpi=dpi, variables=tuple(variables))
+
+
+class _TessHandle:
+    """
+    Handle do tesserocr ligado a uma thread. PSM e variáveis são aplicados por chamada;
+    as variáveis alteradas voltam ao valor original antes da chamada seguinte.
+    """
+
+    def __init__(self, lang: str, oem: int):
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+        self._defaults: Dict[str, str] = {}
+        self._applied: Tuple[Tuple[str, str], ...] = ()
+
+    def configure(self, cfg: TessConfig, dpi: Optional[int]) -> None:
+        api = self.api
+        if cfg.variables != self._applied:
+            for name, _ in self._applied:
+                api.SetVariable(name, self._defaults.get(name, ""))
+            for name, value in cfg.variables:
+                if name not in self._defaults:
+                    self._defaults[name] = api.GetVariableAsString(name) or ""
+                api.SetVariable(name, value)
+            self._applied = cfg.variables
+        api.SetPageSegMode(cfg.psm)
+        resolution = cfg.dpi or dpi
+        if resolution:
+            api.SetSourceResolution(resolution)
+
+    def set_image(self, img: np.ndarray) -> None:
+        img = np.ascontiguousarray(img)
+        if img.ndim == 2:
+            h, w = img.shape
+            bpp = 1
+        else:
+            h, w, bpp = img.shape
+            if bpp == 3:
+                img = np.ascontiguousarray(img[:, :, ::-1])  # BGR (OpenCV) -> RGB
+        if _image_buffers:
+            try:
+                # o buffer do numpy sem cópia (o Tesseract copia-o para o seu Pix)
+                self.api.SetImageBytes(img.data, w, h, bpp, img.strides[0])
+                return
+            except TypeError:
+                _disable_image_buffers()
+        self.api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+
+
+# versões do tesserocr que só aceitam bytes em SetImageBytes: passa-se a copiar
+_image_buffers = True
+
+
+def _disable_image_buffers() -> None:
+    global _image_buffers
+    _image_buffers = False
+    logging.getLogger("ocr.engine").info("tesserocr sem suporte a memoryview em SetImageBytes; a copiar a imagem.")
+
+
+_local = threading.local()
+_tesserocr_broken = False
+
+
+def _get_handle(cfg: TessConfig) -> Optional[_TessHandle]:
+    global _tesserocr_broken
+    if tesserocr is None or OCR_BACKEND == "pytesseract" or _tesserocr_broken:
+        return None
+    handles: Dict[Tuple[str, int], _TessHandle] = getattr(_local, "handles", None)
+    if handles is None:
+        handles = _local.handles = {}
+    key = (cfg.lang, cfg.oem)
+    handle = handles.get(key)
+    if handle is None:
+        try:
+            handle = handles[key] = _TessHandle(cfg.lang, cfg.oem)
+        except RuntimeError as e:
+            if OCR_BACKEND == "tesserocr":
+                raise
+            logging.getLogger("ocr.engine").warning("tesserocr indisponível (%s); a usar pytesseract.", e)
+            _tesserocr_broken = True
+            return None
+    return handle
+
+
+def backend_name() -> str:
+    if tesserocr is None or OCR_BACKEND == "pytesseract" or _tesserocr_broken:
+        return "pytesseract"
+    return "tesserocr"
+
+
+def image_to_string(img: np.ndarray, config: str, dpi: Optional[int] = None) -> str:
+    cfg = parse_tesseract_config(config)
+    handle = _get_handle(cfg)
+    if handle is None:
+        if dpi and cfg.dpi is None:
+            config = f"{config} --dpi {dpi}"
+        return get_pytesseract().image_to_string(img, config=config)
+    handle.configure(cfg, dpi)
+    handle.set_image(img)
+    try:
+        return handle.api.GetUTF8Text()
+    finally:
+        handle.api.Clear()
+
+
+def warmup(config: str) -> str:
+    """
+    Um OCR numa imagem pequena nesta thread: com tesserocr cria o handle (carrega o
+    traineddata); com pytesseract importa o módulo e lança o binário uma vez.
+    Devolve o backend em uso.
+    """
+    img = np.full((32, 96), 255, dtype=np.uint8)
+    img[12:20, 8:88] = 0
+    image_to_string(img, config)
+    return backend_name()
+
+
+def _text_from_tsv(data: Dict[str, List]) -> Tuple[str, List[float]]:
+    """
+    Reconstrói o texto (linhas por bloco/parágrafo/linha) a partir do image_to_data do pytesseract.
+    """
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confs: List[float] = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if conf < 0 or not word.strip():
+            continue
+        confs.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    return text, confs
+
+
+def image_to_text_and_confidences(img: np.ndarray, config: str, dpi: Optional[int] = None) -> Tuple[str, List[float]]:
+    """
+    Texto + confiança (0-100) de cada palavra reconhecida, numa única passagem do Tesseract.
+    """
+    cfg = parse_tesseract_config(config)
+    handle = _get_handle(cfg)
+    if handle is None:
+        if dpi and cfg.dpi is None:
+            config = f"{config} --dpi {dpi}"
+        pytesseract = get_pytesseract()
+        data = pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+        return _text_from_tsv(data)
+    handle.configure(cfg, dpi)
+    handle.set_image(img)
+    try:
+        text = handle.api.GetUTF8Text()
+        confs = [float(c) for c in handle.api.AllWordConfidences()]
+        return text, confs
+    finally:
+        handle.api.Clear()
@@ -0,0 +1,223 @@
+from dataclasses import dataclass
+from functools import reduce
+from operator import add
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+import numpy as np
+
+# =========================
+# Reconciliação de itens em colunas (NumPy)
+# =========================
+# As heurísticas de validar_e_corrigir_dados (unitário derivado do total,
+# IVA incluído no unitário, taxa padrão do rodapé, recálculo de subtotal/IVA)
+# aplicadas a arrays em vez de item a item. A semântica numérica é a do código
+# em Python puro:
+#   - round_to reproduz round(x, n) / float(f"{x:.nf}") (arredondamento correto,
+#     empate para par), corrigindo com round() os casos perto do empate;
+#   - os acumuladores "+=" somam na mesma ordem (running_sum) e os sum() usam o
+#     próprio sum() sobre a lista.
+
+ITEM_KEYS = {
+    "descricao": ["descricao", "descrição", "descricao_item", "desc", "descricao_produto"],
+    "preco_unitario": ["preco_unitario", "preco_unit", "unit_price", "preco_unitario_item"],
+    "preco_total": ["preco_total", "valor_total_item", "valor", "total", "sub_total"],
+    "quantidade": ["quantidade", "qtd", "quantidade_item", "qty"],
+    "taxa": ["taxa_iva_percentagem", "taxa", "iva_percent", "iva_percentagem"],
+}
+
+
+def first_present(d: Dict[str, Any], keys: List[str], default=None):
+    for k in keys:
+        v = d.get(k)
+        if v is not None:
+            return v
+    return default
+
+
+def _number(v: Any, to_number: Callable[..., float]) -> float:
+    # atalho para os tipos que safe_float devolve sem conversão
+    cls = type(v)
+    if cls is float:
+        return v
+    if cls is int:
+        return float(v)
+    return to_number(v, 0.0)
+
+
+def round_to(x: np.ndarray, ndigits: int = 2) -> np.ndarray:
+    """
+    round(v, ndigits) elemento a elemento. O arredondamento de x*10^n só pode
+    divergir do de Python quando x*10^n fica a uma fração de ulp de .5 (ou é
+    enorme / não finito): esses elementos são refeitos com round().
+    """
+    scale = 10.0 ** ndigits
+    s = x * scale
+    out = np.round(s) / scale
+    frac = np.abs(s - np.trunc(s))
+    with np.errstate(invalid="ignore"):
+        suspect = ~np.isfinite(s) | (np.abs(s) >= 2.0 ** 52) | (np.abs(frac - 0.5) <= np.abs(s) * 1e-12 + 1e-9)
+    if suspect.any():
+        idx = np.flatnonzero(suspect)
+        out[idx] = [round(v, ndigits) for v in x[idx].tolist()]
+    return out
+
+
+def running_sum(x: np.ndarray) -> float:
+    """
+    Soma sequencial (total += v), na mesma ordem e com os mesmos arredondamentos.
+    """
+    return reduce(add, x.tolist(), 0.0)
+
+
+@dataclass
+class ItemColumns:
+    descricao: List[Any]
+    quantidade: np.ndarray
+    preco_unit: np.ndarray
+    has_preco_unit: np.ndarray
+    preco_total: np.ndarray
+    has_preco_total: np.ndarray
+    taxa: np.ndarray
+    has_taxa: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.descricao)
+
+
+def item_columns(items: List[Any], to_number: Callable[..., float]) -> ItemColumns:
+    """
+    Uma passagem pelos itens do LLM: resolve os nomes alternativos dos campos e
+    converte cada valor uma única vez (to_number = safe_float).
+    """
+    n = len(items)
+    descricao: List[Any] = []
+    quantidade = np.zeros(n)
+    preco_unit = np.zeros(n)
+    preco_total = np.zeros(n)
+    taxa = np.zeros(n)
+    has_preco_unit = np.zeros(n, dtype=bool)
+    has_preco_total = np.zeros(n, dtype=bool)
+    has_taxa = np.zeros(n, dtype=bool)
+
+    keys_desc, keys_unit, keys_total, keys_qtd, keys_taxa = (
+        ITEM_KEYS["descricao"], ITEM_KEYS["preco_unitario"], ITEM_KEYS["preco_total"],
+        ITEM_KEYS["quantidade"], ITEM_KEYS["taxa"],
+    )
+    for i, it in enumerate(items):
+        # it pode já ser dict ou pydantic
+        if not isinstance(it, dict):
+            try:
+                it = it.dict()
+            except Exception:
+                it = dict(it)
+        descricao.append(first_present(it, keys_desc, ""))
+        quantidade[i] = _number(first_present(it, keys_qtd, 0), to_number)
+        v = first_present(it, keys_unit)
+        if v is not None:
+            preco_unit[i] = _number(v, to_number)
+            has_preco_unit[i] = True
+        v = first_present(it, keys_total)
+        if v is not None:
+            preco_total[i] = _number(v, to_number)
+            has_preco_total[i] = True
+        v = first_present(it, keys_taxa)
+        if v is not None and v != "":
+            taxa[i] = _number(v, to_number)
+            has_taxa[i] = True
+
+    return ItemColumns(descricao, quantidade, preco_unit, has_preco_unit,
+                       preco_total, has_preco_total, taxa, has_taxa)
+
+
+def _positive_zero(x: np.ndarray) -> np.ndarray:
+    # "v or 0.0" troca -0.0 por 0.0
+    return np.where(x == 0.0, 0.0, x)
+
+
+def _line_totals(u: np.ndarray, q: np.ndarray, t: np.ndarray) -> Tuple[float, float]:
+    # subtotal += round(u * q, 2); iva += round((u * q) * (t / 100), 2)
+    line = u * q
+    return running_sum(round_to(line, 2)), running_sum(round_to(line * (t / 100.0), 2))
+
+
+def reconcile_items(cols: ItemColumns, taxa_padrao: Optional[float],
+                    total_com_iva_footer: Optional[float]) -> Tuple[List[Dict[str, Any]], float, float, float]:
+    """
+    Normaliza os itens e recalcula subtotal / IVA / total.
+    Devolve (itens normalizados, subtotal, iva, total) já com os valores finais.
+    """
+    q = cols.quantidade
+    pt = cols.preco_total
+    has_u = cols.has_preco_unit.copy()
+    u = cols.preco_unit.copy()
+    has_pt_nz = cols.has_preco_total & (pt != 0.0)
+
+    # Heurística 1: sem unitário (ou zero) mas com total e quantidade -> unitário = total / quantidade
+    derive = (~has_u | (u == 0.0)) & has_pt_nz & (q > 0)
+    if derive.any():
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u[derive] = round_to(pt[derive] / q[derive], 2)
+        has_u |= derive
+
+    # taxa do item; ausente/zero -> taxa padrão do rodapé
+    t = np.where(cols.has_taxa, cols.taxa, 0.0)
+    if taxa_padrao is not None:
+        t = np.where(~cols.has_taxa | (t == 0.0), float(taxa_padrao), t)
+    t = _positive_zero(t)
+
+    # Heurística 2: unitário * quantidade == total do item e há taxa -> unitário trazia IVA
+    has_u_nz = has_u & (u != 0.0)
+    cand = has_u_nz & has_pt_nz & (q > 0)
+    if cand.any():
+        with np.errstate(invalid="ignore"):
+            calc = round_to(u * q, 2)
+            strip = cand & (np.abs(calc - pt) < 0.01) & (t > 0)
+        if strip.any():
+            u[strip] = round_to(u[strip] / (1.0 + t[strip] / 100.0), 2)
+
+    u = round_to(_positive_zero(np.where(has_u, u, 0.0)), 2)
+    q_norm = [float(f"{v:.6g}") for v in q.tolist()]  # mantém precisão de quantidade (ex: 1, 1.5)
+    q = np.array(q_norm, dtype=float)
+
+    subtotal, iva_calc = _line_totals(u, q, t)
+    subtotal, iva_calc = round(subtotal, 2), round(iva_calc, 2)
+    total_calc = round(subtotal + iva_calc, 2)
+
+    # Totais dos itens não batem com o rodapé: testar se os unitários incluem IVA (taxa homogénea)
+    if total_com_iva_footer and abs(total_calc - float(total_com_iva_footer)) > 0.5 and len(cols):
+        taxas_presentes = {round(v, 6) for v in np.unique(t).tolist()}
+        if len(taxas_presentes) == 1:
+            taxa_hom = taxas_presentes.pop()
+            if taxa_hom > 0:
+                u_excl = round_to(u / (1.0 + taxa_hom / 100.0), 2)
+                subtotal_candidate, iva_candidate = _line_totals(u_excl, q, np.full(len(u), taxa_hom))
+                total_candidate = round(subtotal_candidate + iva_candidate, 2)
+                if abs(total_candidate - float(total_com_iva_footer)) < abs(total_calc - float(total_com_iva_footer)):
+                    u = u_excl
+
+    # itens com taxa 0 recebem a taxa padrão
+    if taxa_padrao is not None:
+        t = np.where(t == 0.0, float(taxa_padrao), t)
+
+    line = u * q
+    subtotal = round(sum(line.tolist()), 2)
+    iva_calc = round(sum((line * (t / 100.0)).tolist()), 2)
+    total_calc = round(subtotal + iva_calc, 2)
+
+    taxa_out = round_to(t, 2).tolist()
+    total_linha = round_to(line, 2).tolist()
+    extraido = round_to(pt, 2).tolist()
+    normalized: List[Dict[str, Any]] = []
+    for i, preco in enumerate(u.tolist()):
+        item = {
+            "descricao": cols.descricao[i] or "",
+            "preco_unitario": preco,
+            "quantidade": q_norm[i],
+            "taxa_iva_percentagem": taxa_out[i],
+        }
+        if has_pt_nz[i]:
+            item["preco_total_extraido"] = extraido[i]
+        item["preco_total_calculado"] = total_linha[i]
+        normalized.append(item)
+
+    return normalized, subtotal, iva_calc, total_calc
@@ -0,0 +1,484 @@
+import re
+import json
+import time
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+# =========================
+# Templates por fornecedor (caminho rápido sem LLM)
+# =========================
+# Um template é aprendido a partir de um DocumentData já validado e do texto OCR
+# correspondente: guarda o rótulo que antecede o número da fatura e a data, e a
+# ordem das colunas numéricas das linhas de itens. O template fica associado ao NIF
+# do fornecedor (só se aprende quando o resultado validado o tem); em documentos
+# seguintes com esse NIF no texto, as regras produzem o resultado localmente; só se
+# o resultado reconciliar com o total do rodapé é aceite, caso contrário o pedido
+# segue para o LLM.
+#
+# Todo o casamento é feito sobre o texto canónico (sem acentos, maiúsculas).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    key TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1,
+    hits INTEGER NOT NULL DEFAULT 0,
+    fallbacks INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+STAT_NAMES = ("lookups", "hits", "fallbacks", "misses", "learned")
+
+TEMPLATE_VERSION = 2
+
+NIF_RE = re.compile(
+    r'(?:\bNIF\b|\bN\.\s*I\.\s*F\.?|CONTRIBUINTE)\s*(?:N[O°º\.]*\s*)?[:\-]?\s*([0-9]{9}[A-Z]{2}[0-9]{3}|[0-9]{9,10})'
+)
+DATE_RE = re.compile(
+    r'(?<!\d)(?:(\d{1,2})[\-/\.](\d{1,2})[\-/\.](\d{4})|(\d{4})[\-/\.](\d{1,2})[\-/\.](\d{1,2}))(?!\d)'
+)
+NUM_TOKEN_RE = re.compile(r'^-?\d[\d\.,]*%?$')
+TOKEN_RE = re.compile(r'\S+')
+
+# Papéis possíveis de uma coluna numérica numa linha de item
+ROLES = (
+    "quantidade",
+    "preco_unitario",
+    "taxa_iva_percentagem",
+    "total_linha",
+    "preco_unitario_iva",
+    "total_linha_iva",
+)
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) <= max(0.011, abs(b) * 0.005)
+
+
+def _normalize_date(m: "re.Match[str]") -> Optional[str]:
+    if m.group(1):
+        d, mo, y = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    else:
+        y, mo, d = int(m.group(4)), int(m.group(5)), int(m.group(6))
+    if not (1 <= d <= 31 and 1 <= mo <= 12):
+        return None
+    return f"{d:02d}-{mo:02d}-{y:04d}"
+
+
+def _flex_pattern(value: str) -> str:
+    # o OCR pode inserir/remover espaços dentro do valor
+    return r'\s*'.join(re.escape(c) for c in value if not c.isspace())
+
+
+def _shape_pattern(value: str) -> str:
+    """
+    Generaliza um valor de exemplo: corridas de dígitos -> \\d+, letras ficam literais
+    (séries como "FT" ou "FR" são fixas por fornecedor), espaços opcionais.
+    """
+    out: List[str] = []
+    for run in re.finditer(r'\d+|[A-Z]+|\s+|.', value):
+        tok = run.group()
+        if tok.isdigit():
+            out.append(r'\d+')
+        elif tok.isspace():
+            out.append(r'\s*')
+        else:
+            out.append(re.escape(tok))
+    return "".join(out)
+
+
+def _anchor_before(text: str, pos: int, max_tokens: int = 3) -> Optional[str]:
+    """
+    Últimos tokens "de rótulo" (sem dígitos) antes de pos, ex.: "FACTURA N".
+    """
+    tokens = TOKEN_RE.findall(text[max(0, pos - 120):pos])
+    anchor: List[str] = []
+    for tok in reversed(tokens):
+        tok = tok.strip(":-")
+        if not tok:
+            continue
+        if any(c.isdigit() for c in tok) or len(anchor) >= max_tokens:
+            break
+        anchor.insert(0, tok)
+    return " ".join(anchor) if anchor else None
+
+
+def _anchor_regex(anchor: str) -> str:
+    return r'\s+'.join(re.escape(t) for t in anchor.split()) + r'\s*[:\-]?\s*'
+
+
+def _is_number(tok: str) -> bool:
+    return bool(NUM_TOKEN_RE.match(tok))
+
+
+class TemplateRegistry:
+    """
+    Registo persistente (SQLite) de templates por fornecedor.
+    parse_number e canon são as funções de normalização da aplicação (to_float / canon).
+    """
+
+    def __init__(self, db_path: str, parse_number: Callable[[str], float], canon: Callable[[str], str],
+                 tolerance: float = 0.005):
+        self.db_path = db_path
+        self.parse_number = parse_number
+        self.canon = canon
+        self.tolerance = tolerance
+        self._initialized = False
+
+    # ---------- persistência ----------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @contextmanager
+    def _db(self):
+        if not self._initialized:
+            conn = self._connect()
+            try:
+                conn.executescript(SCHEMA)
+                conn.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)",
+                                 [(n,) for n in STAT_NAMES])
+            finally:
+                conn.close()
+            self._initialized = True
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _bump(self, name: str, key: Optional[str] = None, column: Optional[str] = None) -> None:
+        with self._db() as conn:
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = ?", (name,))
+            if key is not None and column is not None:
+                conn.execute(f"UPDATE templates SET {column} = {column} + 1 WHERE key = ?", (key,))
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._db() as conn:
+            row = conn.execute("SELECT template FROM templates WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        template = json.loads(row["template"])
+        return template if template.get("version") == TEMPLATE_VERSION else None
+
+    def _save(self, key: str, template: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._db() as conn:
+            conn.execute(
+                "INSERT INTO templates (key, template, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET template = excluded.template, samples = samples + 1, "
+                "updated_at = excluded.updated_at",
+                (key, json.dumps(template, ensure_ascii=False), now, now),
+            )
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'learned'")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db() as conn:
+            out: Dict[str, Any] = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            out["templates"] = conn.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+        lookups = out.get("lookups", 0)
+        out["hit_rate"] = round(out.get("hits", 0) / lookups, 4) if lookups else 0.0
+        out["fallback_rate"] = round(out.get("fallbacks", 0) / lookups, 4) if lookups else 0.0
+        return out
+
+    # ---------- chaves ----------
+    def normalize_nif(self, nif: Any) -> str:
+        return re.sub(r"\s+", "", self.canon(str(nif or "")))
+
+    @staticmethod
+    def mentions_nif(t: str, nif: str) -> bool:
+        """
+        O NIF aparece no texto canónico como número isolado (com ou sem rótulo "NIF").
+        """
+        return bool(nif) and re.search(rf"(?<![0-9A-Z]){re.escape(nif)}(?![0-9A-Z])", t) is not None
+
+    def candidate_keys(self, t: str) -> List[str]:
+        """
+        Todos os NIF rotulados no texto, por ordem: o do cliente pode vir antes do do fornecedor.
+        """
+        keys: List[str] = []
+        for m in NIF_RE.finditer(t):
+            key = f"nif:{m.group(1)}"
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    # ---------- aprendizagem ----------
+    def _learn_field(self, t: str, value: str) -> Optional[Dict[str, str]]:
+        v = self.canon(value).strip()
+        if not v:
+            return None
+        m = re.search(_flex_pattern(v), t)
+        if not m:
+            return None
+        anchor = _anchor_before(t, m.start())
+        if not anchor:
+            return None
+        return {"anchor": anchor, "pattern": _shape_pattern(v)}
+
+    def _learn_date(self, t: str, value: str) -> Optional[Dict[str, str]]:
+        for m in DATE_RE.finditer(t):
+            if _normalize_date(m) == value:
+                anchor = _anchor_before(t, m.start())
+                if anchor:
+                    return {"anchor": anchor}
+        return None
+
+    def _roles_for(self, nums: List[float], item: Dict[str, Any]) -> List[str]:
+        q = float(item.get("quantidade") or 0)
+        p = float(item.get("preco_unitario") or 0)
+        tx = float(item.get("taxa_iva_percentagem") or 0)
+        expected = {
+            "quantidade": q,
+            "preco_unitario": p,
+            "taxa_iva_percentagem": tx,
+            "total_linha": p * q,
+            "preco_unitario_iva": p * (1 + tx / 100.0),
+            "total_linha_iva": p * q * (1 + tx / 100.0),
+        }
+        roles: List[str] = []
+        for n in nums:
+            role = "ignorar"
+            for name in ROLES:
+                if name not in roles and expected[name] and _close(n, expected[name]):
+                    role = name
+                    break
+            roles.append(role)
+        return roles
+
+    def _learn_items(self, t: str, items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        spans: List[Tuple[int, int]] = []
+        cursor = 0
+        for it in items:
+            desc = self.canon(str(it.get("descricao") or "")).strip()
+            if not desc:
+                return None
+            m = re.search(r'\s+'.join(re.escape(w) for w in desc.split()), t[cursor:])
+            if not m:
+                return None
+            spans.append((cursor + m.start(), cursor + m.end()))
+            cursor += m.end()
+
+        column_votes: Counter = Counter()
+        for idx, (it, (_, end)) in enumerate(zip(items, spans)):
+            stop = spans[idx + 1][0] if idx + 1 < len(spans) else min(len(t), end + 200)
+            nums: List[float] = []
+            for tok in TOKEN_RE.findall(t[end:stop]):
+                if not _is_number(tok):
+                    break
+                nums.append(self.parse_number(tok.rstrip("%")))
+            if nums:
+                column_votes[tuple(self._roles_for(nums, it))] += 1
+
+        if not column_votes:
+            return None
+        columns, votes = column_votes.most_common(1)[0]
+        if votes < 0.6 * len(items) or "quantidade" not in columns:
+            return None
+        if not {"preco_unitario", "preco_unitario_iva", "total_linha", "total_linha_iva"} & set(columns):
+            return None
+
+        start_anchor = _anchor_before(t, spans[0][0], max_tokens=4)
+        tail = TOKEN_RE.findall(t[spans[-1][1]:spans[-1][1] + 300])
+        labels = [tok for tok in tail if not _is_number(tok)][:2]
+        return {
+            "columns": list(columns),
+            "start": start_anchor,
+            "end": " ".join(labels) if labels else None,
+        }
+
+    def learn(self, extracted_text: str, data: Dict[str, Any]) -> Optional[str]:
+        """
+        Aprende (ou atualiza) o template do fornecedor a partir de um resultado validado.
+        A chave é o NIF do fornecedor do resultado, que tem de aparecer no texto; sem ele
+        não se aprende (o primeiro NIF do texto é muitas vezes o do cliente).
+        Devolve a chave gravada, ou None se o documento não permitir regras fiáveis.
+        """
+        t = self.canon(extracted_text)
+        nif = self.normalize_nif(data.get("nif"))
+        if not self.mentions_nif(t, nif):
+            return None
+        items = data.get("items") or []
+        if not items or not data.get("invoice_number") or not data.get("data_emissao"):
+            return None
+        invoice = self._learn_field(t, str(data["invoice_number"]))
+        date = self._learn_date(t, str(data["data_emissao"]))
+        item_rules = self._learn_items(t, items)
+        if not invoice or not date or not item_rules:
+            return None
+        key = f"nif:{nif}"
+        template = {
+            "version": TEMPLATE_VERSION,
+            "supplier_name": data.get("supplier_name") or "",
+            "nif": nif,
+            "fields": {"invoice_number": invoice, "data_emissao": date},
+            "items": item_rules,
+        }
+        self._save(key, template)
+        return key
+
+    # ---------- aplicação ----------
+    def _slice_original(self, original: str, t: str, start: int, end: int) -> str:
+        # canon() preserva o comprimento no caso comum (texto NFC); senão fica a forma canónica
+        return original[start:end] if len(original) == len(t) else t[start:end]
+
+    def _apply_items(self, t: str, original: str, rules: Dict[str, Any],
+                     taxa_padrao: Optional[float]) -> List[Dict[str, Any]]:
+        lo, hi = 0, len(t)
+        if rules.get("start"):
+            m = re.search(r'\s+'.join(re.escape(w) for w in rules["start"].split()), t)
+            if m:
+                lo = m.end()
+        if rules.get("end"):
+            m = re.search(r'\s+'.join(re.escape(w) for w in rules["end"].split()), t[lo:])
+            if m:
+                hi = lo + m.start()
+
+        columns: List[str] = rules["columns"]
+        k = len(columns)
+        items: List[Dict[str, Any]] = []
+        desc: List[Tuple[int, int]] = []
+        nums: List[Tuple[int, int, str]] = []
+
+        def flush() -> None:
+            if len(nums) < k:
+                desc.extend((s, e) for s, e, _ in nums)
+                nums.clear()
+                return
+            extra, cols = nums[:-k], nums[-k:]
+            words = desc + [(s, e) for s, e, _ in extra]
+            if words:
+                values = {role: self.parse_number(tok.rstrip("%")) for role, (_, _, tok) in zip(columns, cols)}
+                item = self._item_from_values(values, taxa_padrao)
+                if item is not None:
+                    item["descricao"] = self._slice_original(original, t, words[0][0], words[-1][1]).strip()
+                    items.append(item)
+            desc.clear()
+            nums.clear()
+
+        for m in TOKEN_RE.finditer(t, lo, hi):
+            tok = m.group()
+            if _is_number(tok):
+                nums.append((m.start(), m.end(), tok))
+            else:
+                if nums:
+                    flush()
+                desc.append((m.start(), m.end()))
+        if nums:
+            flush()
+        return items
+
+    @staticmethod
+    def _item_from_values(values: Dict[str, float], taxa_padrao: Optional[float]) -> Optional[Dict[str, Any]]:
+        q = values.get("quantidade") or 0.0
+        if q <= 0:
+            return None
+        taxa = values.get("taxa_iva_percentagem")
+        if taxa is None:
+            taxa = taxa_padrao or 0.0
+        factor = 1.0 + taxa / 100.0
+        if values.get("preco_unitario"):
+            p = values["preco_unitario"]
+        elif values.get("total_linha"):
+            p = values["total_linha"] / q
+        elif values.get("preco_unitario_iva"):
+            p = values["preco_unitario_iva"] / factor
+        elif values.get("total_linha_iva"):
+            p = values["total_linha_iva"] / q / factor
+        else:
+            return None
+        if p <= 0:
+            return None
+        return {"preco_unitario": round(p, 2), "quantidade": q, "taxa_iva_percentagem": float(taxa)}
+
+    def _apply_field(self, t: str, original: str, rule: Dict[str, str]) -> Optional[str]:
+        m = re.search(_anchor_regex(rule["anchor"]) + "(" + rule["pattern"] + ")", t)
+        if not m:
+            return None
+        return self._slice_original(original, t, m.start(1), m.end(1)).strip()
+
+    @staticmethod
+    def _apply_date(t: str, rule: Dict[str, str]) -> Optional[str]:
+        m = re.search(_anchor_regex(rule["anchor"]), t)
+        if not m:
+            return None
+        d = DATE_RE.search(t, m.end(), m.end() + 40)
+        return _normalize_date(d) if d else None
+
+    def _reconciles(self, items: List[Dict[str, Any]], total: Optional[float]) -> bool:
+        if not items or not total:
+            return False
+        calc = sum(it["preco_unitario"] * it["quantidade"] * (1 + it["taxa_iva_percentagem"] / 100.0) for it in items)
+        return abs(calc - total) <= max(1.0, total * self.tolerance)
+
+    def match(self, extracted_text: str, totals: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Tenta produzir o DocumentData com o template do fornecedor.
+        totals é o resultado de extract_totals_from_text para o documento.
+        Devolve {"key": ..., "data": {...}} só quando o resultado reconcilia com o rodapé.
+        """
+        t = self.canon(extracted_text)
+        self._bump("lookups")
+        failed = None
+        for key in self.candidate_keys(t):
+            template = self._load(key)
+            if template is None:
+                continue
+            data = self._apply(t, extracted_text, template, totals)
+            if data is None:
+                failed = key  # pode ser o template do cliente: tenta o NIF seguinte
+                continue
+            self._bump("hits", key, "hits")
+            return {"key": key, "data": data}
+        if failed is not None:
+            self._bump("fallbacks", failed, "fallbacks")
+        else:
+            self._bump("misses")
+        return None
+
+    def report_failure(self, key: str) -> None:
+        """
+        O resultado do template foi aceite mas falhou a validação final: conta como fallback.
+        """
+        with self._db() as conn:
+            conn.execute("UPDATE stats SET value = value - 1 WHERE name = 'hits'")
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'fallbacks'")
+            conn.execute("UPDATE templates SET hits = hits - 1, fallbacks = fallbacks + 1 WHERE key = ?", (key,))
+
+    def _apply(self, t: str, original: str, template: Dict[str, Any], totals: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # o documento tem de ser do fornecedor do template, não só ter um layout parecido
+        if not self.mentions_nif(t, self.normalize_nif(template.get("nif"))):
+            return None
+        fields = template["fields"]
+        invoice = self._apply_field(t, original, fields["invoice_number"])
+        date = self._apply_date(t, fields["data_emissao"])
+        total = totals.get("total_com_iva")
+        if not invoice or not date or not total:
+            return None
+        items = self._apply_items(t, original, template["items"], totals.get("taxa_padrao"))
+        if not self._reconciles(items, total):
+            return None
+        total_iva = totals.get("total_iva")
+        if total_iva is None:
+            total_iva = round(sum(it["preco_unitario"] * it["quantidade"] * it["taxa_iva_percentagem"] / 100.0
+                                  for it in items), 2)
+        return {
+            "supplier_name": template["supplier_name"],
+            "nif": template["nif"],
+            "invoice_number": invoice,
+            "data_emissao": date,
+            "valor_total_documento": total,
+            "total_iva": total_iva,
+            "valor_pago": total,
+            "items": items,
+        }
@@ -0,0 +1,209 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="test_app_")
+for _k, _v in {
+    "DOC_CACHE_ENABLED": "0", "PAGE_CACHE_ENABLED": "0", "TEMPLATES_ENABLED": "0",
+    "TRACE_EXPORTER": "none", "LOG_LEVEL": "WARNING", "PREWARM": "0",
+    "DOC_CACHE_DB": os.path.join(_tmp, "doc.db"), "PAGE_CACHE_DB": os.path.join(_tmp, "pag.db"),
+    "TEMPLATES_DB": os.path.join(_tmp, "tpl.db"), "JOBS_DB": os.path.join(_tmp, "jobs.db"),
+    "JOBS_DIR": os.path.join(_tmp, "jobs"), "GROQ_API_KEY": "stub",
+}.items():
+    os.environ.setdefault(_k, _v)
+
+import app  # noqa: E402
+from test_layout import invoice_page, totals_page  # noqa: E402
+
+
+# ---------- filtro pré-OCR ----------
+def test_duplicate_skipping_is_opt_in():
+    assert app.OCR_SKIP_DUPLICATES is False
+
+
+def test_continuation_pages_are_not_skipped(monkeypatch):
+    monkeypatch.setattr(app, "OCR_SKIP_DUPLICATES", True)
+    seen = []
+    pages = [invoice_page(range(k * 28 + 1, (k + 1) * 28 + 1)) for k in range(8)] + [totals_page()]
+    assert [app.screen_page(i, img, seen) for i, img in enumerate(pages)] == [None] * len(pages)
+
+
+def test_repeated_page_is_skipped_when_enabled(monkeypatch):
+    monkeypatch.setattr(app, "OCR_SKIP_DUPLICATES", True)
+    seen = []
+    page = invoice_page(range(1, 29))
+    assert app.screen_page(0, page, seen) is None
+    skipped = app.screen_page(1, page.copy(), seen)
+    assert skipped["reason"] == "duplicada" and skipped["duplicate_of"] == 0
+
+
+# ---------- memória ----------
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="só Linux")
+def test_rss_goes_down_when_memory_is_freed():
+    import numpy as np
+
+    block = np.ones(50_000_000)  # ~380 MB
+    high = app.rss_mb()
+    del block
+    assert high - app.rss_mb() > 200
+
+
+# ---------- lotes ----------
+class FakeUpload:
+    """
+    O que spool_upload usa de um UploadFile: filename e read(n) assíncrono.
+    """
+
+    def __init__(self, filename: str, size: int):
+        self.filename = filename
+        self.left = size
+        self.read_bytes = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        n = self.left if n < 0 else min(n, self.left)
+        self.left -= n
+        self.read_bytes += n
+        return b"x" * n
+
+
+def test_batch_cap_is_enforced_while_reading(monkeypatch, tmp_path):
+    import asyncio
+
+    monkeypatch.setattr(app, "BATCH_MAX_TOTAL_MB", 1)
+    monkeypatch.setattr(app, "UPLOAD_CHUNK_BYTES", 64 * 1024)
+    first, second, third = FakeUpload("a.pdf", 700 * 1024), FakeUpload("b.pdf", 700 * 1024), FakeUpload("c.pdf", 10)
+    with pytest.raises(app.HTTPException) as exc:
+        asyncio.run(app.spool_batch([first, second, third], str(tmp_path)))
+    assert exc.value.status_code == 413
+    assert second.read_bytes < 700 * 1024 and third.read_bytes == 0
+    # o 2.º ficheiro (parcial) é removido; o resto de workdir é limpo por ocr_batch
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_batch_cap_applies_to_zip_contents(monkeypatch, tmp_path):
+    import hashlib
+    import zipfile
+
+    monkeypatch.setattr(app, "BATCH_MAX_TOTAL_MB", 1)
+    path = str(tmp_path / "lote.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a.pdf", b"\0" * (600 * 1024))
+        zf.writestr("b.pdf", b"\0" * (600 * 1024))
+    with pytest.raises(app.HTTPException) as exc:
+        app.expandir_lote([("lote.zip", path, hashlib.sha256())], str(tmp_path))
+    assert exc.value.status_code == 413
+
+
+def test_batch_zip_members_are_extracted_to_disk(tmp_path):
+    import hashlib
+    import zipfile
+
+    path = str(tmp_path / "lote.zip")
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("a.pdf", b"%PDF-a")
+        zf.writestr("notas.txt", b"ignorado")
+    entries = app.expandir_lote([("lote.zip", path, hashlib.sha256())], str(tmp_path))
+    assert [name for name, _, _ in entries] == ["lote.zip/a.pdf"]
+    _, member, h = entries[0]
+    with open(member, "rb") as f:
+        assert f.read() == b"%PDF-a"
+    assert h.hexdigest() == hashlib.sha256(b"%PDF-a").hexdigest()
+
+
+# ---------- páginas híbridas ----------
+def test_hybrid_regions_use_capped_dpi(monkeypatch):
+    import fitz
+    import numpy as np
+
+    monkeypatch.setattr(app, "IMAGE_MAX_MEGAPIXELS", 1.0)
+    monkeypatch.setattr(app, "ocr_image_cached", lambda img, config=app.TESSERACT_CONFIG: "CARIMBO")
+    rendered = []
+    render_gray = app.render_gray
+
+    def recording_render(page, dpi, clip=None):
+        pix, img = render_gray(page, dpi, clip)
+        rendered.append((dpi, img.size))
+        return pix, img
+
+    monkeypatch.setattr(app, "render_gray", recording_render)
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_text((72, 72), "FACTURA FT A2024/1234 COMERCIAL KWANZA, LDA NIF: 5417000123", fontsize=10)
+    stamp = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 200, 200), False)
+    stamp.set_rect(stamp.irect, (128,))
+    page.insert_image(fitz.Rect(72, 200, 523, 770), pixmap=stamp)
+
+    [result] = list(app.iter_pdf_pages(doc))
+    dpi = app.capped_dpi(page, app.OCR_DPI)
+    assert dpi < app.OCR_DPI
+    assert result["source"] == "hibrida" and result["dpi"] == dpi
+    assert rendered and all(d == dpi and size <= 1e6 for d, size in rendered)
+
+
+# ---------- memo do LLM ----------
+def json_loads_strict(content: str):
+    # no lugar do PydanticOutputParser: só aceita JSON completo
+    import json
+
+    return json.loads(content)
+
+
+def test_invalid_llm_answer_is_not_memoized(monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    answers = ["Desculpe, não consigo ler esta fatura.", '{"nif": "5417000123", "items": []}']
+    calls = []
+
+    class FakeLLM:
+        async def ainvoke(self, prompt):
+            calls.append(prompt)
+            return SimpleNamespace(content=answers[len(calls) - 1])
+
+    monkeypatch.setattr(app, "get_llm", lambda: FakeLLM())
+    monkeypatch.setattr(app, "get_parser", lambda _model: SimpleNamespace(parse=json_loads_strict))
+    monkeypatch.setattr(app, "llm_memo", app.AsyncMemo(16))
+
+    async def run():
+        with pytest.raises(app.HTTPException):
+            await app.allm_json("PROMPT", "texto")
+        first = await app.allm_json("PROMPT", "texto")
+        second = await app.allm_json("PROMPT", "texto")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == {"nif": "5417000123", "items": []}
+    assert len(calls) == 2 and app.llm_memo.stats()["hits"] == 1
+
+
+# ---------- imagens em disco ----------
+def test_image_path_is_decoded_from_a_mapping(monkeypatch, tmp_path):
+    import mmap
+
+    import cv2
+    import numpy as np
+
+    path = str(tmp_path / "fatura.png")
+    img = np.full((300, 200), 255, dtype=np.uint8)
+    img[100:120, 20:180] = 0
+    cv2.imwrite(path, img)
+    seen = []
+    decode_scaled = app.image_io.decode_scaled
+
+    def recording_decode(data, target_dpi, max_pixels):
+        seen.append(type(data))
+        return decode_scaled(data, target_dpi, max_pixels)
+
+    monkeypatch.setattr(app.image_io, "decode_scaled", recording_decode)
+    monkeypatch.setattr(app, "_ocr_page_task", lambda idx, page, dpi, measure: {
+        "page": idx, "shape": page.shape, "timings": {}, "spans": []})
+    [page] = app.extract_pages_from_image_path(path)
+    assert seen == [mmap.mmap]
+    assert page["shape"][0] > 0
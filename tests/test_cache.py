@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+from cache import DiskCache  # noqa: E402
+
+
+def make(tmp_path, ttl=3600.0):
+    return DiskCache(str(tmp_path / "cache.db"), 1 << 20, ttl)
+
+
+def test_get_does_not_take_write_lock(tmp_path):
+    c = make(tmp_path)
+    c.set("a", {"v": 1})
+    other = sqlite3.connect(c.db_path, timeout=0, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        # outro processo com a escrita trancada não bloqueia a leitura
+        assert c.get("a") == {"v": 1}
+        assert c.get("b") is None
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+
+def test_get_reuses_connection(tmp_path):
+    c = make(tmp_path)
+    c.set("a", 1)
+    with c._db() as first:
+        pass
+    c.get("a")
+    with c._db() as second:
+        pass
+    assert first is second
+
+
+def test_stats_flush_pending_counters(tmp_path):
+    c = make(tmp_path)
+    c.set("a", 1)
+    c.get("a")
+    c.get("b")
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"], stats["sets"]) == (1, 1, 1)
+
+
+def test_counters_flush_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "FLUSH_EVERY", 3)
+    c = make(tmp_path)
+    c.set("a", 1)
+    for _ in range(3):
+        c.get("a")
+    with c._db() as conn:
+        assert dict(conn.execute("SELECT name, value FROM stats").fetchall())["hits"] == 3
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    c = make(tmp_path, ttl=0.001)
+    c.set("a", 1)
+    time.sleep(0.01)
+    assert c.get("a") is None
+    assert c.stats()["misses"] == 1
+
+
+def test_size_total_follows_writes(tmp_path):
+    c = DiskCache(str(tmp_path / "cache.db"), 2000, 3600.0)
+    for k in range(30):
+        c.set(f"k{k}", "x" * 100)
+    c.set("k29", "y" * 300)  # substitui: conta a diferença
+    with c._db() as conn:
+        real = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    stats = c.stats()
+    assert stats["bytes"] == real <= 2000
+    assert stats["evictions"] > 0
+
+
+def test_size_total_follows_expirations(tmp_path):
+    c = make(tmp_path, ttl=0.001)
+    c.set("a", "x" * 100)
+    time.sleep(0.01)
+    c.set("b", 1)
+    stats = c.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 1 and stats["bytes"] == 1
+
+
+def _lookup_and_exit(db_path: str) -> None:
+    # como page_cache num processo do pool: global do módulo, vivo até à saída
+    global worker_cache
+    worker_cache = DiskCache(db_path, 1 << 20, 3600.0)
+    worker_cache.get("a")
+    worker_cache.get("b")
+
+
+def test_pending_counters_flush_when_worker_process_exits(tmp_path):
+    import multiprocessing
+
+    c = make(tmp_path)
+    c.set("a", 1)
+    p = multiprocessing.get_context("spawn").Process(target=_lookup_and_exit, args=(c.db_path,))
+    p.start()
+    p.join(30)
+    assert p.exitcode == 0
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
@@ -0,0 +1,86 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "payloads"), max_attempts=2, lease_seconds=60)
+    s.init()
+    return s
+
+
+def submit(store, tmp_path, name="a.pdf") -> str:
+    src = tmp_path / name
+    src.write_bytes(b"%PDF-")
+    return store.submit_file(name, 1, str(src))
+
+
+def age(store, job_id, seconds):
+    # simula o tempo a passar sem heartbeat
+    with store._db() as conn:
+        conn.execute("UPDATE jobs SET updated_at = updated_at - ?, lease_until = lease_until - ? WHERE id = ?",
+                     (seconds, seconds, job_id))
+
+
+def test_live_job_is_not_requeued(store, tmp_path):
+    job_id = submit(store, tmp_path)
+    store.claim("w1")
+    with store._db() as conn:  # etapa longa: nada escrito há muito tempo, mas a concessão está em dia
+        conn.execute("UPDATE jobs SET updated_at = updated_at - 3600 WHERE id = ?", (job_id,))
+    assert store.requeue_stale() == 0
+    assert store.get(job_id)["owner"] == "w1"
+
+
+def test_expired_lease_is_requeued_and_old_owner_cannot_finish(store, tmp_path):
+    job_id = submit(store, tmp_path)
+    store.claim("w1")
+    age(store, job_id, 120)
+    assert store.requeue_stale() == 1
+    assert store.claim("w2")["id"] == job_id
+    assert store.heartbeat(job_id, "w1") is False
+    assert store.complete(job_id, {"ok": 1}, "w1") is False
+    assert store.complete(job_id, {"ok": 2}, "w2") is True
+    assert store.get(job_id)["result"] == {"ok": 2}
+
+
+def test_heartbeat_extends_lease(store, tmp_path):
+    job_id = submit(store, tmp_path)
+    store.claim("w1")
+    age(store, job_id, 120)
+    assert store.heartbeat(job_id, "w1") is True
+    assert store.requeue_stale() == 0
+
+
+def test_retry_consumes_attempts(store, tmp_path):
+    job_id = submit(store, tmp_path)
+    store.claim("w1")
+    assert store.retry(job_id, "w1", "Worker de OCR reiniciado.") == "queued"
+    assert store.claim("w1")["attempts"] == 2
+    assert store.retry(job_id, "w1", "Worker de OCR reiniciado.") == "failed"
+    job = store.get(job_id)
+    assert job["status"] == "failed" and "reiniciado" in job["error"]
+
+
+def test_init_migrates_old_schema(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, progress TEXT NOT NULL DEFAULT '{}',"
+        " filename TEXT NOT NULL, company_id INTEGER NOT NULL, payload_path TEXT, result TEXT, error TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+        " started_at REAL, finished_at REAL);"
+        "INSERT INTO jobs (id, status, filename, company_id, attempts, created_at, updated_at)"
+        " VALUES ('old', 'running', 'a.pdf', 1, 1, 0, 0);"
+    )
+    conn.close()
+    store = JobStore(path, str(tmp_path / "payloads"), lease_seconds=60)
+    store.init()
+    assert store.requeue_stale() == 1
+    assert store.get("old")["status"] == "queued"
@@ -0,0 +1,135 @@
+import os
+import sys
+
+import cv2
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import layout  # noqa: E402
+
+# A4 a 200 dpi (OCR_DPI por omissão), como as páginas que chegam ao filtro pré-OCR
+OCR_DPI = 200
+W, H = 1654, 2339
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    # o mesmo que app.preprocess_image para imagens em cinzento
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def blank_page() -> np.ndarray:
+    return np.full((H, W), 255, dtype=np.uint8)
+
+
+def write(img: np.ndarray, y: int, lines, scale: float = 0.9) -> int:
+    for line in lines:
+        cv2.putText(img, line, (140, y), FONT, scale, 0, 2, cv2.LINE_AA)
+        y += int(48 * scale)
+    return y
+
+
+def invoice_page(rows) -> np.ndarray:
+    img = blank_page()
+    y = write(img, 200, ["COMERCIAL KWANZA, LDA", "NIF: 5417000123", "FACTURA FT A2024/1234"], 1.1)
+    write(img, y + 40, [f"ARROZ AGULHA 25KG   {q}   {q * 1234},00   14%" for q in rows])
+    return img
+
+
+def totals_page() -> np.ndarray:
+    img = blank_page()
+    write(img, 1900, ["TOTAL LIQUIDO: 1.234.567,89", "TOTAL IMPOSTOS: 172.839,50", "TOTAL (KZ): 1.407.407,39"])
+    return img
+
+
+def render_pdf_page(lines, y: float = 700, fontsize: float = 10) -> np.ndarray:
+    # uma página A4 de PDF rasterizada como em app.render_gray
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for k, line in enumerate(lines):
+        page.insert_text((72, y + k * 14), line, fontsize=fontsize)
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width].copy()
+
+
+def rescan(gray: np.ndarray, dx: int = 9, dy: int = -6, noise: float = 12, seed: int = 0) -> np.ndarray:
+    # a mesma folha digitalizada de novo: deslocada e com ruído do sensor
+    moved = cv2.warpAffine(gray, np.float32([[1, 0, dx], [0, 1, dy]]), (gray.shape[1], gray.shape[0]),
+                           borderValue=255)
+    noisy = moved.astype(np.int16) + np.random.default_rng(seed).normal(0, noise, moved.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def classify(gray: np.ndarray):
+    # OCR_BLANK_MAX_INK e OCR_SEPARATOR_MAX_COMPONENTS por omissão
+    return layout.classify_blank_or_separator(gray, binarize(gray), 0.00005, 12)
+
+
+def test_blank_page_is_blank():
+    assert classify(blank_page()) == "em_branco"
+
+
+def test_scanned_blank_page_with_specks_is_blank():
+    img = blank_page()
+    for x, y in ((400, 500), (900, 1200), (1300, 2000)):
+        cv2.circle(img, (x, y), 2, 0, -1)
+    assert classify(img) == "em_branco"
+
+
+def test_scanned_blank_page_with_paper_noise_is_blank():
+    noisy = 235 + np.random.default_rng(1).normal(0, 3, (H, W))
+    assert classify(noisy.clip(0, 255).astype(np.uint8)) == "em_branco"
+
+
+def test_totals_only_page_is_not_blank():
+    assert classify(totals_page()) is None
+
+
+def test_pdf_page_with_only_totals_is_not_blank():
+    lines = ["TOTAL LIQUIDO: 1.234.567,89", "TOTAL IMPOSTOS: 172.839,50", "TOTAL (KZ): 1.407.407,39"]
+    assert classify(render_pdf_page(lines)) is None
+    assert classify(render_pdf_page(lines[-1:])) is None
+
+
+def test_pdf_page_with_one_short_line_is_not_blank():
+    for line in ("Pagina 3/3", "Assinatura"):
+        assert classify(render_pdf_page([line], y=800)) is None
+
+
+def test_patch_code_is_separator():
+    img = blank_page()
+    cv2.rectangle(img, (500, 900), (1100, 1500), 0, -1)
+    cv2.rectangle(img, (500, 1600), (560, 1700), 0, -1)
+    assert classify(img) == "separador"
+
+
+def is_duplicate(a: np.ndarray, b: np.ndarray) -> bool:
+    # OCR_DUP_MAX_HAMMING por omissão
+    distance = layout.hash_distance(layout.page_hash(binarize(a)), layout.page_hash(binarize(b)))
+    return distance is not None and distance <= 12
+
+
+def test_continuation_page_is_not_duplicate():
+    pages = [invoice_page(range(k * 28 + 1, (k + 1) * 28 + 1)) for k in range(4)]
+    assert not any(is_duplicate(a, b) for n, a in enumerate(pages) for b in pages[n + 1:])
+
+
+def test_repeated_page_is_duplicate():
+    page = invoice_page(range(1, 29))
+    assert is_duplicate(page, page.copy())
+
+
+def test_rescanned_page_is_duplicate():
+    page = invoice_page(range(1, 29))
+    assert is_duplicate(page, rescan(page))
+    assert not is_duplicate(invoice_page(range(29, 57)), rescan(page))
+
+
+def test_rescanned_pdf_page_is_duplicate():
+    rows = [f"ARROZ AGULHA 25KG   {q}   {q * 1234},00   14%" for q in range(1, 57)]
+    first, second = render_pdf_page(rows[:28], y=120), render_pdf_page(rows[28:], y=120)
+    assert is_duplicate(first, rescan(first, dx=-15, dy=10, seed=2))
+    assert not is_duplicate(first, second)
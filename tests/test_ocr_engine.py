@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr_engine  # noqa: E402
+
+
+class RecordingAPI:
+    """
+    O que _TessHandle.set_image usa do PyTessBaseAPI; com bytes_only imita as versões
+    do tesserocr que só aceitam bytes.
+    """
+
+    def __init__(self, bytes_only: bool = False):
+        self.bytes_only = bytes_only
+        self.calls = []
+
+    def SetImageBytes(self, data, w, h, bpp, bpl):
+        if self.bytes_only and not isinstance(data, bytes):
+            raise TypeError("expected bytes")
+        self.calls.append((data, w, h, bpp, bpl))
+
+
+def handle(api) -> "ocr_engine._TessHandle":
+    h = ocr_engine._TessHandle.__new__(ocr_engine._TessHandle)
+    h.api = api
+    return h
+
+
+def test_set_image_passes_numpy_buffer_without_copy(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "_image_buffers", True)
+    img = np.zeros((40, 60), dtype=np.uint8)
+    api = RecordingAPI()
+    handle(api).set_image(img)
+    data, w, h, bpp, bpl = api.calls[0]
+    assert isinstance(data, memoryview) and np.shares_memory(np.asarray(data), img)
+    assert (w, h, bpp, bpl) == (60, 40, 1, 60)
+
+
+def test_set_image_falls_back_to_bytes(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "_image_buffers", True)
+    img = np.zeros((40, 60), dtype=np.uint8)
+    api = RecordingAPI(bytes_only=True)
+    handle(api).set_image(img)
+    assert isinstance(api.calls[0][0], bytes)
+    assert ocr_engine._image_buffers is False
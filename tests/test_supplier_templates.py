@@ -0,0 +1,92 @@
+import os
+import re
+import sys
+import unicodedata
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supplier_templates import TemplateRegistry  # noqa: E402
+
+SUPPLIER_NIF = "5417000123"
+CUSTOMER_NIF = "5000111222"
+
+
+def canon(s: str) -> str:
+    # como app.canon
+    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn").upper()
+
+
+def to_float(s: str) -> float:
+    # formato das faturas: 1.234,56
+    return float(re.sub(r"[^\d,\-]", "", s.replace(".", "")).replace(",", ".") or 0)
+
+
+def invoice(number: int, supplier_nif: str = SUPPLIER_NIF) -> str:
+    return "\n".join([
+        f"CLIENTE: HOTEL PANORAMA NIF: {CUSTOMER_NIF}",
+        f"COMERCIAL KWANZA, LDA NIF: {supplier_nif}",
+        f"FACTURA N: FT A2024/{number}",
+        "DATA DE EMISSAO: 12-03-2024",
+        "DESCRICAO QTD PRECO TOTAL",
+        "ARROZ AGULHA 25KG 2 1.000,00 2.000,00",
+        "OLEO ALIMENTAR 5L 3 500,00 1.500,00",
+        "TOTAL LIQUIDO: 3.500,00",
+        "TOTAL (KZ): 3.990,00",
+    ])
+
+
+def validated(number: int, nif=SUPPLIER_NIF):
+    return {
+        "supplier_name": "COMERCIAL KWANZA, LDA", "nif": nif,
+        "invoice_number": f"FT A2024/{number}", "data_emissao": "12-03-2024",
+        "items": [
+            {"descricao": "ARROZ AGULHA 25KG", "quantidade": 2, "preco_unitario": 1000.0, "taxa_iva_percentagem": 14.0},
+            {"descricao": "OLEO ALIMENTAR 5L", "quantidade": 3, "preco_unitario": 500.0, "taxa_iva_percentagem": 14.0},
+        ],
+    }
+
+
+TOTALS = {"total_com_iva": 3990.0, "total_iva": 490.0, "taxa_padrao": 14.0}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return TemplateRegistry(str(tmp_path / "tpl.db"), to_float, canon)
+
+
+def test_learn_keys_on_supplier_nif(registry):
+    assert registry.learn(invoice(1), validated(1)) == f"nif:{SUPPLIER_NIF}"
+
+
+def test_learn_requires_supplier_nif(registry):
+    assert registry.learn(invoice(1), validated(1, nif=None)) is None
+    assert registry.stats()["templates"] == 0
+
+
+def test_learn_rejects_nif_not_in_text(registry):
+    assert registry.learn(invoice(1), validated(1, nif="5999999999")) is None
+
+
+def test_fast_path_accepts_same_supplier(registry):
+    registry.learn(invoice(1), validated(1))
+    match = registry.match(invoice(2), TOTALS)
+    assert match is not None
+    assert match["data"]["nif"] == SUPPLIER_NIF
+    assert match["data"]["invoice_number"] == "FT A2024/2"
+
+
+def test_fast_path_requires_template_nif_in_text(registry):
+    registry.learn(invoice(1), validated(1))
+    # mesmo cliente e mesmo layout, outro fornecedor
+    assert registry.match(invoice(2, supplier_nif="5401234567"), TOTALS) is None
+    stats = registry.stats()
+    assert stats["hits"] == 0 and stats["misses"] == 1
+
+
+def test_apply_rejects_document_without_template_nif(registry):
+    registry.learn(invoice(1), validated(1))
+    template = registry._load(f"nif:{SUPPLIER_NIF}")
+    other = invoice(2, supplier_nif="5401234567")
+    assert registry._apply(canon(other), other, template, TOTALS) is None
@@ -0,0 +1,135 @@
+import re
+from bisect import bisect_left
+from typing import Optional, Dict, List, Tuple, Callable
+
+# =========================
+# Scanner de totais/IVA do rodapé (passagem única)
+# =========================
+# Em vez de um re.search por rótulo (e do padrão INCIDÊNCIA com cadeias .*? em
+# DOTALL, que retrocede muito em textos longos), o texto canónico é percorrido
+# uma só vez à procura das palavras-âncora (TOTAL, VALOR, IVA, IMPOSTO,
+# INCIDENCIA, TAXA). Em cada âncora só se testam, ancorados nessa posição, os
+# rótulos que começam por ela. O resultado é o mesmo do encadeado de re.search:
+# para cada grupo vence o primeiro rótulo da lista que aparece no texto, na sua
+# primeira ocorrência.
+
+FLAGS = re.IGNORECASE
+AMOUNT = r'\s*[:\-]?\s*([0-9\.\,\s]+)'
+NUM_RUN = re.compile(r'[0-9\.\,\s]+', FLAGS)
+
+# (grupo, âncora, rótulo); a ordem dentro de cada grupo é a prioridade
+LABELS: List[Tuple[str, str, str]] = [
+    ("total_com_iva", "TOTAL", r'TOTAL\s*\(KZ\)'),
+    ("total_com_iva", "TOTAL", r'TOTAL\s+GERAL'),
+    ("total_com_iva", "TOTAL", r'TOTAL\s+A\s+PAGAR'),
+    ("total_com_iva", "TOTAL", r'TOTAL\s+A\s+LIQUIDAR'),
+    ("total_com_iva", "TOTAL", r'TOTAL\s+PAGO'),
+    ("total_com_iva", "VALOR", r'VALOR\s+A\s+PAGAR'),
+    ("total_com_iva", "VALOR", r'VALOR\s+PAGO'),
+    ("total_iva", "TOTAL", r'TOTAL\s+IMPOSTOS'),
+    ("total_iva", "TOTAL", r'TOTAL\s+IVA'),
+    ("total_iva", "IVA", r'IVA\b'),
+    ("total_iva", "IMPOSTO", r'IMPOSTOS\b'),
+    ("total_iva", "IMPOSTO", r'IMPOSTO\b'),
+    ("total_liquido", "TOTAL", r'TOTAL\s+LIQUIDO'),
+]
+
+ANCHORS = ("TOTAL", "VALOR", "IVA", "IMPOSTO", "INCIDENCIA", "TAXA")
+# lookahead: as âncoras podem sobrepor-se (ex.: "IMPOSTOTAL"), todas são vistas
+ANCHOR_RE = re.compile(r'(?=(' + "|".join(ANCHORS) + r'))', FLAGS)
+
+LABEL_RES: List["re.Pattern[str]"] = [re.compile(label + AMOUNT, FLAGS) for _, _, label in LABELS]
+LABELS_BY_ANCHOR: Dict[str, List[int]] = {
+    anchor: [i for i, (_, a, _) in enumerate(LABELS) if a == anchor] for anchor in ANCHORS
+}
+
+# Tabela "INCIDENCIA ... TAXA% ... VALOR"
+TAXA_RE = re.compile(r'TAXA\s*%?\s*[:\-]?\s*([0-9]{1,2})', FLAGS)
+KEYWORD_RE = re.compile(r'VALOR|IMPOSTOS', FLAGS)
+
+
+def scan(t: str) -> Tuple[List[Optional[str]], Optional[Tuple[str, str, str]]]:
+    """
+    Percorre o texto canónico uma vez. Devolve o valor (texto) da 1.ª ocorrência
+    de cada rótulo de LABELS e os três grupos da tabela de incidência, se existir.
+    """
+    first: List[Optional[str]] = [None] * len(LABEL_RES)
+    incidencia: Optional[int] = None
+    taxas: List["re.Match[str]"] = []
+    keywords: List[int] = []
+
+    for m in ANCHOR_RE.finditer(t):
+        anchor = m.group(1).upper()
+        pos = m.start()
+        for i in LABELS_BY_ANCHOR[anchor]:
+            if first[i] is None:
+                lm = LABEL_RES[i].match(t, pos)
+                if lm:
+                    first[i] = lm.group(1)
+        if anchor == "INCIDENCIA":
+            if incidencia is None:
+                incidencia = m.end(1)
+        elif anchor == "TAXA":
+            tm = TAXA_RE.match(t, pos)
+            if tm:
+                taxas.append(tm)
+        elif anchor == "VALOR" or (anchor == "IMPOSTO" and KEYWORD_RE.match(t, pos)):
+            keywords.append(pos)
+
+    return first, _resolve_incidencia(t, incidencia, taxas, keywords)
+
+
+def _resolve_incidencia(t: str, start: Optional[int], taxas: List["re.Match[str]"],
+                        keywords: List[int]) -> Optional[Tuple[str, str, str]]:
+    """
+    Equivale ao padrão INCID[ÊE]NCIA.*?(num).*?TAXA...(nn).*?(VALOR|IMPOSTOS).*?(num):
+    cada grupo é a primeira ocorrência a seguir ao anterior, e se a 1.ª INCIDENCIA
+    não fecha a cadeia, nenhuma das seguintes fecha.
+    """
+    if start is None:
+        return None
+    base = NUM_RUN.search(t, start)
+    if base is None:
+        return None
+    taxa_starts = [tm.start() for tm in taxas]
+    k = bisect_left(taxa_starts, base.end())
+    if k == len(taxas):
+        return None
+    taxa = taxas[k]
+    k = bisect_left(keywords, taxa.end(1))
+    if k == len(keywords):
+        return None
+    kw = KEYWORD_RE.match(t, keywords[k])
+    valor = NUM_RUN.search(t, kw.end())
+    if valor is None:
+        return None
+    return base.group(), taxa.group(1), valor.group()
+
+
+def extract_totals(t: str, parse_number: Callable[[str], float]) -> Dict[str, Optional[float]]:
+    """
+    Mesma saída de extract_totals_from_text; t já deve vir canónico (canon()).
+    """
+    out: Dict[str, Optional[float]] = {"total_com_iva": None, "total_iva": None, "total_liquido": None, "taxa_padrao": None}
+    first, incidencia = scan(t)
+
+    for (group, _, _), raw in zip(LABELS, first):
+        if raw is not None and out[group] is None:
+            out[group] = parse_number(raw)
+
+    if incidencia is not None:
+        base = parse_number(incidencia[0])
+        taxa = float(incidencia[1])
+        val_iva = parse_number(incidencia[2])
+        # confere coerência básica
+        if base > 0 and val_iva > 0:
+            out["taxa_padrao"] = taxa
+            out["total_liquido"] = out["total_liquido"] or base
+            out["total_iva"] = out["total_iva"] or val_iva
+            out["total_com_iva"] = out["total_com_iva"] or round(base + val_iva, 2)
+
+    # Se não achou "TOTAL (KZ)" mas tem liquido + impostos, soma
+    if out["total_com_iva"] is None and (out["total_liquido"] is not None and out["total_iva"] is not None):
+        out["total_com_iva"] = round(out["total_liquido"] + out["total_iva"], 2)
+
+    return out
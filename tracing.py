@@ -0,0 +1,285 @@
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterator
+
+# =========================
+# Tracing por pedido (spans) e logs estruturados
+# =========================
+# Cada pedido tem um request id (X-Request-ID recebido ou gerado; nos jobs, o id
+# do job) que é também o trace id. span() abre um intervalo filho do span atual
+# (contextvars: segue para as tarefas asyncio e para asyncio.to_thread). As etapas
+# que correm no pool de processos devolvem início/duração no resultado da página e
+# entram no trace com add_span(). Quando o span raiz fecha, os spans do pedido vão
+# de uma vez para o exportador, numa thread própria (nunca bloqueia o event loop).
+#
+# Exportadores (configure_tracer): "jsonl" (uma linha JSON por span num ficheiro),
+# "otlp" (OTLP/HTTP JSON, ex.: para um OpenTelemetry Collector) ou "none".
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_current: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("span", default=None)
+# spans já fechados do pedido atual (lista partilhada por todos os spans do trace)
+_finished: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("spans", default=None)
+
+
+def new_id(nbytes: int = 8) -> str:
+    return uuid.uuid4().hex[:nbytes * 2]
+
+
+def request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def bind_request_id(rid: str) -> contextvars.Token:
+    return _request_id.set(rid)
+
+
+def unbind_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+def normalize_request_id(value: Optional[str]) -> str:
+    """
+    Aceita o X-Request-ID do cliente se for um id de trace válido (32 hex); senão gera um.
+    """
+    if value:
+        v = value.strip().lower().replace("-", "")
+        if len(v) == 32 and all(c in "0123456789abcdef" for c in v):
+            return v
+    return uuid.uuid4().hex
+
+
+# =========================
+# Exportadores
+# =========================
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps(s, ensure_ascii=False) + "\n")
+
+
+class OtlpHttpExporter:
+    """
+    OTLP/HTTP com corpo JSON (ex.: http://localhost:4318/v1/traces do OpenTelemetry Collector).
+    """
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _value(v: Any) -> Dict[str, Any]:
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": str(v)}
+
+    def _span(self, s: Dict[str, Any]) -> Dict[str, Any]:
+        out = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(int(s["start"] * 1e9)),
+            "endTimeUnixNano": str(int((s["start"] + s["duration"]) * 1e9)),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in s["attributes"].items()],
+            "status": {"code": 2 if s["status"] == "error" else 1},
+        }
+        if s["parent_id"]:
+            out["parentSpanId"] = s["parent_id"]
+        return out
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "ocr"}, "spans": [self._span(s) for s in spans]}],
+        }]}
+        req = urllib.request.Request(self.endpoint, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class NullExporter:
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        return None
+
+
+class Tracer:
+    def __init__(self, exporter: Any, max_queue: int = 1000):
+        self.exporter = exporter
+        self.dropped = 0
+        self._queue: "queue.Queue[List[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _worker(self) -> None:
+        log = logging.getLogger("ocr.tracing")
+        while True:
+            spans = self._queue.get()
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                log.warning("falha ao exportar %d spans: %s", len(spans), e)
+
+    def submit(self, spans: List[Dict[str, Any]]) -> None:
+        if isinstance(self.exporter, NullExporter) or not spans:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="trace-export", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+
+def make_exporter(kind: str, path: str, otlp_endpoint: str, service_name: str) -> Any:
+    if kind == "otlp":
+        return OtlpHttpExporter(otlp_endpoint, service_name)
+    if kind == "none":
+        return NullExporter()
+    return JsonlExporter(path)
+
+
+tracer = Tracer(NullExporter())
+
+
+def configure_tracer(kind: str, path: str, otlp_endpoint: str, service_name: str) -> None:
+    tracer.exporter = make_exporter(kind.lower(), path, otlp_endpoint, service_name)
+
+
+# =========================
+# Spans
+# =========================
+def _finish(span: Dict[str, Any], status: str) -> None:
+    span["duration"] = round(time.time() - span["start"], 6)
+    span["status"] = status
+    spans = _finished.get()
+    if spans is not None:
+        spans.append(span)
+
+
+@contextmanager
+def trace(name: str, rid: Optional[str] = None, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Span raiz de um pedido: define o request id e exporta todos os spans do pedido no fim.
+    """
+    rid = rid or _request_id.get() or uuid.uuid4().hex
+    spans: List[Dict[str, Any]] = []
+    root = {"trace_id": rid, "span_id": new_id(), "parent_id": None, "name": name,
+            "start": time.time(), "attributes": dict(attributes)}
+    tokens = (_request_id.set(rid), _current.set(root), _finished.set(spans))
+    status = "ok"
+    try:
+        yield root
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _finish(root, status)
+        _finished.reset(tokens[2])
+        _current.reset(tokens[1])
+        _request_id.reset(tokens[0])
+        tracer.submit(spans)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Span filho do atual. Fora de um trace não regista nada.
+    """
+    parent = _current.get()
+    if parent is None:
+        yield {"attributes": attributes}
+        return
+    s = {"trace_id": parent["trace_id"], "span_id": new_id(), "parent_id": parent["span_id"],
+         "name": name, "start": time.time(), "attributes": dict(attributes)}
+    token = _current.set(s)
+    status = "ok"
+    try:
+        yield s
+    except BaseException as e:
+        status = "error"
+        s["attributes"]["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        _finish(s, status)
+
+
+def add_span(name: str, start: float, duration: float, parent: Optional[Dict[str, Any]] = None,
+             **attributes: Any) -> Optional[Dict[str, Any]]:
+    """
+    Span já terminado (ex.: etapa medida noutro processo), filho de `parent` ou do span atual.
+    """
+    parent = parent or _current.get()
+    spans = _finished.get()
+    if parent is None or spans is None:
+        return None
+    s = {"trace_id": parent["trace_id"], "span_id": new_id(), "parent_id": parent["span_id"],
+         "name": name, "start": start, "duration": round(duration, 6), "status": "ok",
+         "attributes": attributes}
+    spans.append(s)
+    return s
+
+
+# =========================
+# Logs estruturados
+# =========================
+class JsonFormatter(logging.Formatter):
+    """
+    Uma linha JSON por registo, com o request id do contexto e os campos de `extra`.
+    """
+    _STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            out["request_id"] = rid
+        for k, v in vars(record).items():
+            if k not in self._STANDARD and k != "request_id":
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+def configure_logging(level: str = "INFO", fmt: str = "json") -> None:
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    root = logging.getLogger("ocr")
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    root.propagate = False